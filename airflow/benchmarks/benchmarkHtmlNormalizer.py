@@ -0,0 +1,205 @@
+'''
+Benchmark the lxml email body normalizer against the BeautifulSoup implementation.
+
+Usage (from airflow/dags so the services package resolves):
+
+    python ../benchmarks/benchmarkHtmlNormalizer.py --corpus /path/to/bodies [--repeat 3]
+
+The corpus is a directory (searched recursively) or a single file:
+    - *.html / *.htm files are used as bodies directly
+    - *.json files are Graph message dumps: a list of messages or a {"value": [...]}
+      page; every HTML "body.content" inside is used
+
+Without --corpus, a synthetic set of newsletter-style bodies is generated so the
+script still runs; use an exported mailbox for numbers worth quoting.
+
+The lxml side is timed through normalize_body(), so bodies it hands to html.parser
+(see ReferenceParserRequired) are included in its time. PARITY_CASES, markup the two
+parsers read differently, are checked on every run; the exit code is 1 on any mismatch.
+'''
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import difflib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dags"))
+
+from services.htmlNormalizer import extract_text_and_links, clean_text, decode_content, normalize_body
+
+
+# Bodies libxml2 and html.parser read differently; normalize_body() must still match the reference on each
+PARITY_CASES = [
+    "<div>x</div></body></html>after",
+    "<html><body>a</body></html><div>post</div>",
+    "<p>a<b>b</p>c</b>d",
+    "<p>x<![CDATA[cdata text]]>y</p>",
+    "<textarea><b>raw</b> t</textarea>",
+    "<title><b>t</b></title><p>a</p>",
+    "a</br>b",
+    "<p>a</span>b</p>",
+    "<h1>x</h2>y",
+    "<p>x</p></html >y",
+    "word<body>x",
+    "a<!DOCTYPE html>b",
+    "<a href=\"x\">l<a href=\"y\">m</a></a>",
+    "<a href=\"h\">x<th>y",
+    "a&foo;b",
+    "<p>a\x00b</p>",
+    "text <w2",
+    "<html><head><title>T</title></head><body><p>a &amp; b</p><!-- c --><p>c&nbsp;d</p></body></html>",
+]
+
+
+# Function to pull HTML bodies out of Graph message JSON
+def collect_json_bodies(data):
+    if isinstance(data, dict):
+        messages = data.get("value", [data])
+    else:
+        messages = data
+
+    bodies = []
+    for message in messages:
+        if not isinstance(message, dict):
+            continue
+
+        body = message.get("body")
+        if isinstance(body, dict) and body.get("contentType", "html").lower() == "html" and body.get("content"):
+            bodies.append(body["content"])
+
+    return bodies
+
+
+# Function to load the benchmark corpus from a file or directory
+def load_corpus(path):
+    paths = []
+    if os.path.isdir(path):
+        for root, _, files in os.walk(path):
+            paths.extend(os.path.join(root, file) for file in sorted(files))
+    else:
+        paths.append(path)
+
+    bodies = []
+    for file_path in paths:
+        extension = os.path.splitext(file_path)[1].lower()
+
+        if extension in (".html", ".htm"):
+            with open(file_path, "r", encoding="utf-8", errors="replace") as file:
+                bodies.append(file.read())
+
+        elif extension == ".json":
+            with open(file_path, "r", encoding="utf-8") as file:
+                bodies.extend(collect_json_bodies(json.load(file)))
+
+    return bodies
+
+
+# Function to build newsletter-like HTML when no real corpus is available
+def generate_corpus(count, seed=42):
+    rng = random.Random(seed)
+    words = ["update", "offer", "meeting", "invoice", "Café", "naïve", "résumé", "schedule", "report", "“quoted”", "—", "team", "日本", "launch"]
+
+    bodies = []
+    for index in range(count):
+        rows = []
+        for row in range(rng.randint(5, 60)):
+            text = " ".join(rng.choice(words) for _ in range(rng.randint(3, 25)))
+            link = f'<a href="https://example.com/track?id={index}-{row}" originalsrc="https://example.com/{row}"><span style="color:#333">{rng.choice(words)}</span></a>'
+            rows.append(f'<tr><td class="c{row}" style="padding:4px;font-family:Arial">{text} {link}&nbsp;</td></tr>')
+
+        bodies.append(
+            "<html><head><meta charset=\"utf-8\"><style>td{font-size:12px}</style></head><body>"
+            "<!--[if mso]><table><tr><td><![endif]-->"
+            f"<table width=\"600\">{''.join(rows)}</table>"
+            "<!--[if mso]></td></tr></table><![endif]-->"
+            "<p>Unsubscribe <a href=\"https://example.com/u\">here</a></p></body></html>"
+        )
+
+    return bodies
+
+
+def reference_normalize(html_content):
+    return clean_text(decode_content(extract_text_and_links(html_content)))
+
+
+def fast_normalize(html_content):
+    return normalize_body({"contentType": "html", "content": html_content})[0]
+
+
+# Function to check the parity cases, returning the ones where the outputs differ
+def check_parity_cases():
+    return [
+        (case, reference_normalize(case), fast_normalize(case))
+        for case in PARITY_CASES
+        if reference_normalize(case) != fast_normalize(case)
+    ]
+
+
+# Function to time a normalizer over the corpus, keeping the best of several runs
+def time_normalizer(normalizer, bodies, repeat):
+    best = None
+    outputs = None
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        outputs = [normalizer(body) for body in bodies]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the lxml and BeautifulSoup email body normalizers")
+    parser.add_argument("--corpus", help="Directory or file with HTML bodies / Graph message JSON")
+    parser.add_argument("--synthetic", type=int, default=200, help="Number of generated bodies when --corpus is not given")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per implementation (best is reported)")
+    parser.add_argument("--show-diffs", type=int, default=3, help="Number of mismatching bodies to print")
+    args = parser.parse_args()
+
+    if args.corpus:
+        bodies = load_corpus(args.corpus)
+        source = args.corpus
+    else:
+        bodies = generate_corpus(args.synthetic)
+        source = f"synthetic ({args.synthetic} bodies)"
+
+    if not bodies:
+        print(f"No HTML bodies found in {source}")
+        return 1
+
+    total_bytes = sum(len(body.encode("utf-8", errors="replace")) for body in bodies)
+    print(f"Corpus: {source} - {len(bodies)} bodies, {total_bytes / 1024 / 1024:.2f} MB")
+
+    reference_time, reference_outputs = time_normalizer(reference_normalize, bodies, args.repeat)
+    fast_time, fast_outputs = time_normalizer(fast_normalize, bodies, args.repeat)
+    fallbacks = sum(1 for body in bodies if normalize_body({"contentType": "html", "content": body})[1])
+
+    mismatches = [index for index, (expected, actual) in enumerate(zip(reference_outputs, fast_outputs)) if expected != actual]
+
+    for label, elapsed in (("BeautifulSoup (html.parser)", reference_time), ("lxml normalizer", fast_time)):
+        print(f"{label:<28} {elapsed:8.3f}s  {elapsed / len(bodies) * 1000:8.3f} ms/body  {total_bytes / 1024 / 1024 / elapsed:8.2f} MB/s")
+
+    print(f"Speedup: {reference_time / fast_time:.1f}x")
+    print(f"Identical output: {len(bodies) - len(mismatches)}/{len(bodies)} ({(len(bodies) - len(mismatches)) / len(bodies):.2%})")
+    print(f"Handed to html.parser: {fallbacks}/{len(bodies)}")
+
+    parity_failures = check_parity_cases()
+    print(f"Parity cases: {len(PARITY_CASES) - len(parity_failures)}/{len(PARITY_CASES)} identical")
+
+    for case, expected, actual in parity_failures:
+        print(f"  {case!r}: html.parser {expected!r}, lxml {actual!r}")
+
+    for index in mismatches[:args.show_diffs]:
+        print(f"\n--- body {index} (html.parser) / +++ (lxml)")
+        diff = difflib.unified_diff(reference_outputs[index].split(" "), fast_outputs[index].split(" "), lineterm="", n=3)
+        print("\n".join(list(diff)[2:40]))
+
+    return 1 if mismatches or parity_failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+'''
+Compare serial and process-pool cleaning in process_email_response().
+
+Usage (from airflow/dags so the services package resolves):
+
+    python ../benchmarks/benchmarkParallelCleaning.py [--workers 8] [--sizes 100 1000 10000] [--corpus /path/to/bodies]
+
+Messages are built from the same corpus options as benchmarkHtmlNormalizer.py
+(synthetic newsletter bodies by default) and cycled up to each size. Pool
+start-up is timed separately, since a task pays it once per run, not per page.
+'''
+
+import os
+import sys
+import time
+import logging
+import argparse
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dags"))
+
+from benchmarkHtmlNormalizer import load_corpus, generate_corpus
+from services.processEmails import process_email_response, get_clean_pool, shutdown_clean_pool
+from services.emailRecord import format_email
+
+
+# Function to wrap HTML bodies into Graph message resources
+def build_messages(bodies, count):
+    return [
+        {
+            "id"            : f"message-{index}",
+            "subject"       : f"Newsletter #{index}",
+            "body"          : {"contentType": "html", "content": bodies[index % len(bodies)]},
+            "sender"        : {"emailAddress": {"name": "Sender", "address": "sender@example.com"}},
+            "toRecipients"  : [{"emailAddress": {"name": "Recipient", "address": "recipient@example.com"}}],
+            "flag"          : {"flagStatus": "notFlagged"}
+        }
+        for index in range(count)
+    ]
+
+
+# Function to time process_email_response() with the given parallel settings
+def time_cleaning(logger, messages, workers, min_parallel):
+    environment = {"EMAIL_CLEAN_WORKERS": str(workers), "EMAIL_CLEAN_MIN_PARALLEL_MESSAGES": str(min_parallel)}
+
+    with mock.patch.dict(os.environ, environment):
+        start = time.perf_counter()
+        records = process_email_response(logger, messages)
+        return time.perf_counter() - start, records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare serial and process-pool email body cleaning")
+    parser.add_argument("--corpus", help="Directory or file with HTML bodies / Graph message JSON")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Pool size for the parallel run")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000], help="Page sizes to compare")
+    args = parser.parse_args()
+
+    logger = logging.getLogger("benchmark")
+    logger.disabled = True
+
+    bodies = load_corpus(args.corpus) if args.corpus else generate_corpus(200)
+    if not bodies:
+        print(f"No HTML bodies found in {args.corpus}")
+        return 1
+
+    start = time.perf_counter()
+    pool = get_clean_pool(args.workers)
+    list(pool.map(format_email, build_messages(bodies, args.workers), chunksize=1))
+    print(f"Pool start-up ({args.workers} workers): {time.perf_counter() - start:.3f}s\n")
+
+    print(f"{'messages':>9} {'serial':>10} {'parallel':>10} {'speedup':>8} {'serial msg/s':>13} {'parallel msg/s':>15}  identical")
+
+    try:
+        for size in args.sizes:
+            messages = build_messages(bodies, size)
+
+            serial_time, serial_records = time_cleaning(logger, messages, workers=0, min_parallel=0)
+            parallel_time, parallel_records = time_cleaning(logger, messages, workers=args.workers, min_parallel=0)
+
+            print(
+                f"{size:>9} {serial_time:>9.3f}s {parallel_time:>9.3f}s {serial_time / parallel_time:>7.1f}x "
+                f"{size / serial_time:>13.0f} {size / parallel_time:>15.0f}  {serial_records == parallel_records}"
+            )
+
+    finally:
+        shutdown_clean_pool()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+'''
+EXPLAIN report for the hot FastAPI queries against the managed index set.
+
+Usage (from airflow/dags so the database package resolves, with the usual DB_* env vars):
+
+    python ../benchmarks/explainHotQueries.py [--analyze] [--no-seqscan]
+
+Runs EXPLAIN on the mailbox listing, email load and category lookup queries
+(copied from fastapi/utils/services.py) and the summary agent thread query
+(THREAD_EMAILS_QUERY, read from fastapi/agents/summary_agent.py so it cannot
+drift), with parameters sampled from the database.
+For each query it prints the indexes the plan uses and any sequential scans.
+
+On small databases the planner rightly prefers sequential scans; --no-seqscan
+sets enable_seqscan = off for the session to show the indexes are usable.
+'''
+
+import os
+import ast
+import sys
+import json
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dags"))
+
+from database.connectDB import get_pooled_connection, release_connection
+from database.migrations import INDEXES
+
+FASTAPI_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "fastapi")
+
+
+# Function to read a module-level SQL string from a FastAPI module without importing it (and its LLM clients)
+def load_fastapi_query(relative_path, name):
+    with open(os.path.join(FASTAPI_DIR, relative_path), "r", encoding="utf-8") as file:
+        tree = ast.parse(file.read())
+
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(isinstance(target, ast.Name) and target.id == name for target in node.targets):
+            return ast.literal_eval(node.value)
+
+    raise LookupError(f"{name} not found in fastapi/{relative_path}")
+
+
+HOT_QUERIES = {
+    "fetch_emails (mailbox listing)": ("""
+        SELECT s.email_address, s.name, r.email_address, r.email_id, e.body_preview, e.subject,
+            e.sent_datetime, e.received_datetime, e.is_read
+        FROM recipients r
+        INNER JOIN emails e ON r.email_id = e.id
+        INNER JOIN senders s ON e.id = s.email_id
+        INNER JOIN email_folders f ON e.parent_folder_id = f.id
+        WHERE r.email_address IN (SELECT email FROM users)
+            AND f.display_name = %(folder_name)s
+        ORDER BY e.received_datetime DESC
+        LIMIT 10;
+    """, "folder_name"),
+
+    "load_email": ("""
+        SELECT s.email_address, r.name, e.subject, e.received_datetime, e.body, a.name
+        FROM emails e
+        INNER JOIN senders s ON e.id = s.email_id
+        INNER JOIN recipients r ON e.id = r.email_id
+        LEFT JOIN attachments a ON e.id = a.email_id AND e.has_attachments = TRUE
+        WHERE e.id = %(email_id)s;
+    """, "email_id"),
+
+    "get_email_category": ("""
+        SELECT c.category
+        FROM categories c
+        WHERE c.email_id = %(email_id)s
+        LIMIT 3;
+    """, "email_id"),
+
+    "summary_agent thread": (load_fastapi_query(os.path.join("agents", "summary_agent.py"), "THREAD_EMAILS_QUERY"), "conversation_id"),
+}
+
+SAMPLE_QUERIES = {
+    "folder_name"     : "SELECT display_name FROM email_folders ORDER BY total_item_count DESC NULLS LAST LIMIT 1",
+    "email_id"        : "SELECT email_id FROM categories LIMIT 1",
+    "conversation_id" : "SELECT conversation_id FROM emails WHERE conversation_id IS NOT NULL GROUP BY conversation_id ORDER BY COUNT(*) DESC LIMIT 1",
+}
+
+
+# Function to walk a JSON plan and collect (node type, relation, index) for every scan
+def collect_scans(plan, scans):
+    node_type = plan.get("Node Type", "")
+
+    if "Scan" in node_type:
+        scans.append((node_type, plan.get("Relation Name"), plan.get("Index Name")))
+
+    for child in plan.get("Plans", []):
+        collect_scans(child, scans)
+
+    return scans
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show which indexes the hot FastAPI queries use")
+    parser.add_argument("--analyze", action="store_true", help="Run EXPLAIN ANALYZE (executes the queries)")
+    parser.add_argument("--no-seqscan", action="store_true", help="SET enable_seqscan = off for the session")
+    args = parser.parse_args()
+
+    conn = get_pooled_connection()
+    if not conn:
+        print("Failed to connect to the database")
+        return 1
+
+    exit_code = 0
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema()")
+            present = {row[0] for row in cursor.fetchall()}
+            missing = sorted(set(INDEXES) - present)
+            print(f"Managed indexes present: {len(INDEXES) - len(missing)}/{len(INDEXES)}" + (f" (missing: {', '.join(missing)})" if missing else ""))
+
+            if args.no_seqscan:
+                cursor.execute("SET enable_seqscan = off")
+
+            params = {}
+            for name, sample_query in SAMPLE_QUERIES.items():
+                cursor.execute(sample_query)
+                row = cursor.fetchone()
+                params[name] = row[0] if row else ""
+
+            explain = "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " if args.analyze else "EXPLAIN (FORMAT JSON) "
+
+            for label, (query, param) in HOT_QUERIES.items():
+                cursor.execute(explain + query, {param: params[param]})
+                result = cursor.fetchone()[0]
+                plan = (json.loads(result) if isinstance(result, str) else result)[0]
+
+                scans = collect_scans(plan["Plan"], [])
+                used = sorted({index for _, _, index in scans if index})
+                seq_scans = sorted({relation for node_type, relation, _ in scans if node_type == "Seq Scan"})
+
+                timing = f", {plan['Execution Time']:.2f} ms" if "Execution Time" in plan else ""
+                print(f"\n{label} ({param} = {params[param]!r}{timing})")
+                print(f"  indexes used : {', '.join(used) or '-'}")
+                print(f"  seq scans    : {', '.join(seq_scans) or '-'}")
+
+                if seq_scans and args.no_seqscan:
+                    exit_code = 2
+
+    finally:
+        conn.rollback()
+        release_connection(conn)
+
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,27 @@
 import os
 import time
-import psycopg2
-from psycopg2 import sql, Error
+import threading
+from contextlib import contextmanager
+from psycopg2 import Error
+from psycopg2.pool import ThreadedConnectionPool
 
 from services.logger import start_logger
 
 logger = start_logger()
 
-# Function to create connection to PostgreSQL
-def create_connection_to_postgresql(attempts=3, delay=2):
-    logger.info("Airflow - POSTGRESQL - database/connectDB.py - create_connection() - Creating connection to PostgreSQL database")
+# Process-wide connection pool, lazily created on first use
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_pool_slots = None
 
-    # Fetch connection parameters from environment variables
-    db_params = {
+# Pools inherited across a fork are kept referenced (never closed) so the child
+# does not terminate sessions that still belong to the parent process
+_inherited_pools = []
+
+# Function to read connection parameters from environment variables
+def get_db_params():
+    return {
         "dbname": os.getenv("DB_NAME"),
         "user": os.getenv("DB_USERNAME"),
         "password": os.getenv("DB_PASSWORD"),
@@ -20,36 +29,153 @@ def create_connection_to_postgresql(attempts=3, delay=2):
         "port": int(os.getenv("DB_PORT"))
     }
 
-    attempt = 1
-    while attempt <= attempts:
-        try:
-            # Establish connection
-            conn = psycopg2.connect(**db_params)
-            logger.info("Airflow - POSTGRESQL - database/connectDB.py - create_connection() - Connection to PostgreSQL database established successfully")
-            return conn
-        except (Error, IOError) as e:
-            if attempt == attempts:
-                logger.error(f"Airflow - POSTGRESQL - database/connectDB.py - create_connection() - Failed to connect to PostgreSQL database: {e}")
-                return None
-            else:
-                logger.warning(f"Airflow - POSTGRESQL - database/connectDB.py - create_connection() - Connection Failed: {e} - Retrying {attempt}/{attempts}")
-                time.sleep(delay ** attempt)
-                attempt += 1
+
+# Function to get (or create) the process-wide connection pool
+def get_connection_pool(attempts=3, delay=2):
+    global _pool, _pool_pid, _pool_slots
+
+    # Celery workers fork; sockets inherited from the parent must not be reused by the child
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            return _pool
+
+        if _pool is not None:
+            _inherited_pools.append(_pool)
+            _pool = None
+
+        logger.info("Airflow - POSTGRESQL - database/connectDB.py - get_connection_pool() - Creating PostgreSQL connection pool")
+        max_size = int(os.getenv("DB_POOL_MAX_SIZE", "5"))
+
+        attempt = 1
+        while attempt <= attempts:
+            try:
+                _pool = ThreadedConnectionPool(
+                    minconn = int(os.getenv("DB_POOL_MIN_SIZE", "1")),
+                    maxconn = max_size,
+                    **get_db_params()
+                )
+                _pool_pid = os.getpid()
+
+                # ThreadedConnectionPool raises when exhausted; callers wait for a free slot instead
+                _pool_slots = threading.BoundedSemaphore(max_size)
+                logger.info("Airflow - POSTGRESQL - database/connectDB.py - get_connection_pool() - Connection pool created successfully")
+                return _pool
+            
+            except (Error, IOError) as e:
+                if attempt == attempts:
+                    logger.error(f"Airflow - POSTGRESQL - database/connectDB.py - get_connection_pool() - Failed to create connection pool: {e}")
+                    _pool = None
+                    return None
+                else:
+                    logger.warning(f"Airflow - POSTGRESQL - database/connectDB.py - get_connection_pool() - Connection Failed: {e} - Retrying {attempt}/{attempts}")
+                    time.sleep(delay ** attempt)
+                    attempt += 1
     return None
 
 
+# Function to check that a pooled connection is still usable
+def is_connection_healthy(conn):
+    if conn is None or conn.closed:
+        return False
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        conn.rollback()
+        return True
+
+    except (Error, IOError):
+        return False
+
+
+# Function to borrow a healthy connection from the pool
+def get_pooled_connection():
+    logger.info("Airflow - POSTGRESQL - database/connectDB.py - get_pooled_connection() - Borrowing connection from the pool")
+
+    pool = get_connection_pool()
+
+    if pool is None:
+        return None
+
+    _pool_slots.acquire()
+
+    try:
+        conn = pool.getconn()
+
+        # Replace connections the server (or RDS failover) dropped while they sat idle
+        if not is_connection_healthy(conn):
+            logger.warning("Airflow - POSTGRESQL - database/connectDB.py - get_pooled_connection() - Discarding stale pooled connection")
+            pool.putconn(conn, close=True)
+            conn = pool.getconn()
+
+        return conn
+
+    except (Error, IOError) as e:
+        logger.error(f"Airflow - POSTGRESQL - database/connectDB.py - get_pooled_connection() - Failed to get a pooled connection: {e}")
+        _pool_slots.release()
+        return None
+
+
+# Function to return a borrowed connection to the pool
+def release_connection(dbconn, cursor=None):
+    if dbconn is None:
+        logger.warning("Airflow - POSTGRESQL - database/connectDB.py - release_connection() - Connection does not exist")
+        return
 
-# Function to close connection to PostgreSQL
-def close_connection(dbconn, cursor=None):
-    logger.info("Airflow - POSTGRESQL - database/connectDB.py - close_connection() - Closing the database connection")
     try:
-        if dbconn is not None:
-            if cursor is not None:
-                cursor.close()
-                logger.info("Airflow - POSTGRESQL - database/connectDB.py - close_connection() - Cursor closed successfully")
-            dbconn.close()
-            logger.info("Airflow - POSTGRESQL - database/connectDB.py - close_connection() - Connection closed successfully")
-        else:
-            logger.warning("Airflow - POSTGRESQL - database/connectDB.py - close_connection() - Connection does not exist")
+        if cursor is not None and not cursor.closed:
+            cursor.close()
+
+        # The pool rolls back anything left uncommitted and closes broken connections
+        _pool.putconn(dbconn, close=dbconn.closed != 0)
     except Exception as e:
-        logger.error(f"Airflow - POSTGRESQL - database/connectDB.py - close_connection() - Error while closing the database connection: {e}")
+        logger.error(f"Airflow - POSTGRESQL - database/connectDB.py - release_connection() - Error while returning the connection to the pool: {e}")
+
+    finally:
+        # The slot is freed even when the pool refuses the connection (e.g. one borrowed before a fork)
+        try:
+            if _pool_slots is not None:
+                _pool_slots.release()
+        except ValueError:
+            logger.warning("Airflow - POSTGRESQL - database/connectDB.py - release_connection() - Connection was not borrowed from this process's pool")
+
+
+# Function to borrow a pooled connection for the duration of a with-block
+@contextmanager
+def postgres_connection():
+    '''
+    Yield a healthy pooled connection (or None when none could be established, so callers
+    keep their 'if conn:' guard). Uncommitted work is rolled back when an exception escapes
+    and the connection always goes back to the pool.
+    '''
+
+    conn = get_pooled_connection()
+
+    try:
+        yield conn
+
+    except Exception:
+        if conn is not None and not conn.closed:
+            conn.rollback()
+        raise
+
+    finally:
+        if conn is not None:
+            release_connection(conn)
+
+
+# Function to close every connection held by the pool
+def close_connection_pool():
+    global _pool, _pool_pid, _pool_slots
+
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+            logger.info("Airflow - POSTGRESQL - database/connectDB.py - close_connection_pool() - Connection pool closed")
+
+        _pool = None
+        _pool_pid = None
+        _pool_slots = None
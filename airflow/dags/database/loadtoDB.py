@@ -1,57 +1,63 @@
-import ast
+import os
 import uuid
 import json
+import hashlib
+from psycopg2.extras import execute_values
 
-from database.connectDB import create_connection_to_postgresql, close_connection
-from services.vectors import create_embeddings_and_index
+from database.connectDB import postgres_connection
+from services.vectors import create_embeddings_and_index_batch, delete_email_vectors
 from services.labeling import label_email
+from services.emailRecord import EmailAddress
+
+# Rows per multi-row INSERT statement
+PAGE_SIZE = 500
 
 # Function to store token response with respect to user in Users table
 def load_users_tokendata_to_db(logger, formatted_token_response):
     logger.info("Airflow - database/loadtoDB.py - load_users_tokendata_to_db() - Loading token data into USERS table")
     logger.info("Airflow - database/loadtoDB.py -  load_users_tokendata_to_db() - Creating database connection")
 
-    conn = create_connection_to_postgresql()
     user_email = None
 
-    if conn:
-        try:
-            cursor = conn.cursor()
-            insert_query = f"""
-                INSERT INTO users (
-                    id, tenant_id, name, email, token_type, 
-                    access_token, refresh_token, id_token, scope, 
-                    token_source, issued_at, expires_at, nonce
-                ) VALUES (
-                    %(id)s, %(tenant_id)s, %(name)s, %(email)s, %(token_type)s,
-                    %(access_token)s, %(refresh_token)s, %(id_token)s, %(scope)s,
-                    %(token_source)s, %(iat)s, %(exp)s, %(nonce)s
-                )
-                ON CONFLICT (id) 
-                DO UPDATE SET
-                    tenant_id = EXCLUDED.tenant_id,
-                    name = EXCLUDED.name,
-                    email = EXCLUDED.email,
-                    token_type = EXCLUDED.token_type,
-                    access_token = EXCLUDED.access_token,
-                    refresh_token = EXCLUDED.refresh_token,
-                    id_token = EXCLUDED.id_token,
-                    scope = EXCLUDED.scope,
-                    token_source = EXCLUDED.token_source,
-                    issued_at = EXCLUDED.issued_at,
-                    expires_at = EXCLUDED.expires_at,
-                    nonce = EXCLUDED.nonce
-            """
-            cursor.execute(insert_query, formatted_token_response)
-            conn.commit()
-            user_email = formatted_token_response['email']
-            logger.info("Airflow - database/loadtoDB.py - load_users_tokendata_to_db() - Token data inserted successfully in USERS table")
+    with postgres_connection() as conn:
+        if conn:
+            try:
+                with conn.cursor() as cursor:
+                    insert_query = f"""
+                        INSERT INTO users (
+                            id, tenant_id, name, email, token_type, 
+                            access_token, refresh_token, id_token, scope, 
+                            token_source, issued_at, expires_at, nonce
+                        ) VALUES (
+                            %(id)s, %(tenant_id)s, %(name)s, %(email)s, %(token_type)s,
+                            %(access_token)s, %(refresh_token)s, %(id_token)s, %(scope)s,
+                            %(token_source)s, %(iat)s, %(exp)s, %(nonce)s
+                        )
+                        ON CONFLICT (id) 
+                        DO UPDATE SET
+                            tenant_id = EXCLUDED.tenant_id,
+                            name = EXCLUDED.name,
+                            email = EXCLUDED.email,
+                            token_type = EXCLUDED.token_type,
+                            access_token = EXCLUDED.access_token,
+                            refresh_token = EXCLUDED.refresh_token,
+                            id_token = EXCLUDED.id_token,
+                            scope = EXCLUDED.scope,
+                            token_source = EXCLUDED.token_source,
+                            issued_at = EXCLUDED.issued_at,
+                            expires_at = EXCLUDED.expires_at,
+                            nonce = EXCLUDED.nonce
+                    """
+                    cursor.execute(insert_query, formatted_token_response)
+                conn.commit()
+                user_email = formatted_token_response['email']
+                logger.info("Airflow - database/loadtoDB.py - load_users_tokendata_to_db() - Token data inserted successfully in USERS table")
 
-        except Exception as e:
-            logger.error(f"Airflow - database/loadtoDB.py - load_users_tokendata_to_db() - Error inserting token data into the users table = {e}")
-        finally:
-            close_connection(conn, cursor)
-            return user_email
+            except Exception as e:
+                logger.error(f"Airflow - database/loadtoDB.py - load_users_tokendata_to_db() - Error inserting token data into the users table = {e}")
+                conn.rollback()
+
+    return user_email
 
 
 # Fuction to load email link data into EMAIL_LINKS table
@@ -59,388 +65,495 @@ def insert_or_update_email_links(logger, email_link_data):
     logger.info("Airflow - database/loadtoDB.py - insert_or_update_email_links() - Inserting or updating email links data in EMAIL_LINKS table")
     logger.info("Airflow - database/loadtoDB.py - insert_or_update_email_links() - Creating database connection")
 
-    conn = create_connection_to_postgresql()
+    with postgres_connection() as conn:
+        if conn:
+            try:
+                with conn.cursor() as cursor:
+                    email_links_query = f"""
+                        INSERT INTO email_links (
+                            id, email, current_link, next_link, is_current_link_processed
+                        ) VALUES (
+                            %(id)s, %(email)s, %(current_link)s, %(next_link)s, %(is_current_link_processed)s
+                        )
+                        ON CONFLICT (id) 
+                        DO UPDATE SET
+                            current_link = EXCLUDED.current_link,
+                            next_link = EXCLUDED.next_link,
+                            is_current_link_processed = EXCLUDED.is_current_link_processed,
+                            updated_at = CURRENT_TIMESTAMP
+                    """
 
-    if conn:
-        try:
-            cursor = conn.cursor()
-            email_links_query = f"""
-                INSERT INTO email_links (
-                    id, email, current_link, next_link, is_current_link_processed
-                ) VALUES (
-                    %(id)s, %(email)s, %(current_link)s, %(next_link)s, %(is_current_link_processed)s
-                )
-                ON CONFLICT (id) 
-                DO UPDATE SET
-                    current_link = EXCLUDED.current_link,
-                    next_link = EXCLUDED.next_link,
-                    is_current_link_processed = EXCLUDED.is_current_link_processed,
-                    updated_at = CURRENT_TIMESTAMP
-            """
-
-            cursor.execute(email_links_query, email_link_data)
-            conn.commit()
-            logger.info("Airflow - database/loadtoDB.py - insert_or_update_email_links() - Email links data inserted or updated successfully in EMAIL_LINKS table")
+                    cursor.execute(email_links_query, email_link_data)
+                conn.commit()
+                logger.info("Airflow - database/loadtoDB.py - insert_or_update_email_links() - Email links data inserted or updated successfully in EMAIL_LINKS table")
 
-        except Exception as e:
-            logger.error(f"Airflow - database/loadtoDB.py - insert_or_update_email_links() - Error inserting or updating email links data: {e}")
-        finally:
-            close_connection(conn, cursor)
+            except Exception as e:
+                logger.error(f"Airflow - database/loadtoDB.py - insert_or_update_email_links() - Error inserting or updating email links data: {e}")
 
-# Function to insert email folders
-def insert_email_folders(logger, email_folder):
-    logger.info("Airflow - database/loadtoDB.py - insert_email_folders() - Loading email folders into EMAIL_FOLDERS table")
-    logger.info("Airflow - database/loadtoDB.py - insert_email_folders() - Creating database connection")
 
-    conn = create_connection_to_postgresql()
+# Function to fetch the stored delta links (one per mail folder) for a user
+def fetch_delta_links(logger, user_id, email):
+    logger.info("Airflow - database/loadtoDB.py - fetch_delta_links() - Fetching delta links from EMAIL_LINKS table")
 
-    if conn:
-        try:
-            cursor = conn.cursor()
-            emailfolder_insert_query = f"""
-                        INSERT INTO email_folders (
-                            id, display_name, parent_folder_id, child_folder_count, unread_item_count,
-                            total_item_count, size_in_bytes, is_hidden, created_at
-                        )
-                        VALUES (
-                            %(id)s, %(display_name)s, %(parent_folder_id)s, %(child_folder_count)s,
-                            %(unread_item_count)s, %(total_item_count)s, %(size_in_bytes)s,
-                            %(is_hidden)s, CURRENT_TIMESTAMP
-                        )
-                        ON CONFLICT (id) DO NOTHING;
-                    """
-            cursor.execute(emailfolder_insert_query, email_folder)
-            conn.commit()
-            logger.info("Airflow - database/loadtoDB.py - insert_email_folders() - Email folders inserted successfully in EMAIL_FOLDERS table")
+    delta_links = {}
 
-        except Exception as e:
-            logger.error(f"Airflow - database/loadtoDB.py - insert_email_folders() - Error inserting email contents into the EMAIL_FOLDERS table = {e}")
-            raise e
-        finally:
-            close_connection(conn, cursor)
+    with postgres_connection() as conn:
+        if conn:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        "SELECT delta_links FROM email_links WHERE id = %s AND email = %s LIMIT 1",
+                        (user_id, email)
+                    )
+                    result = cursor.fetchone()
 
+                    if result and result[0]:
+                        delta_links = result[0]
 
-# Function to load email data into EMAILS table
-def insert_email_data(logger, email_data):
-    logger.info("Airflow - database/loadtoDB.py - insert_email_data() - Loading email data into EMAILS table")
-    logger.info("Airflow - database/loadtoDB.py - insert_email_data() - Creating database connection")
+            except Exception as e:
+                logger.error(f"Airflow - database/loadtoDB.py - fetch_delta_links() - Error fetching delta links: {e}")
 
-    conn = create_connection_to_postgresql()
+    return delta_links
 
-    if conn:
-        try:
-            cursor = conn.cursor()
-            email_insert_query = f"""
-                    INSERT INTO emails (
-                    id, content_type, body, body_preview, change_key, conversation_id, conversation_index, 
-                    created_datetime, created_datetime_timezone, end_datetime, end_datetime_timezone, 
-                    has_attachments, importance, inference_classification, is_draft, is_read, 
-                    is_all_day, is_out_of_date, meeting_message_type, meeting_request_type, 
-                    odata_etag, odata_value, parent_folder_id, received_datetime, recurrence, 
-                    reply_to, response_type, sent_datetime, start_datetime, start_datetime_timezone, 
-                    subject, type, web_link
-                ) VALUES (
-                    %(id)s, %(content_type)s, %(body)s, %(body_preview)s, %(change_key)s, %(conversation_id)s, %(conversation_index)s,
-                    %(created_datetime)s, %(created_datetime_timezone)s, %(end_datetime)s, %(end_datetime_timezone)s,
-                    %(has_attachments)s, %(importance)s, %(inference_classification)s, %(is_draft)s, %(is_read)s,
-                    %(is_all_day)s, %(is_out_of_date)s, %(meeting_message_type)s, %(meeting_request_type)s,
-                    %(odata_etag)s, %(odata_value)s, %(parent_folder_id)s, %(received_datetime)s, %(recurrence)s,
-                    %(reply_to)s, %(response_type)s, %(sent_datetime)s, %(start_datetime)s, %(start_datetime_timezone)s,
-                    %(subject)s, %(type)s, %(web_link)s
-                )
-                ON CONFLICT (id)
-                DO UPDATE SET
-                    content_type = EXCLUDED.content_type,
-                    body = EXCLUDED.body,
-                    body_preview = EXCLUDED.body_preview,
-                    change_key = EXCLUDED.change_key,
-                    conversation_id = EXCLUDED.conversation_id,
-                    conversation_index = EXCLUDED.conversation_index,
-                    created_datetime = EXCLUDED.created_datetime,
-                    created_datetime_timezone = EXCLUDED.created_datetime_timezone,
-                    end_datetime = EXCLUDED.end_datetime,
-                    end_datetime_timezone = EXCLUDED.end_datetime_timezone,
-                    has_attachments = EXCLUDED.has_attachments,
-                    importance = EXCLUDED.importance,
-                    inference_classification = EXCLUDED.inference_classification,
-                    is_draft = EXCLUDED.is_draft,
-                    is_read = EXCLUDED.is_read,
-                    is_all_day = EXCLUDED.is_all_day,
-                    is_out_of_date = EXCLUDED.is_out_of_date,
-                    meeting_message_type = EXCLUDED.meeting_message_type,
-                    meeting_request_type = EXCLUDED.meeting_request_type,
-                    odata_etag = EXCLUDED.odata_etag,
-                    odata_value = EXCLUDED.odata_value,
-                    parent_folder_id = EXCLUDED.parent_folder_id,
-                    received_datetime = EXCLUDED.received_datetime,
-                    recurrence = EXCLUDED.recurrence,
-                    reply_to = EXCLUDED.reply_to,
-                    response_type = EXCLUDED.response_type,
-                    sent_datetime = EXCLUDED.sent_datetime,
-                    start_datetime = EXCLUDED.start_datetime,
-                    start_datetime_timezone = EXCLUDED.start_datetime_timezone,
-                    subject = EXCLUDED.subject,
-                    type = EXCLUDED.type,
-                    web_link = EXCLUDED.web_link
-                """
-
-            cursor.execute(email_insert_query, email_data)
-            conn.commit()
-            logger.info("Airflow - database/loadtoDB.py - insert_email_data() - Email contents inserted successfully in EMAILS table")
 
-        except Exception as e:
-            logger.error(f"Airflow - database/loadtoDB.py - insert_email_data() - Error inserting email contents into the EMAILS table = {e}")
-            raise e
-        finally:
-            close_connection(conn, cursor)
+# Function to store the latest delta (or next) link for a single mail folder
+def update_delta_link(logger, user_id, email, folder_id, link):
+    logger.info(f"Airflow - database/loadtoDB.py - update_delta_link() - Saving delta link for folder {folder_id} in EMAIL_LINKS table")
 
+    with postgres_connection() as conn:
+        if conn:
+            try:
+                with conn.cursor() as cursor:
+                    delta_link_query = """
+                        INSERT INTO email_links (id, email, delta_links)
+                        VALUES (%s, %s, jsonb_build_object(%s::text, %s::text))
+                        ON CONFLICT (id)
+                        DO UPDATE SET
+                            delta_links = COALESCE(email_links.delta_links, '{}'::jsonb) || EXCLUDED.delta_links,
+                            updated_at = CURRENT_TIMESTAMP
+                    """
+                    cursor.execute(delta_link_query, (user_id, email, folder_id, link))
+                    conn.commit()
 
-# Function to load sender data
-def insert_sender_data(logger, sender_data):
-    logger.info("Airflow - database/loadtoDB.py - insert_sender_data() - Loading senders data into SENDERS table")
-    logger.info("Airflow - database/loadtoDB.py - insert_sender_data() - Creating database connection")
+            except Exception as e:
+                logger.error(f"Airflow - database/loadtoDB.py - update_delta_link() - Error saving delta link: {e}")
+                raise e
 
-    conn = create_connection_to_postgresql()
 
-    if conn:
-        try:
-            cursor = conn.cursor()
-            sender_insert_query = f"""
-                    INSERT INTO senders (
-                        id, email_id, email_address, name
-                    ) VALUES (
-                        %(id)s, %(email_id)s, %(email_address)s, %(name)s
-                    )
-                    ON CONFLICT (id) 
-                    DO UPDATE SET
-                        email_id = EXCLUDED.email_id,
-                        email_address = EXCLUDED.email_address,
-                        name = EXCLUDED.name
-                """
-
-            cursor.execute(sender_insert_query, sender_data)
-            conn.commit()
-            logger.info("Airflow - database/loadtoDB.py - insert_sender_data() - Senders contents inserted successfully in SENDERS table")
+# Function to delete emails (and their dependent rows) that were removed from the mailbox
+def delete_emails_from_db(logger, email_ids, user_email=None):
+    '''
+    Return (released_hashes, shared_hashes) for the attachment blobs of the deleted emails:
+    blobs no other email of the user references any more (their attachment_blob_embeddings
+    row is deleted too, so a later copy embeds them again) and blobs still referenced.
+    '''
 
-        except Exception as e:
-            logger.error(f"Airflow - database/loadtoDB.py - insert_sender_data() - Error inserting sender contents into the SENDERS table = {e}")
-            raise e
-        finally:
-            close_connection(conn, cursor)
+    logger.info(f"Airflow - database/loadtoDB.py - delete_emails_from_db() - Deleting {len(email_ids)} removed emails from the database")
 
+    if not email_ids:
+        return set(), set()
 
-# Function to load recipient data
-def insert_recipient_data(logger, recipients_data):
-    logger.info("Airflow - database/loadtoDB.py - insert_recipient_data() - Loading recipients data into RECIPIENTS table")
-    logger.info("Airflow - database/loadtoDB.py - insert_recipient_data() - Creating database connection")
+    with postgres_connection() as conn:
+        if not conn:
+            raise ConnectionError("Failed to connect to the database while deleting removed emails")
 
-    conn = create_connection_to_postgresql()
+        released_hashes = set()
+        shared_hashes = set()
 
-    if conn:
         try:
-            cursor = conn.cursor()
-            recipient_insert_query = f"""
-                    INSERT INTO recipients (
-                        id, email_id, type, email_address, name
-                    ) VALUES (
-                        %(id)s, %(email_id)s, %(type)s, %(email_address)s, %(name)s
-                    )
-                    ON CONFLICT (id) 
-                    DO UPDATE SET
-                        email_id = EXCLUDED.email_id,
-                        type = EXCLUDED.type,
-                        email_address = EXCLUDED.email_address,
-                        name = EXCLUDED.name
-                """
-
-            for recipient in recipients_data:
-                cursor.execute(recipient_insert_query, recipient)
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT DISTINCT content_hash FROM attachments WHERE email_id = ANY(%s) AND content_hash IS NOT NULL", (list(email_ids),))
+                content_hashes = [row[0] for row in cursor.fetchall()]
+
+                # Child tables reference emails(id) without ON DELETE CASCADE
+                for table in ("categories", "flags", "senders", "recipients", "attachments"):
+                    cursor.execute(f"DELETE FROM {table} WHERE email_id = ANY(%s)", (list(email_ids),))
+
+                cursor.execute("DELETE FROM emails WHERE id = ANY(%s)", (list(email_ids),))
+                logger.info(f"Airflow - database/loadtoDB.py - delete_emails_from_db() - Deleted {cursor.rowcount} emails")
+
+                # A blob is embedded once per user, so its vectors stay while another email still has a copy
+                if content_hashes and user_email:
+                    cursor.execute("""
+                        SELECT DISTINCT a.content_hash
+                        FROM attachments a
+                        JOIN emails e ON e.id = a.email_id
+                        WHERE e.user_email = %s AND a.content_hash = ANY(%s);
+                    """, (user_email, content_hashes))
+                    shared_hashes = {row[0] for row in cursor.fetchall()}
+                    released_hashes = set(content_hashes) - shared_hashes
+
+                    if released_hashes:
+                        cursor.execute("DELETE FROM attachment_blob_embeddings WHERE user_email = %s AND sha256 = ANY(%s)", (user_email, list(released_hashes)))
+
             conn.commit()
-            logger.info("Airflow - database/loadtoDB.py - insert_recipient_data() - RECIPIENTS contents inserted successfully in RECIPIENTS table")
+            return released_hashes, shared_hashes
 
         except Exception as e:
-            logger.error(f"Airflow - database/loadtoDB.py - insert_recipient_data() - Error inserting RECIPIENTS contents into the RECIPIENTS table = {e}")
+            logger.error(f"Airflow - database/loadtoDB.py - delete_emails_from_db() - Error deleting removed emails, rolling back = {e}")
             raise e
-        finally:
-            close_connection(conn, cursor)
 
 
-# Function to load flags data
-def insert_flags_data(logger, flags_data):
-    logger.info("Airflow - database/loadtoDB.py - insert_flags_data() - Loading flags data into FLAGS table")
-    logger.info("Airflow - database/loadtoDB.py - insert_flags_data() - Creating database connection")
+# Function to insert email folders
+def insert_email_folders(logger, email_folder):
+    logger.info("Airflow - database/loadtoDB.py - insert_email_folders() - Loading email folders into EMAIL_FOLDERS table")
+    logger.info("Airflow - database/loadtoDB.py - insert_email_folders() - Creating database connection")
 
-    conn = create_connection_to_postgresql()
+    with postgres_connection() as conn:
+        if conn:
+            try:
+                with conn.cursor() as cursor:
+                    emailfolder_insert_query = f"""
+                                INSERT INTO email_folders (
+                                    id, display_name, parent_folder_id, child_folder_count, unread_item_count,
+                                    total_item_count, size_in_bytes, is_hidden, created_at
+                                )
+                                VALUES (
+                                    %(id)s, %(display_name)s, %(parent_folder_id)s, %(child_folder_count)s,
+                                    %(unread_item_count)s, %(total_item_count)s, %(size_in_bytes)s,
+                                    %(is_hidden)s, CURRENT_TIMESTAMP
+                                )
+                                ON CONFLICT (id) DO NOTHING;
+                            """
+                    cursor.execute(emailfolder_insert_query, email_folder)
+                conn.commit()
+                logger.info("Airflow - database/loadtoDB.py - insert_email_folders() - Email folders inserted successfully in EMAIL_FOLDERS table")
+
+            except Exception as e:
+                logger.error(f"Airflow - database/loadtoDB.py - insert_email_folders() - Error inserting email contents into the EMAIL_FOLDERS table = {e}")
+                raise e
+
+
+# Graph message properties read by EmailRecord.from_graph (used to build $select projections)
+EMAIL_GRAPH_FIELDS = (
+    "id", "body", "bodyPreview", "changeKey", "conversationId", "conversationIndex",
+    "createdDateTime", "hasAttachments", "importance", "inferenceClassification",
+    "isDraft", "isRead", "parentFolderId", "receivedDateTime", "replyTo",
+    "sentDateTime", "subject", "webLink", "sender", "toRecipients",
+    "ccRecipients", "bccRecipients", "flag"
+)
+
+# emails columns filled from eventMessage-only properties (startDateTime, recurrence, meetingMessageType...).
+# Graph rejects those in $select on /messages, so in select mode updates keep the stored values
+EVENT_MESSAGE_COLUMNS = (
+    "start_datetime", "start_datetime_timezone", "end_datetime", "end_datetime_timezone",
+    "is_all_day", "is_out_of_date", "meeting_message_type", "meeting_request_type",
+    "recurrence", "response_type", "type"
+)
+
+
+# Function to tell whether messages are fetched with a $select of EMAIL_GRAPH_FIELDS (GRAPH_FETCH_MODE=select) instead of in full
+def is_select_fetch_mode():
+    return os.getenv("GRAPH_FETCH_MODE", "full") == "select"
+
+
+# Function to hash the parts of an email that feed its embedding and labels
+def compute_content_hash(email):
+    content = f"{email.subject or ''}\x00{email.body or ''}"
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+# Function to format a single EmailRecord into rows for each table
+def build_email_rows(logger, email):
+    # Email data
+    email_data = {
+        "id"                        : email.id,
+        "content_type"              : email.content_type,
+        "body"                      : email.body,
+        "body_preview"              : email.body_preview,
+        "change_key"                : email.change_key,
+        "conversation_id"           : email.conversation_id,
+        "conversation_index"        : email.conversation_index,
+        "created_datetime"          : email.created_datetime,
+        "created_datetime_timezone" : email.created_datetime,
+        "end_datetime"              : email.end_datetime,
+        "end_datetime_timezone"     : email.end_datetime_timezone,
+        "has_attachments"           : email.has_attachments,
+        "importance"                : email.importance,
+        "inference_classification"  : email.inference_classification,
+        "is_draft"                  : email.is_draft,
+        "is_read"                   : email.is_read,
+        "is_all_day"                : email.is_all_day,
+        "is_out_of_date"            : email.is_out_of_date,
+        "meeting_message_type"      : email.meeting_message_type,
+        "meeting_request_type"      : email.meeting_request_type,
+        "odata_etag"                : email.odata_etag,
+        "odata_value"               : email.odata_value,
+        "parent_folder_id"          : email.parent_folder_id,
+        "received_datetime"         : email.received_datetime,
+        "recurrence"                : json.dumps(email.recurrence) if email.recurrence else None,
+
+        # Stored in Graph's own shape: [{"emailAddress": {"name": ..., "address": ...}}]
+        "reply_to"                  : json.dumps([address.to_graph() for address in email.reply_to]) if email.reply_to else None,
+        "response_type"             : email.response_type,
+        "sent_datetime"             : email.sent_datetime,
+        "start_datetime"            : email.start_datetime,
+        "start_datetime_timezone"   : email.start_datetime_timezone,
+        "subject"                   : email.subject,
+        "type"                      : email.type,
+        "web_link"                  : email.web_link,
+        "content_hash"              : compute_content_hash(email),
+        "vector_indexed"            : False
+    }
+
+    # Sender data
+    # Sometimes, the emailAddress of the sender might be missing
+    # Like for Calendar reminders, the sender address is empty
+    sender = email.sender or EmailAddress()
+
+    sender_data = {
+        "id"            : str(uuid.uuid4()),
+        "email_id"      : email.id or "",
+        "email_address" : sender.address,
+        "name"          : sender.name
+    }
+
+    # Recipient data
+    recipients_data = []
+    for recipient_type, recipients in [("to", email.to_recipients), ("cc", email.cc_recipients), ("bcc", email.bcc_recipients)]:
+        for recipient in recipients:
+            recipients_data.append({
+                "id"            : str(uuid.uuid4()),
+                "email_id"      : email.id or "",
+                "type"          : recipient_type,
+                "email_address" : recipient.address,
+                "name"          : recipient.name
+            })
+
+    # Email flags data
+    flag_data = {
+        "email_id"      : email.id or "",
+        "flag_status"   : email.flag_status
+    }
+
+    return email_data, sender_data, recipients_data, flag_data
+
+
+# Function to write a whole page of emails in a single transaction
+def bulk_load_email_page(logger, emails_data, senders_data, recipients_data, flags_data, categories_data):
+    logger.info(f"Airflow - database/loadtoDB.py - bulk_load_email_page() - Loading a page of {len(emails_data)} emails into the database")
+
+    if not emails_data:
+        logger.info("Airflow - database/loadtoDB.py - bulk_load_email_page() - Nothing to load")
+        return
+
+    # A page can repeat a message (e.g. moved between folders while paging); 
+    # ON CONFLICT cannot touch the same row twice in one statement, so keep the latest copy
+    emails_data = list({email["id"]: email for email in emails_data}.values())
+    flags_data  = list({flag["email_id"]: flag for flag in flags_data}.values())
+    senders_data = list({sender["email_id"]: sender for sender in senders_data}.values())
+    recipients_data = list({
+        (recipient["email_id"], recipient["type"], recipient["email_address"]): recipient for recipient in recipients_data
+    }.values())
+    email_ids   = [email["id"] for email in emails_data]
+
+    # Messages fetched with $select carry no event properties; their stored values are kept
+    event_updates = "" if is_select_fetch_mode() else "".join(f"{column} = EXCLUDED.{column}, " for column in EVENT_MESSAGE_COLUMNS)
+
+    email_upsert_query = f"""
+        INSERT INTO emails (
+            id, content_type, body, body_preview, change_key, conversation_id, conversation_index, 
+            created_datetime, created_datetime_timezone, end_datetime, end_datetime_timezone, 
+            has_attachments, importance, inference_classification, is_draft, is_read, 
+            is_all_day, is_out_of_date, meeting_message_type, meeting_request_type, 
+            odata_etag, odata_value, parent_folder_id, received_datetime, recurrence, 
+            reply_to, response_type, sent_datetime, start_datetime, start_datetime_timezone, 
+            subject, type, web_link, content_hash, vector_indexed,
+            user_email, attachments_status
+        ) VALUES %s
+        ON CONFLICT (id)
+        DO UPDATE SET
+            content_type = EXCLUDED.content_type,
+            body = EXCLUDED.body,
+            body_preview = EXCLUDED.body_preview,
+            change_key = EXCLUDED.change_key,
+            conversation_id = EXCLUDED.conversation_id,
+            conversation_index = EXCLUDED.conversation_index,
+            created_datetime = EXCLUDED.created_datetime,
+            created_datetime_timezone = EXCLUDED.created_datetime_timezone,
+            has_attachments = EXCLUDED.has_attachments,
+            importance = EXCLUDED.importance,
+            inference_classification = EXCLUDED.inference_classification,
+            is_draft = EXCLUDED.is_draft,
+            is_read = EXCLUDED.is_read,
+            odata_etag = EXCLUDED.odata_etag,
+            odata_value = EXCLUDED.odata_value,
+            parent_folder_id = EXCLUDED.parent_folder_id,
+            received_datetime = EXCLUDED.received_datetime,
+            reply_to = EXCLUDED.reply_to,
+            sent_datetime = EXCLUDED.sent_datetime,
+            subject = EXCLUDED.subject,
+            web_link = EXCLUDED.web_link,
+            {event_updates}
+            content_hash = EXCLUDED.content_hash,
+            vector_indexed = EXCLUDED.vector_indexed,
+            user_email = EXCLUDED.user_email,
+            attachments_status = CASE
+                WHEN NOT EXCLUDED.has_attachments THEN NULL
+                WHEN emails.attachments_status IS NULL THEN 'pending'
+                ELSE emails.attachments_status
+            END
+    """
+    email_upsert_template = """(
+        %(id)s, %(content_type)s, %(body)s, %(body_preview)s, %(change_key)s, %(conversation_id)s, %(conversation_index)s,
+        %(created_datetime)s, %(created_datetime_timezone)s, %(end_datetime)s, %(end_datetime_timezone)s,
+        %(has_attachments)s, %(importance)s, %(inference_classification)s, %(is_draft)s, %(is_read)s,
+        %(is_all_day)s, %(is_out_of_date)s, %(meeting_message_type)s, %(meeting_request_type)s,
+        %(odata_etag)s, %(odata_value)s, %(parent_folder_id)s, %(received_datetime)s, %(recurrence)s,
+        %(reply_to)s, %(response_type)s, %(sent_datetime)s, %(start_datetime)s, %(start_datetime_timezone)s,
+        %(subject)s, %(type)s, %(web_link)s, %(content_hash)s, %(vector_indexed)s,
+        %(user_email)s, %(attachments_status)s
+    )"""
+
+    # Senders, recipients and categories are keyed by a fresh UUID on every load,
+    # so replace the rows belonging to this page instead of upserting them
+    delete_senders_query    = "DELETE FROM senders WHERE email_id = ANY(%s)"
+    delete_recipients_query = "DELETE FROM recipients WHERE email_id = ANY(%s)"
+    delete_categories_query = "DELETE FROM categories WHERE email_id = ANY(%s)"
+
+    sender_insert_query     = "INSERT INTO senders (id, email_id, email_address, name) VALUES %s"
+    recipient_insert_query  = "INSERT INTO recipients (id, email_id, type, email_address, name) VALUES %s"
+    category_insert_query   = "INSERT INTO categories (id, email_id, category) VALUES %s"
+
+    flags_upsert_query = """
+        INSERT INTO flags (email_id, flag_status) VALUES %s
+        ON CONFLICT (email_id) 
+        DO UPDATE SET
+            flag_status = EXCLUDED.flag_status
+    """
+
+    with postgres_connection() as conn:
+        if not conn:
+            raise ConnectionError("Failed to connect to the database while loading a page of emails")
 
-    if conn:
         try:
-            cursor = conn.cursor()
-            flags_insert_query = f"""
-                    INSERT INTO flags (
-                        email_id, flag_status
-                    ) VALUES (
-                        %(email_id)s, %(flag_status)s
+            with conn.cursor() as cursor:
+                execute_values(cursor, email_upsert_query, emails_data, template=email_upsert_template, page_size=PAGE_SIZE)
+
+                cursor.execute(delete_senders_query, (email_ids,))
+                execute_values(
+                    cursor, sender_insert_query,
+                    [(sender["id"], sender["email_id"], sender["email_address"], sender["name"]) for sender in senders_data],
+                    page_size=PAGE_SIZE
+                )
+
+                cursor.execute(delete_recipients_query, (email_ids,))
+                if recipients_data:
+                    execute_values(
+                        cursor, recipient_insert_query,
+                        [(recipient["id"], recipient["email_id"], recipient["type"], recipient["email_address"], recipient["name"]) for recipient in recipients_data],
+                        page_size=PAGE_SIZE
+                    )
+
+                execute_values(
+                    cursor, flags_upsert_query,
+                    [(flag["email_id"], flag["flag_status"]) for flag in flags_data],
+                    page_size=PAGE_SIZE
+                )
+
+                # Only replace categories for emails that were successfully labeled in this run
+                if categories_data:
+                    labeled_email_ids = list({category["email_id"] for category in categories_data})
+                    cursor.execute(delete_categories_query, (labeled_email_ids,))
+                    execute_values(
+                        cursor, category_insert_query,
+                        [(category["id"], category["email_id"], category["category"]) for category in categories_data],
+                        page_size=PAGE_SIZE
                     )
-                    ON CONFLICT (email_id) 
-                    DO UPDATE SET
-                        flag_status = EXCLUDED.flag_status
-                """
 
-            cursor.execute(flags_insert_query, flags_data)
             conn.commit()
-            logger.info("Airflow - database/loadtoDB.py - insert_flags_data() - FLAGS contents inserted successfully in FLAGS table")
+            logger.info(f"Airflow - database/loadtoDB.py - bulk_load_email_page() - Loaded {len(emails_data)} emails, {len(senders_data)} senders, {len(recipients_data)} recipients and {len(categories_data)} categories")
 
         except Exception as e:
-            logger.error(f"Airflow - database/loadtoDB.py - insert_flags_data() - Error inserting FLAGS contents into the FLAGS table = {e}")
+            logger.error(f"Airflow - database/loadtoDB.py - bulk_load_email_page() - Error loading page of emails, rolling back = {e}")
             raise e
-        finally:
-            close_connection(conn, cursor)
 
 
-# Function to save email categories
-def insert_category_data(logger, email_id, labels):
-    logger.info("Airflow - database/loadtoDB.py - insert_category_data() - Loading email categories into the database")
+# Function to fetch what is already stored for a page of emails (change key, content hash, indexing state)
+def fetch_email_index_state(logger, email_ids):
+    logger.info(f"Airflow - database/loadtoDB.py - fetch_email_index_state() - Fetching stored state of {len(email_ids)} emails")
 
-    conn = create_connection_to_postgresql()
+    index_state = {}
 
-    if conn:
-        categories_insert_query = """
-            INSERT INTO categories (
-                id, email_id, category
-            ) VALUES (
-                %s, %s, %s  
-            )
+    if not email_ids:
+        return index_state
+
+    with postgres_connection() as conn:
+        if not conn:
+            logger.error("Airflow - database/loadtoDB.py - fetch_email_index_state() - Failed to connect to database, every email will be re-indexed")
+            return index_state
+
+        state_query = """
+            SELECT emails.id, emails.change_key, emails.content_hash, emails.vector_indexed,
+                EXISTS (SELECT 1 FROM categories WHERE categories.email_id = emails.id)
+            FROM emails
+            WHERE emails.id = ANY(%s)
         """
-        
-        try:
-            if not labels:
-                raise ValueError("Labels is empty!")
 
+        try:
             with conn.cursor() as cursor:
-                for label in labels:
-                    cursor.execute(categories_insert_query, (str(uuid.uuid4()), str(email_id), str(label),))
-                
-                conn.commit()
-                logger.info("Airflow - database/loadtoDB.py - insert_category_data() - Inserted email category into the database")
+                cursor.execute(state_query, (list(email_ids),))
+
+                for email_id, change_key, content_hash, vector_indexed, is_labeled in cursor.fetchall():
+                    index_state[email_id] = {
+                        "change_key"     : change_key,
+                        "content_hash"   : content_hash,
+                        "vector_indexed" : bool(vector_indexed),
+                        "is_labeled"     : is_labeled
+                    }
 
         except Exception as e:
-            logger.error(f"Airflow - database/loadtoDB.py - insert_category_data() - Error inserting CATEGORY contents into the CATEGORY table = {e}")
+            logger.error(f"Airflow - database/loadtoDB.py - fetch_email_index_state() - Error fetching stored email state, every email will be re-indexed = {e}")
+            index_state = {}
+
+    return index_state
 
-        finally:
-            close_connection(conn)
 
 # Function to load emails info
 def load_email_info_to_db(logger, formatted_mail_responses, user_email):
     logger.info("Airflow - database/loadtoDB.py - load_email_info_to_db() - Loading mail information into the database")
 
-    for email in formatted_mail_responses:
-        # Email data
-        email_data = {
-            "id"                        : email.get("id"),
-            "content_type"              : email.get("body", None).get("contentType", "html"),
-            "body"                      : email.get("body", None).get("content", ""),
-            "body_preview"              : email.get("bodyPreview", None),
-            "change_key"                : email.get("changeKey", None),
-            "conversation_id"           : email.get("conversationId", None),
-            "conversation_index"        : email.get("conversationIndex", None),
-            "created_datetime"          : email.get("createdDateTime", None) or None,
-            "created_datetime_timezone" : email.get("createdDateTime", None) or None,
-            "end_datetime"              : email.get("endDateTime", {}).get("dateTime", None) or None,
-            "end_datetime_timezone"     : email.get("endDateTime", {}).get("timeZone", None) or None,
-            "has_attachments"           : email.get("hasAttachments", False),
-            "importance"                : email.get("importance", None),
-            "inference_classification"  : email.get("inferenceClassification", None),
-            "is_draft"                  : email.get("isDraft", False),
-            "is_read"                   : email.get("isRead", False),
-            "is_all_day"                : email.get("isAllDay", False),
-            "is_out_of_date"            : email.get("isOutOfDate", False),
-            "meeting_message_type"      : email.get("meetingMessageType", None),
-            "meeting_request_type"      : email.get("meetingRequestType", None),
-            "odata_etag"                : email.get("@odata.etag", None),
-            "odata_value"               : email.get("@odata.value", None),
-            "parent_folder_id"          : email.get("parentFolderId", None),
-            "received_datetime"         : email.get("receivedDateTime", None) or None,
-            "recurrence"                : json.dumps(email.get("recurrence")) if email.get("recurrence", None) else None,
-            "reply_to"                  : json.dumps(email.get("replyTo")) if email.get("replyTo", None) else None,
-            "response_type"             : email.get("responseType", None),
-            "sent_datetime"             : email.get("sentDateTime", None) or None,
-            "start_datetime"            : email.get("startDateTime", {}).get("dateTime", None) or None,
-            "start_datetime_timezone"   : email.get("startDateTime", {}).get("timeZone", None) or None,
-            "subject"                   : email.get("subject", None),
-            "type"                      : email.get("type", None),
-            "web_link"                  : email.get("webLink", None)
-        }
-
-        # Sender data
-        sender_info = email.get("sender", {}).get("emailAddress", None)
-
-        # Sometimes, the emailAddress of the sender might be missing
-        # Like for Calendar reminders, the sender address is empty
-        if sender_info:
-            try:
-                sender_dict = ast.literal_eval(sender_info)
-            
-            except Exception as exception:
-                logger.warning("Airflow - database/loadtoDB.py - load_email_info_to_db() - Sender email address seems to be missing. Defaulting to empty string.")
-                sender_dict = {}
-       
-        else:
-            sender_dict = {}
-        
-        sender_data = {
-            "id"            : str(uuid.uuid4()),
-            "email_id"      : email.get("id", ""),
-            "email_address" : sender_dict.get("address", ""),
-            "name"          : sender_dict.get("name", "")
-        }
+    emails_data     = []
+    senders_data    = []
+    recipients_data = []
+    flags_data      = []
+    categories_data = []
 
-        # Recipient data
-        recipients_data = []
-        for recipient_type, recipients_key in [("to", "toRecipients"), ("cc", "ccRecipients"), ("bcc", "bccRecipients")]:
-            for recipient in email.get(recipients_key, []):
-                recipient_info = recipient.get("emailAddress", "")
-                recipient_dict = ast.literal_eval(recipient_info)
-                recipients_data.append({
-                    "id"            : str(uuid.uuid4()),
-                    "email_id"      : email.get("id", ""),
-                    "type"          : recipient_type,
-                    "email_address" : recipient_dict.get('address', ""),
-                    "name"          : recipient_dict.get('name', "")
-                })
+    # Emails whose subject and body are unchanged since the last run keep their vectors and categories
+    index_state = fetch_email_index_state(logger, [email.id for email in formatted_mail_responses])
+    skipped_count = 0
+    pending_index = []
 
-        # Email flags data
-        flag_data = {
-            "email_id"      : email.get("id", ""),
-            "flag_status"   : email.get("flag", {}).get("flagStatus","")
-        }
+    for email in formatted_mail_responses:
+        email_data, sender_data, email_recipients, flag_data = build_email_rows(logger, email)
 
-        # Insert email data into Postgres
-        logger.info(f"Airflow - database/loadtoDB.py - load_email_info_to_db() - Loading mail contents to EMAILS table in database")
-        insert_email_data(logger, email_data)
-        logger.info(f"Airflow - database/loadtoDB.py - load_email_info_to_db() - Email contents uploaded to EMAILS table in database")
+        emails_data.append(email_data)
+        senders_data.append(sender_data)
+        recipients_data.extend(email_recipients)
+        flags_data.append(flag_data)
 
-        # Insert sender data into Postgres
-        logger.info(f"Airflow - database/loadtoDB.py - load_email_info_to_db() - Loading sender contents to SENDERS table in database")
-        insert_sender_data(logger, sender_data)
-        logger.info(f"Airflow - database/loadtoDB.py - load_email_info_to_db() - Sender contents uploaded to SENDERS table in database")
+        # Attachment-bearing messages enter the attachment ledger as 'pending' (see processEmailAttachments.py)
+        email_data["user_email"] = user_email
+        email_data["attachments_status"] = "pending" if email_data["has_attachments"] else None
 
-        # Insert recipient data into Postgres
-        logger.info(f"Airflow - database/loadtoDB.py - load_email_info_to_db() - Loading recipient contents to RECIPIENTS table in database")
-        insert_recipient_data(logger, recipients_data)
-        logger.info(f"Airflow - database/loadtoDB.py - load_email_info_to_db() - recipient contents uploaded to RECIPIENTS table in database")
+        stored = index_state.get(email_data["id"])
+        is_unchanged = bool(stored) and (
+            stored["content_hash"] == email_data["content_hash"]
+            or (stored["content_hash"] is None and stored["change_key"] == email_data["change_key"])
+        )
 
-        # Insert flag data into Postgres        
-        logger.info(f"Airflow - database/loadtoDB.py - load_email_info_to_db() - Loading flags contents to FLAGS table in database")
-        insert_flags_data(logger, flag_data)
-        logger.info(f"Airflow - database/loadtoDB.py - load_email_info_to_db() - flags contents uploaded to FLAGS table in database")
+        if is_unchanged and stored["vector_indexed"] and stored["is_labeled"]:
+            email_data["vector_indexed"] = True
+            skipped_count += 1
+            continue
 
-        # Finally, index the email contents in Milvus
+        # Index the email contents in Milvus
         data_to_index = {
             "subject"           : email_data["subject"],
             "body"              : email_data["body"],
             "sender_name"       : sender_data["name"],
             "sender_email"      : sender_data["email_address"],
-            "reply_to"          : email_data["reply_to"],
+            "reply_to"          : ", ".join(address.address for address in email.reply_to),
             "created_datetime"  : email_data["created_datetime"],
             "received_datetime" : email_data["received_datetime"],
             "sent_datetime"     : email_data["sent_datetime"],
@@ -454,132 +567,193 @@ def load_email_info_to_db(logger, formatted_mail_responses, user_email):
             "message_type"       : "email"
         }
 
-        create_embeddings_and_index(data_to_index=data_to_index, metadata=metadata)
-        
+        if is_unchanged and stored["vector_indexed"]:
+            email_data["vector_indexed"] = True
+
+        else:
+            # Embedded together with the rest of the page below
+            pending_index.append((email_data, data_to_index, metadata))
+
+        # Unchanged emails that already have categories are not sent to the language model again
+        if is_unchanged and stored["is_labeled"]:
+            continue
+
         # Email Categorization
         cat_data = {
             "sender_email" : sender_data["email_address"],
             "subject"      : email_data["subject"],
             "body"         : email_data["body"],
-            "reply_to"     : email_data["reply_to"]
+            "reply_to"     : [address.address for address in email.reply_to]
         }
 
         categories = label_email(email_dict=cat_data)
 
-        # Insert category data into Postgres        
-        logger.info(f"Airflow - database/loadtoDB.py - load_email_info_to_db() - Loading 'category' contents to CATEGORY table in database")
-        insert_category_data(logger, email_data["id"], categories)
-        logger.info(f"Airflow - database/loadtoDB.py - load_email_info_to_db() - 'category' contents uploaded to CATEGORY table in database")
+        if not categories:
+            logger.warning(f"Airflow - database/loadtoDB.py - load_email_info_to_db() - No categories assigned to email {email_data['id']}")
+
+        for category in categories or []:
+            categories_data.append({
+                "id"       : str(uuid.uuid4()),
+                "email_id" : str(email_data["id"]),
+                "category" : str(category)
+            })
+
+    logger.info(f"Airflow - database/loadtoDB.py - load_email_info_to_db() - Skipped embedding and labeling for {skipped_count} unchanged emails")
+
+    # Vectors are inserted before the page is committed, so a run that died in between left vectors
+    # the database does not know about; every email is cleared by id first so none is indexed twice
+    # (this also replaces the previous vectors of changed emails)
+    is_cleared = not pending_index or delete_email_vectors(user_email=user_email, email_ids=[email_data["id"] for email_data, _, _ in pending_index], include_attachments=False)
+
+    # Embed and index the page's new and changed emails in batched requests (left unindexed for the next run if they could not be cleared)
+    if is_cleared:
+        indexed = create_embeddings_and_index_batch([(data_to_index, metadata) for _, data_to_index, metadata in pending_index])
+    else:
+        logger.warning(f"Airflow - database/loadtoDB.py - load_email_info_to_db() - Could not clear previous vectors, leaving {len(pending_index)} emails unindexed")
+        indexed = [False] * len(pending_index)
+
+    for (email_data, _, _), is_indexed in zip(pending_index, indexed):
+        email_data["vector_indexed"] = is_indexed
+
+    # Write the whole page (emails, senders, recipients, flags and categories) in one transaction
+    logger.info(f"Airflow - database/loadtoDB.py - load_email_info_to_db() - Loading page contents into the database")
+    bulk_load_email_page(logger, emails_data, senders_data, recipients_data, flags_data, categories_data)
+    logger.info(f"Airflow - database/loadtoDB.py - load_email_info_to_db() - Page contents uploaded to the database")
+
+
+
+# Function to claim a batch of due sync jobs, skipping jobs another DAG run has locked
+def claim_due_jobs(logger, limit, lease_minutes, sync_interval_minutes, email=None):
+    logger.info(f"Airflow - database/loadtoDB.py - claim_due_jobs() - Claiming up to {limit} due jobs")
+
+    claimed_jobs = []
+
+    with postgres_connection() as conn:
+        if not conn:
+            logger.info("Airflow - database/loadtoDB.py - claim_due_jobs() - Failed to connect to database")
+            return claimed_jobs
+
+        # A job is due when it is pending, was last synced more than sync_interval_minutes ago,
+        # or was claimed by a run that died before its lease ran out. Pending jobs go first,
+        # then the least recently synced. Each email is claimed through one job only (queued_jobs.email
+        # is unique, so overlapping runs compete for the same row), and rows locked by a concurrent claim are skipped.
+        claim_query = """
+            WITH candidates AS (
+                SELECT DISTINCT ON (jobs.email) jobs.id, jobs.status, jobs.updated_at, jobs.claimed_at
+                FROM queued_jobs AS jobs
+                WHERE (
+                        jobs.status = 'pending'
+                        OR (jobs.status = 'success' AND jobs.updated_at <= CURRENT_TIMESTAMP - make_interval(mins => %(sync_interval)s))
+                        OR (jobs.status = 'in_progress' AND jobs.claimed_at <= CURRENT_TIMESTAMP - make_interval(mins => %(lease)s))
+                    )
+                    AND (%(email)s::text IS NULL OR jobs.email = %(email)s::text)
+                    AND EXISTS (SELECT 1 FROM users WHERE users.email = jobs.email)
+                    AND NOT EXISTS (
+                        SELECT 1 FROM queued_jobs AS active
+                        WHERE active.email = jobs.email
+                            AND active.status = 'in_progress'
+                            AND active.claimed_at > CURRENT_TIMESTAMP - make_interval(mins => %(lease)s)
+                    )
+                ORDER BY jobs.email, (jobs.status = 'pending') DESC, jobs.updated_at ASC
+            ),
+            due AS (
+                SELECT jobs.id
+                FROM queued_jobs AS jobs
+                JOIN candidates ON candidates.id = jobs.id
+                -- Re-checked once the row is locked: a job another run claimed meanwhile is left alone
+                WHERE jobs.status = candidates.status
+                    AND jobs.claimed_at IS NOT DISTINCT FROM candidates.claimed_at
+                ORDER BY (candidates.status = 'pending') DESC, candidates.updated_at ASC
+                LIMIT %(limit)s
+                FOR UPDATE OF jobs SKIP LOCKED
+            )
+            UPDATE queued_jobs AS jobs
+            SET status = 'in_progress', claimed_at = CURRENT_TIMESTAMP
+            FROM due
+            WHERE jobs.id = due.id
+            RETURNING jobs.id, jobs.email;
+        """
 
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(claim_query, {
+                    "limit"         : limit,
+                    "lease"         : lease_minutes,
+                    "sync_interval" : sync_interval_minutes,
+                    "email"         : email
+                })
+                claimed_jobs = [{"id": job_id, "email": job_email} for job_id, job_email in cursor.fetchall()]
 
+            conn.commit()
+            logger.info(f"Airflow - database/loadtoDB.py - claim_due_jobs() - Claimed {len(claimed_jobs)} jobs")
 
-def fetch_new_job(logger):
-    logger.info("Airflow - database/loadtoDB.py - fetch_new_job() - Fetching job that has not been processed lately")
+        except Exception as e:
+            logger.error(f"Airflow - database/loadtoDB.py - claim_due_jobs() - Error occurred while claiming jobs: {e}")
+            conn.rollback()
+            claimed_jobs = []
 
-    conn = create_connection_to_postgresql()
-    refresh_token = None
+    return claimed_jobs
 
-    if not conn:
-        logger.info("Airflow - database/loadtoDB.py - fetch_new_job() - Failed to connect to database")
-        
-        return refresh_token
-        
-    # If there are pending jobs in the table
-    fetching_pending_jobs_query = """
-        SELECT refresh_token 
-        FROM users 
-        WHERE email IN (
-            SELECT email 
-            FROM queued_jobs 
-            WHERE status = 'pending' 
-            ORDER BY updated_at ASC 
-            LIMIT 1
-        );
-    """
 
-    # If there are no pending jobs in the table, then fetch the job marked
-    # 'success' that was not updated in a while
-    fetching_fresh_jobs_query = """
-        SELECT refresh_token 
-        FROM users 
-        WHERE email IN (
-            SELECT email 
-            FROM queued_jobs 
-            WHERE status = 'success' 
-            ORDER BY updated_at ASC 
-            LIMIT 1
-        );
-    """
+# Function to fetch the stored refresh token of a user
+def fetch_refresh_token(logger, email):
+    logger.info("Airflow - database/loadtoDB.py - fetch_refresh_token() - Fetching refresh token from USERS table")
 
-    try:
-        with conn.cursor() as cursor:
-            logger.info("Airflow - database/loadtoDB.py - fetch_new_job() - Attempting to fetch job that is marked as pending")
-            
-            cursor.execute(fetching_pending_jobs_query)
-            result = cursor.fetchone()
-            
-            if result:
-                refresh_token = result[0]
-                logger.info("Airflow - database/loadtoDB.py - fetch_new_job() - Found a job marked as pending")
-            
-            else:
-                logger.info("Airflow - database/loadtoDB.py - fetch_new_job() - Found no jobs marked as pending")
-                logger.info("Airflow - database/loadtoDB.py - fetch_new_job() - Attempting to fetch job that was not updated recently")
-                
-                cursor.execute(fetching_fresh_jobs_query)
+    refresh_token = None
+
+    with postgres_connection() as conn:
+        if not conn:
+            logger.info("Airflow - database/loadtoDB.py - fetch_refresh_token() - Failed to connect to database")
+            return refresh_token
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT refresh_token FROM users WHERE email = %s LIMIT 1", (email,))
                 result = cursor.fetchone()
-                
+
                 if result:
                     refresh_token = result[0]
-                    logger.info("Airflow - database/loadtoDB.py - fetch_new_job() - Found a job that was not updated recently")
-                
                 else:
-                    logger.warning("Airflow - database/loadtoDB.py - fetch_new_job() - No pending or fresh jobs found")
-                    refresh_token = None
-    
-    except Exception as e:
-        logger.error(f"Airflow - database/loadtoDB.py - Error occurred while fetching new job: {e}", )
-    
-    finally:
-        close_connection(conn)
-        return refresh_token
-    
-
-def update_job_timestamp(logger, email):
-    logger.info("Airflow - database/loadtoDB.py - update_job_timestamp() - Updating job's updated_at timestamp")
-
-    conn = create_connection_to_postgresql()
+                    logger.warning(f"Airflow - database/loadtoDB.py - fetch_refresh_token() - No user found with email {email}")
+
+        except Exception as e:
+            logger.error(f"Airflow - database/loadtoDB.py - fetch_refresh_token() - Error occurred while fetching refresh token: {e}")
+
+    return refresh_token
+
+
+# Function to release the claimed jobs of a user once its sync finished (or failed)
+def complete_jobs(logger, email, succeeded=True):
+    logger.info(f"Airflow - database/loadtoDB.py - complete_jobs() - Releasing jobs for {email}")
+
     update_status = False
 
-    if not conn:
-        logger.info("Airflow - database/loadtoDB.py - update_job_timestamp() - Failed to connect to database")
-        
-        return update_status
+    with postgres_connection() as conn:
+        if not conn:
+            logger.info("Airflow - database/loadtoDB.py - complete_jobs() - Failed to connect to database")
+            return update_status
 
-    try:
-        update_query = """
-            UPDATE queued_jobs 
-            SET updated_at = CURRENT_TIMESTAMP 
-            WHERE email = %s;
+        # Failed syncs go back to 'pending' so the next run retries them first
+        complete_query = """
+            UPDATE queued_jobs
+            SET status = %s, updated_at = CURRENT_TIMESTAMP, claimed_at = NULL
+            WHERE email = %s AND status = 'in_progress';
         """
 
-        with conn.cursor() as cursor:
-            cursor.execute(update_query, (email,))
-            
-            if cursor.rowcount > 0:
-                logger.info(f"Airflow - database/loadtoDB.py - Successfully updated job's updated_at timestamp for email: {email}")
-                
-                conn.commit()
-                update_status = True
-            
-            else:
-                logger.warning(f"Airflow - database/loadtoDB.py - No job found with email {email} to update.")
-                update_status = False
-    
-    except Exception as e:
-        logger.error(f"Error occurred while updating job's timestamp: {e}")
-        update_status = False
-    
-    finally:
-        close_connection(conn)
-        return update_status
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(complete_query, ("success" if succeeded else "pending", email))
+
+                if cursor.rowcount > 0:
+                    logger.info(f"Airflow - database/loadtoDB.py - complete_jobs() - Released {cursor.rowcount} jobs for email: {email}")
+                    update_status = True
+                else:
+                    logger.warning(f"Airflow - database/loadtoDB.py - complete_jobs() - No claimed job found with email {email} to release.")
+
+            conn.commit()
+
+        except Exception as e:
+            logger.error(f"Airflow - database/loadtoDB.py - complete_jobs() - Error occurred while releasing jobs: {e}")
+            conn.rollback()
+
+    return update_status
@@ -0,0 +1,347 @@
+'''
+Versioned, forward-only schema migrations for the Outlook Assistant database.
+
+The Airflow pipeline (database/setupTables.py) and the FastAPI app (app.py) both
+run these at startup. The two are built from separate Docker contexts, so this
+file is kept identical in airflow/dags/database/migrations.py and
+fastapi/database/migrations.py; change both together.
+
+Rules for adding a migration:
+    - append a new (version, name, statements) entry; never edit or reorder an applied one
+    - write statements so they are safe on databases created by the old drop-and-recreate
+      setup (IF NOT EXISTS / ADD COLUMN IF NOT EXISTS), since those have no schema_version rows
+    - each migration runs in its own transaction together with its schema_version row
+'''
+
+# Arbitrary key for pg_advisory_lock(); serializes DAG runs and FastAPI replicas starting together
+MIGRATION_LOCK_ID = 7347001
+
+CREATE_SCHEMA_VERSION_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INT PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+# Secondary indexes for the hot join, filter and sort columns (name -> statement).
+# Applied by migration 6; indexes added later need their own migration.
+INDEXES = {
+    # Joins from emails to its child tables; INCLUDE lets the list/load/thread queries read them from the index
+    "idx_senders_email_id"              : "CREATE INDEX IF NOT EXISTS idx_senders_email_id ON senders (email_id) INCLUDE (email_address, name);",
+    "idx_recipients_email_id"           : "CREATE INDEX IF NOT EXISTS idx_recipients_email_id ON recipients (email_id) INCLUDE (type, email_address, name);",
+    "idx_recipients_email_address"      : "CREATE INDEX IF NOT EXISTS idx_recipients_email_address ON recipients (email_address);",
+    "idx_categories_email_id"           : "CREATE INDEX IF NOT EXISTS idx_categories_email_id ON categories (email_id) INCLUDE (category);",
+    "idx_attachments_email_id"          : "CREATE INDEX IF NOT EXISTS idx_attachments_email_id ON attachments (email_id);",
+
+    # Mailbox listing (folder, newest first) and thread lookups (conversation, oldest first)
+    "idx_emails_folder_received"        : "CREATE INDEX IF NOT EXISTS idx_emails_folder_received ON emails (parent_folder_id, received_datetime DESC);",
+    "idx_emails_conversation_sent"      : "CREATE INDEX IF NOT EXISTS idx_emails_conversation_sent ON emails (conversation_id, sent_datetime);",
+    "idx_email_folders_display_name"    : "CREATE INDEX IF NOT EXISTS idx_email_folders_display_name ON email_folders (display_name);",
+
+    # Job claiming (status, least recently synced first) and per-user job updates
+    "idx_queued_jobs_status_updated"    : "CREATE INDEX IF NOT EXISTS idx_queued_jobs_status_updated ON queued_jobs (status, updated_at);",
+    "idx_queued_jobs_email"             : "CREATE INDEX IF NOT EXISTS idx_queued_jobs_email ON queued_jobs (email);",
+
+    # Attachment ledger: only the user's pending messages are indexed
+    "idx_emails_pending_attachments"    : "CREATE INDEX IF NOT EXISTS idx_emails_pending_attachments ON emails (user_email, received_datetime) WHERE attachments_status = 'pending';",
+}
+
+# (version, name, statements) in the order they are applied
+MIGRATIONS = [
+    (1, "baseline tables", [
+        """
+            CREATE TABLE IF NOT EXISTS users (
+                id VARCHAR(255) PRIMARY KEY,
+                tenant_id VARCHAR(255),
+                name VARCHAR(255),
+                email VARCHAR(255) UNIQUE,
+                token_type VARCHAR(50),
+                access_token TEXT,
+                refresh_token TEXT,
+                id_token TEXT,
+                scope TEXT,
+                token_source VARCHAR(50),
+                issued_at TIMESTAMP,
+                expires_at TIMESTAMP,
+                nonce VARCHAR(255)
+            );
+        """,
+        """
+            CREATE TABLE IF NOT EXISTS emails (
+                body TEXT DEFAULT NULL,
+                body_preview TEXT DEFAULT NULL,
+                change_key VARCHAR(255) DEFAULT NULL,
+                content_type VARCHAR(255) DEFAULT 'html',
+                conversation_id VARCHAR(255) DEFAULT NULL,
+                conversation_index TEXT DEFAULT NULL,
+                created_datetime TIMESTAMPTZ DEFAULT NULL,
+                created_datetime_timezone VARCHAR(50) DEFAULT NULL,
+                end_datetime TIMESTAMPTZ DEFAULT NULL,
+                end_datetime_timezone VARCHAR(50) DEFAULT NULL,
+                has_attachments BOOLEAN DEFAULT FALSE,
+                id VARCHAR(255) PRIMARY KEY,
+                importance VARCHAR(50) DEFAULT NULL,
+                inference_classification VARCHAR(50) DEFAULT NULL,
+                is_draft BOOLEAN DEFAULT FALSE,
+                is_read BOOLEAN DEFAULT NULL,
+                is_all_day BOOLEAN DEFAULT NULL,
+                is_out_of_date BOOLEAN DEFAULT NULL,
+                meeting_message_type VARCHAR(255) DEFAULT NULL,
+                meeting_request_type VARCHAR(255) DEFAULT NULL,
+                odata_etag TEXT DEFAULT NULL,
+                odata_value TEXT DEFAULT NULL,
+                parent_folder_id VARCHAR(255) DEFAULT NULL,
+                received_datetime TIMESTAMPTZ DEFAULT NULL,
+                recurrence TEXT DEFAULT NULL,
+                reply_to TEXT DEFAULT NULL,
+                response_type VARCHAR(50) DEFAULT NULL,
+                sent_datetime TIMESTAMPTZ DEFAULT NULL,
+                start_datetime TIMESTAMPTZ DEFAULT NULL,
+                start_datetime_timezone VARCHAR(50) DEFAULT NULL,
+                subject TEXT DEFAULT NULL,
+                type VARCHAR(50) DEFAULT NULL,
+                web_link TEXT DEFAULT NULL,
+                vector_indexed BOOLEAN DEFAULT FALSE
+            );
+        """,
+        """
+            CREATE TABLE IF NOT EXISTS recipients (
+                id VARCHAR(255) PRIMARY KEY,
+                email_id VARCHAR(255) REFERENCES emails(id),
+                type VARCHAR(50),
+                email_address VARCHAR(255),
+                name VARCHAR(255)
+            );
+        """,
+        """
+            CREATE TABLE IF NOT EXISTS senders (
+                id VARCHAR(255) PRIMARY KEY,
+                email_id VARCHAR(255) REFERENCES emails(id),
+                email_address VARCHAR(255),
+                name VARCHAR(255)
+            );
+        """,
+        """
+            CREATE TABLE IF NOT EXISTS attachments (
+                id VARCHAR(255) PRIMARY KEY,
+                email_id VARCHAR(255) REFERENCES emails(id),
+                name TEXT,
+                content_type TEXT,
+                size BIGINT,
+                bucket_url TEXT
+            );
+        """,
+        """
+            CREATE TABLE IF NOT EXISTS flags (
+                email_id VARCHAR(255) PRIMARY KEY REFERENCES emails(id),
+                flag_status VARCHAR(50)
+            );
+        """,
+        """
+            CREATE TABLE IF NOT EXISTS categories (
+                id VARCHAR(255) PRIMARY KEY,
+                email_id VARCHAR(255) REFERENCES emails(id),
+                category TEXT,
+                user_defined_category TEXT
+            );
+        """,
+        """
+            CREATE TABLE IF NOT EXISTS queued_jobs (
+                id SERIAL PRIMARY KEY,
+                email VARCHAR(255),
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                status VARCHAR(50),
+                updated_at TIMESTAMP DEFAULT '1970-01-01 00:00:00'
+            );
+        """,
+        """
+            CREATE TABLE IF NOT EXISTS email_links (
+                id VARCHAR(255) PRIMARY KEY,
+                email VARCHAR(255) UNIQUE,
+                current_link TEXT DEFAULT NULL,
+                next_link TEXT DEFAULT NULL,
+                is_current_link_processed BOOLEAN DEFAULT FALSE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """,
+        """
+            CREATE TABLE IF NOT EXISTS email_folders (
+                id VARCHAR(255) PRIMARY KEY,
+                display_name VARCHAR(255) NOT NULL,
+                parent_folder_id VARCHAR(255),
+                child_folder_count INT DEFAULT 0,
+                unread_item_count INT DEFAULT 0,
+                total_item_count INT DEFAULT 0,
+                size_in_bytes BIGINT DEFAULT 0,
+                is_hidden BOOLEAN DEFAULT FALSE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """,
+    ]),
+
+    (2, "per-folder delta links", [
+        "ALTER TABLE email_links ADD COLUMN IF NOT EXISTS delta_links JSONB DEFAULT '{}'::jsonb;",
+    ]),
+
+    (3, "job claim leases", [
+        "ALTER TABLE queued_jobs ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP DEFAULT NULL;",
+    ]),
+
+    (4, "email content hash", [
+        "ALTER TABLE emails ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64) DEFAULT NULL;",
+    ]),
+
+    (5, "attachment ledger", [
+        "ALTER TABLE emails ADD COLUMN IF NOT EXISTS user_email VARCHAR(255) DEFAULT NULL;",
+        "ALTER TABLE emails ADD COLUMN IF NOT EXISTS attachments_status VARCHAR(20) DEFAULT NULL;",
+        "ALTER TABLE emails ADD COLUMN IF NOT EXISTS attachments_attempts INT DEFAULT 0;",
+
+        # Existing rows: the owning mailbox is the user who received or sent the email
+        """
+            UPDATE emails e
+            SET user_email = u.email
+            FROM users u
+            WHERE e.user_email IS NULL
+                AND (
+                    EXISTS (SELECT 1 FROM recipients r WHERE r.email_id = e.id AND r.email_address = u.email)
+                    OR EXISTS (SELECT 1 FROM senders s WHERE s.email_id = e.id AND s.email_address = u.email)
+                );
+        """,
+
+        # Existing attachment rows mean the email was already handled by the old full scan
+        """
+            UPDATE emails e
+            SET attachments_status = CASE
+                WHEN EXISTS (SELECT 1 FROM attachments a WHERE a.email_id = e.id) THEN 'processed'
+                ELSE 'pending'
+            END
+            WHERE e.has_attachments = TRUE AND e.attachments_status IS NULL;
+        """,
+    ]),
+
+    (6, "secondary indexes", list(INDEXES.values())),
+
+    (7, "content-addressed attachment blobs", [
+        """
+            CREATE TABLE IF NOT EXISTS attachment_blobs (
+                sha256 CHAR(64) PRIMARY KEY,
+                size BIGINT,
+                content_type TEXT,
+                bucket_url TEXT,
+                extracted_text TEXT DEFAULT NULL,
+                extracted_at TIMESTAMP DEFAULT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """,
+        """
+            CREATE TABLE IF NOT EXISTS attachment_blob_embeddings (
+                sha256 CHAR(64) REFERENCES attachment_blobs(sha256),
+                user_email VARCHAR(255),
+                embedded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (sha256, user_email)
+            );
+        """,
+        "ALTER TABLE attachments ADD COLUMN IF NOT EXISTS content_hash CHAR(64) REFERENCES attachment_blobs(sha256);",
+        "CREATE INDEX IF NOT EXISTS idx_attachments_content_hash ON attachments (content_hash);",
+    ]),
+    (8, "embedding cache", [
+        """
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                model VARCHAR(255),
+                dimensions INTEGER,
+                input_sha256 CHAR(64),
+                embedding BYTEA NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (model, dimensions, input_sha256)
+            );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_used_at ON embedding_cache (last_used_at);",
+    ]),
+    (9, "one queued job per email", [
+        # Keep the job a run holds (or else the pending one, else the most recent) for each email
+        """
+            DELETE FROM queued_jobs AS jobs
+            USING (
+                SELECT id, ROW_NUMBER() OVER (
+                    PARTITION BY email
+                    ORDER BY COALESCE(status = 'in_progress', FALSE) DESC,
+                        COALESCE(status = 'pending', FALSE) DESC,
+                        updated_at DESC NULLS LAST,
+                        id DESC
+                ) AS position
+                FROM queued_jobs
+                WHERE email IS NOT NULL
+            ) AS ranked
+            WHERE jobs.id = ranked.id AND ranked.position > 1;
+        """,
+        "ALTER TABLE queued_jobs ADD CONSTRAINT queued_jobs_email_key UNIQUE (email);",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+# Function to read the applied schema version (0 for a database without schema_version rows)
+def get_schema_version(cursor):
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version;")
+    return cursor.fetchone()[0]
+
+
+# Function to apply every pending migration in order on an open psycopg2 connection
+def run_migrations(logger, conn):
+    ''' Bring the schema up to LATEST_VERSION and return the resulting version; raises if a migration fails '''
+
+    cursor = conn.cursor()
+
+    try:
+        # Session-level lock: held across the per-migration commits, released in finally
+        cursor.execute("SELECT pg_advisory_lock(%s);", (MIGRATION_LOCK_ID,))
+        cursor.execute(CREATE_SCHEMA_VERSION_TABLE)
+        conn.commit()
+
+        current_version = get_schema_version(cursor)
+        conn.commit()
+
+        # An older build starting against a newer schema leaves it alone
+        if current_version > LATEST_VERSION:
+            logger.warning(f"MIGRATIONS - run_migrations() - Database schema is at version {current_version}, newer than this build ({LATEST_VERSION}); nothing to apply")
+            return current_version
+
+        if current_version == LATEST_VERSION:
+            logger.info(f"MIGRATIONS - run_migrations() - Database schema is up to date (version {current_version})")
+            return current_version
+
+        for version, name, statements in MIGRATIONS:
+            if version <= current_version:
+                continue
+
+            logger.info(f"MIGRATIONS - run_migrations() - Applying migration {version} ({name})")
+
+            try:
+                for statement in statements:
+                    cursor.execute(statement)
+
+                cursor.execute("INSERT INTO schema_version (version, name) VALUES (%s, %s);", (version, name))
+                conn.commit()
+
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"MIGRATIONS - run_migrations() - Migration {version} ({name}) failed, schema left at version {current_version}: {e}")
+                raise
+
+            current_version = version
+
+        logger.info(f"MIGRATIONS - run_migrations() - Database schema migrated to version {current_version}")
+        return current_version
+
+    finally:
+        try:
+            cursor.execute("SELECT pg_advisory_unlock(%s);", (MIGRATION_LOCK_ID,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+
+        cursor.close()
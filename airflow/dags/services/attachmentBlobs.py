@@ -0,0 +1,264 @@
+import io
+import os
+import hashlib
+from database.connectDB import postgres_connection
+from services.vectors import embed_attachment_records, delete_blob_vectors
+
+
+class HashingReader:
+    ''' File-like wrapper that hashes (SHA-256) and counts the bytes read through it; `prefix` is returned before the stream '''
+
+    def __init__(self, stream, prefix=b""):
+        self.stream = stream
+        self.prefix = io.BytesIO(prefix)
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size=-1):
+        chunk = self.prefix.read(size)
+
+        if not chunk:
+            chunk = self.stream.read(size)
+
+        self.sha256.update(chunk)
+        self.size += len(chunk)
+        return chunk
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+
+# Function to read at most `limit` bytes from a stream (one read() may return less than asked)
+def read_up_to(stream, limit):
+    buffer = io.BytesIO()
+
+    while buffer.tell() < limit:
+        chunk = stream.read(min(limit - buffer.tell(), 1024 * 1024))
+        if not chunk:
+            break
+        buffer.write(chunk)
+
+    return buffer.getvalue()
+
+
+# Function to build the content-addressed S3 key of a blob
+def get_blob_key(content_hash):
+    return f"blobs/{content_hash[:2]}/{content_hash}"
+
+
+# Function to fetch a stored blob by its content hash
+def fetch_attachment_blob(logger, content_hash):
+    query = """
+        SELECT sha256, size, content_type, bucket_url, extracted_text
+        FROM attachment_blobs
+        WHERE sha256 = %s;
+    """
+
+    with postgres_connection() as conn:
+        if not conn:
+            logger.error(f"Airflow - services/attachmentBlobs.py - fetch_attachment_blob() - Failed to connect to the database.")
+            return None
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(query, (content_hash,))
+                row = cursor.fetchone()
+
+                if not row:
+                    return None
+
+                return {
+                    "sha256"         : row[0],
+                    "size"           : row[1],
+                    "content_type"   : row[2],
+                    "bucket_url"     : row[3],
+                    "extracted_text" : row[4]
+                }
+
+        except Exception as e:
+            logger.error(f"Airflow - services/attachmentBlobs.py - fetch_attachment_blob() - Error fetching blob {content_hash}: {e}")
+            return None
+
+
+# Function to record a blob after its contents are in S3 (concurrent writers of the same blob are fine)
+def insert_attachment_blob(logger, content_hash, size, content_type, bucket_url):
+    query = """
+        INSERT INTO attachment_blobs (sha256, size, content_type, bucket_url)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (sha256) DO NOTHING;
+    """
+
+    with postgres_connection() as conn:
+        if not conn:
+            logger.error(f"Airflow - services/attachmentBlobs.py - insert_attachment_blob() - Failed to connect to the database.")
+            return False
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(query, (content_hash, size, content_type, bucket_url))
+                conn.commit()
+                return True
+
+        except Exception as e:
+            logger.error(f"Airflow - services/attachmentBlobs.py - insert_attachment_blob() - Error inserting blob {content_hash}: {e}")
+            conn.rollback()
+            return False
+
+
+# Function to store the extracted text of a blob so later copies skip extraction (and image summaries)
+def save_blob_extracted_text(logger, content_hash, extracted_text):
+    query = """
+        UPDATE attachment_blobs
+        SET extracted_text = %s, extracted_at = CURRENT_TIMESTAMP
+        WHERE sha256 = %s;
+    """
+
+    with postgres_connection() as conn:
+        if not conn:
+            logger.error(f"Airflow - services/attachmentBlobs.py - save_blob_extracted_text() - Failed to connect to the database.")
+            return
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(query, (extracted_text, content_hash))
+                conn.commit()
+
+        except Exception as e:
+            logger.error(f"Airflow - services/attachmentBlobs.py - save_blob_extracted_text() - Error saving text for blob {content_hash}: {e}")
+            conn.rollback()
+
+
+# Function to get which of the given blobs are already embedded in the user's attachment collection
+def fetch_embedded_blobs(logger, user_email, content_hashes):
+    if not content_hashes:
+        return set()
+
+    query = """
+        SELECT sha256
+        FROM attachment_blob_embeddings
+        WHERE user_email = %s AND sha256 = ANY(%s);
+    """
+
+    with postgres_connection() as conn:
+        if not conn:
+            logger.error(f"Airflow - services/attachmentBlobs.py - fetch_embedded_blobs() - Failed to connect to the database.")
+            return set()
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(query, (user_email, list(content_hashes)))
+                return {row[0] for row in cursor.fetchall()}
+
+        except Exception as e:
+            logger.error(f"Airflow - services/attachmentBlobs.py - fetch_embedded_blobs() - Error fetching embedded blobs: {e}")
+            return set()
+
+
+# Function to record that blobs were embedded for a user
+def mark_blobs_embedded(logger, user_email, content_hashes):
+    if not content_hashes:
+        return
+
+    query = """
+        INSERT INTO attachment_blob_embeddings (sha256, user_email)
+        SELECT UNNEST(%s::text[]), %s
+        ON CONFLICT DO NOTHING;
+    """
+
+    with postgres_connection() as conn:
+        if not conn:
+            logger.error(f"Airflow - services/attachmentBlobs.py - mark_blobs_embedded() - Failed to connect to the database.")
+            return
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(query, (list(content_hashes), user_email))
+                conn.commit()
+                logger.info(f"Airflow - services/attachmentBlobs.py - mark_blobs_embedded() - Marked {len(content_hashes)} blobs as embedded for {user_email}")
+
+        except Exception as e:
+            logger.error(f"Airflow - services/attachmentBlobs.py - mark_blobs_embedded() - Error marking blobs as embedded: {e}")
+            conn.rollback()
+
+
+# Function to embed extracted attachments whose blob is not yet in the user's attachment collection (False when embedding failed)
+def embed_new_blobs(logger, user_email, extracted_data):
+    embedded = fetch_embedded_blobs(logger, user_email, {record["content_hash"] for record in extracted_data})
+
+    records = []
+    for record in extracted_data:
+        if record["content_hash"] not in embedded:
+            embedded.add(record["content_hash"])
+            records.append(record)
+
+    logger.info(f"Airflow - services/attachmentBlobs.py - embed_new_blobs() - Embedding {len(records)} of {len(extracted_data)} extracted attachments (others are copies of embedded blobs)")
+
+    if not records:
+        return True
+
+    # Vectors of a blob that is not marked embedded are left over from an attempt that failed part way
+    if not delete_blob_vectors(user_email, {record["content_hash"] for record in records}):
+        return False
+
+    if not embed_attachment_records(records):
+        return False
+
+    mark_blobs_embedded(logger, user_email, [record["content_hash"] for record in records])
+    return True
+
+
+# Function to move an attachment's contents from Graph into the content-addressed blob store
+def store_attachment_blob(logger, s3_client, transfer_config, response_stream, s3_bucket_name, staging_key, content_type):
+    '''
+    Return (blob, data): the attachment_blobs row for the contents and, when they fit
+    ATTACHMENT_INLINE_EXTRACT_MAX_MB, the bytes as a BytesIO (otherwise None).
+
+    Contents that fit in memory are hashed before anything is written, so a known blob
+    costs no S3 request. Larger ones are streamed to `staging_key` while being hashed,
+    then copied to their blob key (or dropped when the blob already exists).
+    '''
+
+    max_bytes = int(float(os.getenv("ATTACHMENT_INLINE_EXTRACT_MAX_MB", "25")) * 1024 * 1024)
+    extra_args = {"ContentType": content_type or "application/octet-stream"}
+
+    head = read_up_to(response_stream, max_bytes + 1)
+
+    if len(head) <= max_bytes:
+        content_hash = hashlib.sha256(head).hexdigest()
+        size = len(head)
+        data = io.BytesIO(head)
+        staged = False
+
+    else:
+        reader = HashingReader(response_stream, prefix=head)
+        s3_client.upload_fileobj(reader, s3_bucket_name, staging_key, ExtraArgs=extra_args, Config=transfer_config)
+
+        content_hash = reader.hexdigest()
+        size = reader.size
+        data = None
+        staged = True
+
+    blob = fetch_attachment_blob(logger, content_hash)
+
+    if blob:
+        logger.info(f"Airflow - services/attachmentBlobs.py - store_attachment_blob() - Blob {content_hash} already stored, reusing it")
+
+    else:
+        blob_key = get_blob_key(content_hash)
+
+        if staged:
+            s3_client.copy({"Bucket": s3_bucket_name, "Key": staging_key}, s3_bucket_name, blob_key, ExtraArgs=extra_args, Config=transfer_config)
+        else:
+            s3_client.upload_fileobj(data, s3_bucket_name, blob_key, ExtraArgs=extra_args, Config=transfer_config)
+            data.seek(0)
+
+        bucket_url = f"s3://{s3_bucket_name}/{blob_key}"
+        if not insert_attachment_blob(logger, content_hash, size, content_type, bucket_url):
+            raise RuntimeError(f"Failed to record blob {content_hash}")
+
+        blob = {"sha256": content_hash, "size": size, "content_type": content_type, "bucket_url": bucket_url, "extracted_text": None}
+
+    if staged:
+        s3_client.delete_object(Bucket=s3_bucket_name, Key=staging_key)
+
+    return blob, data
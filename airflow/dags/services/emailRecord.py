@@ -0,0 +1,136 @@
+from dataclasses import dataclass, field
+
+from services.htmlNormalizer import normalize_text, normalize_body
+
+
+# Function to normalize an optional text value, keeping missing values as None
+def optional_text(value):
+    return None if value is None else normalize_text(value)
+
+
+@dataclass(slots=True)
+class EmailAddress:
+    ''' Name and address of a sender, recipient or reply-to entry '''
+
+    name: str = ""
+    address: str = ""
+
+    @classmethod
+    def from_graph(cls, recipient):
+        ''' Build from a Graph recipient resource: {"emailAddress": {"name": ..., "address": ...}} '''
+
+        email_address = (recipient or {}).get("emailAddress") or {}
+        return cls(
+            name    = normalize_text(email_address.get("name") or ""),
+            address = normalize_text(email_address.get("address") or "")
+        )
+
+    def to_graph(self):
+        return {"emailAddress": {"name": self.name, "address": self.address}}
+
+
+@dataclass(slots=True)
+class EmailRecord:
+    ''' Normalized Graph message with its structured fields (addresses, flag, recurrence) kept intact '''
+
+    id: str
+    body: str = ""
+    content_type: str = "html"
+    body_preview: str | None = None
+    change_key: str | None = None
+    conversation_id: str | None = None
+    conversation_index: str | None = None
+    created_datetime: str | None = None
+    sent_datetime: str | None = None
+    received_datetime: str | None = None
+    start_datetime: str | None = None
+    start_datetime_timezone: str | None = None
+    end_datetime: str | None = None
+    end_datetime_timezone: str | None = None
+    has_attachments: bool = False
+    importance: str | None = None
+    inference_classification: str | None = None
+    is_draft: bool = False
+    is_read: bool = False
+    is_all_day: bool = False
+    is_out_of_date: bool = False
+    meeting_message_type: str | None = None
+    meeting_request_type: str | None = None
+    odata_etag: str | None = None
+    odata_value: str | None = None
+    parent_folder_id: str | None = None
+    recurrence: dict | None = None
+    response_type: str | None = None
+    subject: str | None = None
+    type: str | None = None
+    web_link: str | None = None
+    flag_status: str = ""
+    sender: EmailAddress | None = None
+    reply_to: list[EmailAddress] = field(default_factory=list)
+    to_recipients: list[EmailAddress] = field(default_factory=list)
+    cc_recipients: list[EmailAddress] = field(default_factory=list)
+    bcc_recipients: list[EmailAddress] = field(default_factory=list)
+
+    @classmethod
+    def from_graph(cls, message, body):
+        '''
+        Build a record from a Graph message resource.
+
+        `body` is the already normalized body text (see process_email_response()).
+        Text values are passed through normalize_text(); booleans, missing values
+        and nested resources keep their types.
+        '''
+
+        start = message.get("startDateTime") or {}
+        end = message.get("endDateTime") or {}
+        sender = (message.get("sender") or {}).get("emailAddress")
+
+        return cls(
+            id                          = message.get("id"),
+            body                        = body,
+            content_type                = normalize_text((message.get("body") or {}).get("contentType") or "html"),
+            body_preview                = optional_text(message.get("bodyPreview")),
+            change_key                  = optional_text(message.get("changeKey")),
+            conversation_id             = optional_text(message.get("conversationId")),
+            conversation_index          = optional_text(message.get("conversationIndex")),
+            created_datetime            = optional_text(message.get("createdDateTime")) or None,
+            sent_datetime               = optional_text(message.get("sentDateTime")) or None,
+            received_datetime           = optional_text(message.get("receivedDateTime")) or None,
+            start_datetime              = optional_text(start.get("dateTime")) or None,
+            start_datetime_timezone     = optional_text(start.get("timeZone")) or None,
+            end_datetime                = optional_text(end.get("dateTime")) or None,
+            end_datetime_timezone       = optional_text(end.get("timeZone")) or None,
+            has_attachments             = bool(message.get("hasAttachments", False)),
+            importance                  = optional_text(message.get("importance")),
+            inference_classification    = optional_text(message.get("inferenceClassification")),
+            is_draft                    = bool(message.get("isDraft", False)),
+            is_read                     = bool(message.get("isRead", False)),
+            is_all_day                  = bool(message.get("isAllDay", False)),
+            is_out_of_date              = bool(message.get("isOutOfDate", False)),
+            meeting_message_type        = optional_text(message.get("meetingMessageType")),
+            meeting_request_type        = optional_text(message.get("meetingRequestType")),
+            odata_etag                  = optional_text(message.get("@odata.etag")),
+            odata_value                 = optional_text(message.get("@odata.value")),
+            parent_folder_id            = optional_text(message.get("parentFolderId")),
+            recurrence                  = message.get("recurrence") or None,
+            response_type               = optional_text(message.get("responseType")),
+            subject                     = optional_text(message.get("subject")),
+            type                        = optional_text(message.get("type")),
+            web_link                    = optional_text(message.get("webLink")),
+            flag_status                 = normalize_text((message.get("flag") or {}).get("flagStatus") or ""),
+
+            # Calendar reminders and some system messages come without a sender address
+            sender                      = EmailAddress.from_graph({"emailAddress": sender}) if sender else None,
+            reply_to                    = [EmailAddress.from_graph(item) for item in message.get("replyTo") or []],
+            to_recipients               = [EmailAddress.from_graph(item) for item in message.get("toRecipients") or []],
+            cc_recipients               = [EmailAddress.from_graph(item) for item in message.get("ccRecipients") or []],
+            bcc_recipients              = [EmailAddress.from_graph(item) for item in message.get("bccRecipients") or []]
+        )
+
+
+# Function to turn a raw Graph message into an EmailRecord (top-level so process pools can pickle it)
+def format_email(message):
+    ''' Return (EmailRecord, fallback_error) for a Graph message '''
+
+    body, fallback_error = normalize_body(message.get("body"))
+    return EmailRecord.from_graph(message, body=body), fallback_error
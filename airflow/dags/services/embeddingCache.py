@@ -0,0 +1,135 @@
+import os
+import time
+import hashlib
+import numpy as np
+from psycopg2.extras import execute_values
+from database.connectDB import postgres_connection
+
+# A hit refreshes last_used_at at most this often, so repeated hits do not rewrite the row every time
+TOUCH_INTERVAL_MINUTES = 60
+
+# Each process checks the row bound at most this often instead of on every store
+EVICT_INTERVAL_SECONDS = 600
+_last_eviction_check = None
+
+
+# Function to hash an embedding input (the cache key together with the model and dimensions)
+def get_input_hash(text):
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+# Function to get the cache settings: whether it is on and its row bound
+def get_cache_settings():
+    is_enabled = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+    max_entries = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "100000"))
+
+    return is_enabled, max_entries
+
+
+# Function to fetch cached embeddings for the given input hashes, marking them as recently used
+def fetch_cached_embeddings(logger, model, dimensions, input_hashes):
+    if not input_hashes:
+        return {}
+
+    query = """
+        SELECT input_sha256, embedding
+        FROM embedding_cache
+        WHERE model = %s AND dimensions = %s AND input_sha256 = ANY(%s);
+    """
+
+    touch_query = """
+        UPDATE embedding_cache
+        SET last_used_at = CURRENT_TIMESTAMP
+        WHERE model = %s AND dimensions = %s AND input_sha256 = ANY(%s)
+            AND last_used_at < CURRENT_TIMESTAMP - make_interval(mins => %s);
+    """
+
+    with postgres_connection() as conn:
+        if not conn:
+            logger.error(f"Airflow - services/embeddingCache.py - fetch_cached_embeddings() - Failed to connect to the database.")
+            return {}
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(query, (model, dimensions, list(input_hashes)))
+
+                cached = {
+                    input_hash: np.frombuffer(bytes(embedding), dtype=np.float32).tolist()
+                    for input_hash, embedding in cursor.fetchall()
+                }
+
+                if cached:
+                    cursor.execute(touch_query, (model, dimensions, list(cached), TOUCH_INTERVAL_MINUTES))
+
+            conn.commit()
+            return cached
+
+        except Exception as e:
+            logger.error(f"Airflow - services/embeddingCache.py - fetch_cached_embeddings() - Error reading the embedding cache: {e}")
+            conn.rollback()
+            return {}
+
+
+# Function to check whether the cache is due an eviction pass (at most once per EVICT_INTERVAL_SECONDS per process)
+def is_eviction_due():
+    global _last_eviction_check
+
+    now = time.monotonic()
+    if _last_eviction_check is not None and now - _last_eviction_check < EVICT_INTERVAL_SECONDS:
+        return False
+
+    _last_eviction_check = now
+    return True
+
+
+# Function to store new embeddings, then evict the least recently used rows once there are more than `max_entries`
+def store_embeddings(logger, model, dimensions, embeddings, max_entries):
+    if not embeddings:
+        return
+
+    insert_query = """
+        INSERT INTO embedding_cache (model, dimensions, input_sha256, embedding)
+        VALUES %s
+        ON CONFLICT (model, dimensions, input_sha256) DO NOTHING;
+    """
+
+    count_query = "SELECT COUNT(*) FROM embedding_cache;"
+
+    evict_query = """
+        DELETE FROM embedding_cache
+        WHERE (model, dimensions, input_sha256) IN (
+            SELECT model, dimensions, input_sha256
+            FROM embedding_cache
+            ORDER BY last_used_at DESC
+            OFFSET %s
+        );
+    """
+
+    # Stored as float32, the precision Milvus keeps for FLOAT_VECTOR fields
+    rows = [
+        (model, dimensions, input_hash, np.asarray(embedding, dtype=np.float32).tobytes())
+        for input_hash, embedding in embeddings.items()
+    ]
+
+    with postgres_connection() as conn:
+        if not conn:
+            logger.error(f"Airflow - services/embeddingCache.py - store_embeddings() - Failed to connect to the database.")
+            return
+
+        try:
+            with conn.cursor() as cursor:
+                execute_values(cursor, insert_query, rows)
+
+                # The sorted scan behind the eviction only runs once the cache is past its bound
+                if max_entries > 0 and is_eviction_due():
+                    cursor.execute(count_query)
+
+                    if cursor.fetchone()[0] > max_entries:
+                        cursor.execute(evict_query, (max_entries,))
+                        logger.info(f"Airflow - services/embeddingCache.py - store_embeddings() - Evicted {cursor.rowcount} least recently used embeddings")
+
+            conn.commit()
+
+        except Exception as e:
+            logger.error(f"Airflow - services/embeddingCache.py - store_embeddings() - Error writing the embedding cache: {e}")
+            conn.rollback()
@@ -0,0 +1,218 @@
+import os
+import time
+import threading
+import tiktoken
+import openai
+from openai import OpenAI
+
+from services.embeddingCache import get_input_hash, get_cache_settings, fetch_cached_embeddings, store_embeddings
+
+# Per-request limits of the OpenAI embeddings endpoint
+MAX_INPUTS_PER_REQUEST = 2048
+MAX_TOKENS_PER_REQUEST = 300000
+
+# Per-input limit of the text-embedding-3 models
+MAX_TOKENS_PER_INPUT = 8191
+
+# Per-process client state (one HTTP connection pool shared by every embedding call)
+_client = None
+_encoder = None
+_state_lock = threading.Lock()
+
+
+def _get_client():
+    ''' Share one OpenAI client (and its keep-alive connections) across embedding calls '''
+
+    global _client
+
+    with _state_lock:
+        if _client is None:
+            _client = OpenAI(
+                api_key      = os.getenv("OPENAI_API_KEY"),
+                project      = os.getenv("PROJECT_ID"),
+                organization = os.getenv("ORGANIZATION_ID"),
+                max_retries  = int(os.getenv("EMBEDDING_MAX_RETRIES", "5"))
+            )
+
+        return _client
+
+
+def _get_encoder():
+    ''' Tokenizer of the text-embedding-3 models, loaded once per process '''
+
+    global _encoder
+
+    with _state_lock:
+        if _encoder is None:
+            _encoder = tiktoken.get_encoding("cl100k_base")
+
+        return _encoder
+
+
+# Function to get the size of the embeddings requested from the API (and of the Milvus vector field)
+def get_embedding_dimensions():
+    return int(os.getenv("EMBEDDING_DIMENSIONS", "3072"))
+
+
+# Function to get the request limits, capped at what the API accepts
+def get_batch_limits():
+    max_inputs = min(int(os.getenv("EMBEDDING_BATCH_MAX_INPUTS", str(MAX_INPUTS_PER_REQUEST))), MAX_INPUTS_PER_REQUEST)
+    max_tokens = min(int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "250000")), MAX_TOKENS_PER_REQUEST)
+
+    return max(1, max_inputs), max(MAX_TOKENS_PER_INPUT, max_tokens)
+
+
+# Function to tokenize the inputs, truncating any input past the model's per-input limit
+def prepare_inputs(logger, texts):
+    encoder = _get_encoder()
+    inputs = []
+
+    for index, text in enumerate(texts):
+        tokens = encoder.encode(text or " ", disallowed_special=())
+
+        if len(tokens) > MAX_TOKENS_PER_INPUT:
+            logger.warning(f"Airflow - services/embeddingClient.py - prepare_inputs() - Input {index} has {len(tokens)} tokens, truncating to {MAX_TOKENS_PER_INPUT}")
+            tokens = tokens[:MAX_TOKENS_PER_INPUT]
+            text = encoder.decode(tokens)
+
+        inputs.append((text or " ", len(tokens)))
+
+    return inputs
+
+
+# Function to pack input indexes into requests that stay under the input and token limits
+def pack_batches(inputs, max_inputs, max_tokens):
+    batches = []
+    batch = []
+    batch_tokens = 0
+
+    for index, (_, token_count) in enumerate(inputs):
+        if batch and (len(batch) >= max_inputs or batch_tokens + token_count > max_tokens):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+
+        batch.append(index)
+        batch_tokens += token_count
+
+    if batch:
+        batches.append(batch)
+
+    return batches
+
+
+# Function to embed one packed batch, splitting it when the API rejects its contents
+def embed_batch(logger, inputs, batch, model, dimensions, embeddings):
+    attempts = int(os.getenv("EMBEDDING_BATCH_ATTEMPTS", "3"))
+
+    for attempt in range(1, attempts + 1):
+        try:
+            response = _get_client().embeddings.create(
+                input      = [inputs[index][0] for index in batch],
+                model      = model,
+                dimensions = dimensions
+            )
+
+            # Results carry the position of their input; never rely on response order
+            for item in response.data:
+                embeddings[batch[item.index]] = item.embedding
+
+            return
+
+        except openai.BadRequestError as exception:
+            # A rejected input fails the whole request: halve the batch to isolate it
+            if len(batch) == 1:
+                logger.error(f"Airflow - services/embeddingClient.py - embed_batch() - Input {batch[0]} was rejected = {exception}")
+                return
+
+            middle = len(batch) // 2
+            embed_batch(logger, inputs, batch[:middle], model, dimensions, embeddings)
+            embed_batch(logger, inputs, batch[middle:], model, dimensions, embeddings)
+            return
+
+        except Exception as exception:
+            # The client already retried throttling and transient errors; back off before trying the batch again
+            logger.warning(f"Airflow - services/embeddingClient.py - embed_batch() - Batch of {len(batch)} inputs failed (attempt {attempt}/{attempts}) = {exception}")
+
+            if attempt < attempts:
+                time.sleep(min(2 ** attempt, 30))
+
+    logger.error(f"Airflow - services/embeddingClient.py - embed_batch() - Giving up on a batch of {len(batch)} inputs")
+
+
+# Function to embed texts in as few requests as the API limits allow
+def request_embeddings(logger, texts, model, dimensions):
+    '''
+    Return one embedding of `dimensions` values per text, in the order of `texts`; inputs
+    that could not be embedded are None. Texts are packed into requests of at most EMBEDDING_BATCH_MAX_INPUTS
+    inputs and EMBEDDING_BATCH_MAX_TOKENS tokens, and every request goes through one
+    shared client. A failed request is retried on its own, so the other batches keep
+    their results; a rejected request is split until the offending input is isolated.
+    '''
+
+    embeddings = [None] * len(texts)
+    if not texts:
+        return embeddings
+
+    max_inputs, max_tokens = get_batch_limits()
+
+    inputs = prepare_inputs(logger, texts)
+    batches = pack_batches(inputs, max_inputs, max_tokens)
+
+    logger.info(f"Airflow - services/embeddingClient.py - request_embeddings() - Embedding {len(texts)} inputs in {len(batches)} requests")
+
+    for batch in batches:
+        embed_batch(logger, inputs, batch, model, dimensions, embeddings)
+
+    failed = sum(1 for embedding in embeddings if embedding is None)
+    if failed:
+        logger.warning(f"Airflow - services/embeddingClient.py - request_embeddings() - {failed} of {len(texts)} inputs were not embedded")
+
+    return embeddings
+
+
+# Function to embed texts, sending only inputs that are not already in the embedding cache
+def embed_texts(logger, texts, model=None):
+    '''
+    Return one embedding per text, in the order of `texts` (None where embedding failed).
+
+    Identical texts are embedded once. Unless EMBEDDING_CACHE_ENABLED is false, embeddings
+    are looked up in the shared Postgres cache by (model, EMBEDDING_DIMENSIONS, sha256 of
+    the text) first, and the new ones are stored there for later runs and other users.
+    '''
+
+    embeddings = [None] * len(texts)
+    if not texts:
+        return embeddings
+
+    model = model or os.getenv("EMBEDDING_MODEL")
+    dimensions = get_embedding_dimensions()
+    is_cache_enabled, max_entries = get_cache_settings()
+
+    positions = {}
+    for index, text in enumerate(texts):
+        positions.setdefault(get_input_hash(text), []).append(index)
+
+    cached = fetch_cached_embeddings(logger, model, dimensions, list(positions)) if is_cache_enabled else {}
+
+    missing = [input_hash for input_hash in positions if input_hash not in cached]
+    new_embeddings = request_embeddings(logger, [texts[positions[input_hash][0]] for input_hash in missing], model, dimensions)
+
+    logger.info(f"Airflow - services/embeddingClient.py - embed_texts() - {len(texts)} inputs: {len(positions)} distinct, {len(cached)} from the cache, {len(missing)} requested")
+
+    found = dict(cached)
+    found.update(zip(missing, new_embeddings))
+
+    for input_hash, indexes in positions.items():
+        for index in indexes:
+            embeddings[index] = found.get(input_hash)
+
+    if is_cache_enabled:
+        # Only vectors of the requested size are cached (the Milvus schema uses the same dim)
+        store_embeddings(logger, model, dimensions, {
+            input_hash: embedding
+            for input_hash, embedding in zip(missing, new_embeddings)
+            if embedding is not None and len(embedding) == dimensions
+        }, max_entries)
+
+    return embeddings
@@ -2,11 +2,14 @@ import os
 import json
 import csv
 import boto3
+import hashlib
+from datetime import datetime, timezone
 
 
-from services.extractFileContents import parse_images, parse_csv_files, parse_word_file, parse_txt_files, parse_excel_files, parse_pdf_files
+from services.extractionEngine import extract_contents_in_parallel, shutdown_parse_pool
+from services.extractFileContents import is_extraction_error
 from services.processEmails import save_emails_to_json_file
-from services.vectors import embed_email_attachments
+from services.attachmentBlobs import save_blob_extracted_text, embed_new_blobs
 
 # Function to create directories
 def create_local_directory(logger, directory_path):
@@ -21,8 +24,8 @@ def create_local_directory(logger, directory_path):
 def normalize_path(file_path):
     return os.path.normpath(file_path)
 
-# Function to download attachments from S3
-def download_attachments_from_s3(logger, user_email, email_id, s3_bucket_name):
+# Function to download attachments from S3 (the fallback when contents could not be extracted in memory)
+def download_attachments_from_s3(logger, user_email, email_id, s3_bucket_name, s3_files=None):
     logger.info(f"Downloading attachments for email ID: {email_id} from S3.")
     
     s3_client = boto3.client("s3")
@@ -31,15 +34,21 @@ def download_attachments_from_s3(logger, user_email, email_id, s3_bucket_name):
     base_s3_prefix = f"{user_email}/{email_id}/attachments"
     
     try:
-        response = s3_client.list_objects_v2(Bucket=s3_bucket_name, Prefix=base_s3_prefix)
+        # Only the given {key: path relative to the email's download directory}, or everything under the email's prefix when reprocessing
+        if s3_files is None:
+            response = s3_client.list_objects_v2(Bucket=s3_bucket_name, Prefix=base_s3_prefix)
+            s3_files = {obj["Key"]: obj["Key"][len(base_s3_prefix):].lstrip("/") for obj in response.get("Contents", [])}
         
-        if "Contents" not in response:
+        if not s3_files:
             logger.info(f"No attachments found in S3 for email ID: {email_id}.")
             return
         
-        for obj in response["Contents"]:
-            key = obj["Key"]
-            relative_path = key[len(base_s3_prefix):].lstrip("/")
+        for key, relative_path in s3_files.items():
+
+            # Skip the empty "folder" keys older runs created
+            if key.endswith("/"):
+                continue
+
             local_file_path = os.path.join(base_download_dir, relative_path)
             create_local_directory(logger, os.path.dirname(local_file_path))
             
@@ -54,58 +63,73 @@ def download_attachments_from_s3(logger, user_email, email_id, s3_bucket_name):
         logger.error(f"Failed to download attachments for email ID: {email_id}. Error: {e}")
 
 
-def extract_contents_from_file(logger, file_path):
-    file_extension = os.path.splitext(file_path)[-1].lower()  # Get file extension
-    content = ""
+# Manifest of the files under DOWNLOAD_DIRECTORY that were already extracted and embedded
+MANIFEST_FILE_NAME = ".extraction_manifest.json"
+
+# Function to load the extraction manifest ({relative path: entry}), empty when missing or unreadable
+def load_extraction_manifest(logger, download_dir):
+    manifest_path = os.path.join(download_dir, MANIFEST_FILE_NAME)
 
-    file_extensions = {
-        "PDFs"          : [".pdf"],
-        "Images"        : [".png", ".jpg", ".jpeg"],
-        "Docs"          : [".doc", ".docx"],
-        "TextFiles"     : [".txt"],
-        "SpreadSheets"  : [".xls", ".xlsx"],
-        "CSVFiles"      : ['.csv'],
-    }
+    if not os.path.isfile(manifest_path):
+        return {}
 
     try:
-        if file_extension in file_extensions["PDFs"]:
-            logger.info("Parsing PDF file")
-            content = parse_pdf_files(logger, file_path)
-        
-        elif file_extension in file_extensions["Images"]:
-            logger.info("Parsing Image file")
-            content = parse_images(logger, file_path)
-        
-        elif file_extension in file_extensions["Docs"]:
-            logger.info("Parsing Document file")
-            content = parse_word_file(logger, file_path)
-        
-        elif file_extension in file_extensions["TextFiles"]:
-            logger.info("Parsing Text file")
-            content = parse_txt_files(logger, file_path)
-        
-        elif file_extension in file_extensions["SpreadSheets"]:
-            logger.info("Parsing Spreadsheet file")
-            content = parse_excel_files(logger, file_path)
-        
-        elif file_extension in file_extensions["CSVFiles"]:
-            logger.info("Parsing CSV file")
-            content = parse_csv_files(logger, file_path)
-        
-        else:
-            logger.warning(f"Unsupported file type: {file_extension}")
-            content = f"Unsupported file type: {file_extension}"
-    
+        with open(manifest_path, "r") as manifest_file:
+            return json.load(manifest_file)
     except Exception as e:
-        content = f"Error processing file {file_path}: {str(e)}"
-    
-    return content
+        logger.error(f"Airflow - services/extractAttachments.py - load_extraction_manifest() - Could not read {manifest_path}, every file will be processed again: {e}")
+        return {}
+
+
+# Function to write the extraction manifest atomically (a crash mid-write keeps the previous one)
+def save_extraction_manifest(logger, download_dir, manifest):
+    manifest_path = os.path.join(download_dir, MANIFEST_FILE_NAME)
+    temp_path = manifest_path + ".tmp"
+
+    try:
+        with open(temp_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=4)
+        os.replace(temp_path, manifest_path)
+    except Exception as e:
+        logger.error(f"Airflow - services/extractAttachments.py - save_extraction_manifest() - Error writing {manifest_path}: {e}")
+
+
+# Function to compute the SHA-256 of a file without reading it into memory at once
+def get_file_hash(file_path):
+    sha256 = hashlib.sha256()
+
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            sha256.update(block)
+
+    return sha256.hexdigest()
 
 
-def extract_filepaths_with_attachments(logger, download_dir):
+# Function to check a file against its manifest entry; returns (is_done, entry to keep for the file)
+def check_manifest_entry(file_path, entry):
+    stat = os.stat(file_path)
+    fingerprint = {"size": stat.st_size, "mtime": stat.st_mtime}
+
+    # Same size and mtime: trust the entry without reading the file
+    if entry and entry.get("size") == fingerprint["size"] and entry.get("mtime") == fingerprint["mtime"]:
+        return entry.get("embedding_status") == "embedded", entry
+
+    # Touched or re-downloaded: only a content change makes the file new
+    fingerprint["sha256"] = get_file_hash(file_path)
+    if entry and entry.get("sha256") == fingerprint["sha256"]:
+        return entry.get("embedding_status") == "embedded", {**entry, **fingerprint}
+
+    return False, {**fingerprint, "extraction_status": "pending", "embedding_status": "pending"}
+
+
+def extract_filepaths_with_attachments(logger, download_dir, manifest=None):
+    ''' Extract the files under download_dir; with a manifest, files already embedded are skipped and entries are updated in place '''
+
     logger.info(f"Airflow - services/extractAttachments.py - extract_filepaths_with_attachments() - Extracting files with attachments")
     
     extracted_data = []
+    file_paths = []
+    skipped_files = 0
     # Walk through the base directory
     email_ids = os.listdir(download_dir)
 
@@ -131,29 +155,86 @@ def extract_filepaths_with_attachments(logger, download_dir):
                 
                 if not os.path.isdir(file_types_dir):
                     continue
-                files = os.listdir(file_types_dir)
+
+                # downloads/email_id/mail_id/file_type/attachment_id/filename.ext (older downloads sit directly under file_type)
+                files = [
+                    (os.path.join(root, file), file)
+                    for root, _, names in os.walk(file_types_dir)
+                    for file in names
+                ]
 
                 if files:
-                    for file in files:
-                        # downloads/email_id/mail_id/file_type/filename.ext
-                        file_path = os.path.join(file_types_dir, file)
+                    for file_path, file in files:
+                        relative_path = os.path.relpath(file_path, download_dir)
+
+                        if manifest is not None:
+                            is_done, entry = check_manifest_entry(file_path, manifest.get(relative_path))
+                            manifest[relative_path] = entry
+
+                            if is_done:
+                                skipped_files += 1
+                                continue
                         
-                        logger.info(f"Airflow - services/extractAttachments.py - extract_filepaths_with_attachments() - Processing file: {file_path}")
-                        content = extract_contents_from_file(logger, file_path)
-                        logger.info(f"Extracted contents from {file} is {content}")
+                        logger.info(f"Airflow - services/extractAttachments.py - extract_filepaths_with_attachments() - Queued file: {file_path}")
+                        file_paths.append(file_path)
 
+                        # Downloaded files are blob contents, so their SHA-256 is the blob's content_hash
+                        content_hash = manifest[relative_path].get("sha256") if manifest is not None else None
+
+                        # Contents are filled in below, once every queued file is extracted
                         extracted_data.append({
-                            "email_id"  : email_id,
-                            "email"     : email,
-                            "file_type" : file_type,
-                            "file"      : file,
-                            "content"   : content
+                            "email_id"     : email_id,
+                            "email"        : email,
+                            "file_type"    : file_type,
+                            "file"         : file,
+                            "content"      : None,
+                            "content_hash" : content_hash or get_file_hash(file_path),
+                            "path"         : relative_path
                         })
                 else:
                     continue
             else:
                 continue
-    return extracted_data
+
+    # PDFs and documents on the parse process pool, images on the vision thread pool; results keep the queue order
+    contents = extract_contents_in_parallel(logger, [(file_path, None) for file_path in file_paths])
+
+    extracted_records = []
+
+    for record, content in zip(extracted_data, contents):
+        record["content"] = content
+        logger.info(f"Extracted contents from {record['file']} is {content}")
+
+        # Failed files stay pending in the manifest and are extracted again next run
+        is_extracted = not is_extraction_error(content)
+
+        if is_extracted:
+            # Later copies of the blob reuse the text instead of extracting it again
+            save_blob_extracted_text(logger, record["content_hash"], content)
+            extracted_records.append(record)
+
+        if manifest is not None:
+            manifest[record["path"]]["extraction_status"] = "extracted" if is_extracted else "failed"
+            manifest[record["path"]]["extracted_at"] = datetime.now(timezone.utc).isoformat()
+
+    logger.info(f"Airflow - services/extractAttachments.py - extract_filepaths_with_attachments() - Extracted {len(extracted_records)} of {len(extracted_data)} files, skipped {skipped_files} already embedded")
+    return extracted_records
+
+# Function to delete a downloaded file and the directories it leaves empty (up to download_dir)
+def remove_downloaded_file(logger, download_dir, relative_path):
+    file_path = os.path.join(download_dir, relative_path)
+
+    try:
+        os.remove(file_path)
+
+        directory = os.path.dirname(file_path)
+        while os.path.normpath(directory) != os.path.normpath(download_dir) and not os.listdir(directory):
+            os.rmdir(directory)
+            directory = os.path.dirname(directory)
+
+    except OSError as e:
+        logger.warning(f"Airflow - services/extractAttachments.py - remove_downloaded_file() - Could not delete {file_path}: {e}")
+
 
 def extract_contents_from_attachments(logger):
     logger.info(f"Airflow - services/extractAttachments.py - extract_contents_from_attachments() - Extracting contents from email attachments")
@@ -165,7 +246,36 @@ def extract_contents_from_attachments(logger):
         logger.warning(f"Airflow - services/extractAttachments.py - extract_contents_from_attachments() - No attachments were found so far")
         return
 
-    extracted_data = extract_filepaths_with_attachments(logger, download_dir)
-    
-    save_emails_to_json_file(logger, extracted_data, "extracted_contents.json")
-    embed_email_attachments(filename="extracted_contents.json")
\ No newline at end of file
+    manifest = load_extraction_manifest(logger, download_dir)
+
+    try:
+        extracted_data = extract_filepaths_with_attachments(logger, download_dir, manifest)
+
+        if not extracted_data:
+            logger.info(f"Airflow - services/extractAttachments.py - extract_contents_from_attachments() - No new or changed attachments to extract")
+            return
+
+        save_emails_to_json_file(logger, extracted_data, "extracted_contents.json")
+
+        # Blobs are embedded once per user and marked like the in-memory path does; files whose embedding failed stay pending
+        records_by_user = {}
+        for record in extracted_data:
+            records_by_user.setdefault(record["email_id"], []).append(record)
+
+        for user_email, records in records_by_user.items():
+            embedding_status = "embedded" if embed_new_blobs(logger, user_email, records) else "failed"
+            for record in records:
+                manifest[record["path"]]["embedding_status"] = embedding_status
+
+                # The blob's text and vectors are stored now, so the local copy is no longer needed
+                if embedding_status == "embedded":
+                    remove_downloaded_file(logger, download_dir, record["path"])
+
+    finally:
+        shutdown_parse_pool()
+
+        # Forget files that were deleted from the download directory
+        for relative_path in [path for path in manifest if not os.path.isfile(os.path.join(download_dir, path))]:
+            del manifest[relative_path]
+
+        save_extraction_manifest(logger, download_dir, manifest)
\ No newline at end of file
@@ -1,5 +1,4 @@
 import os
-import csv
 import json
 import base64
 import openai
@@ -9,18 +8,25 @@ from langchain.schema import HumanMessage
 
 from docx import Document
 import mammoth
-from openpyxl import load_workbook
-import fitz
+from services.pdfText import iter_pdf_text
+from services.tabularDigest import iter_csv_rows, iter_excel_sheets, format_rows, build_tabular_digest, get_tabular_mode, get_sample_rows, get_max_rows
 
 # Loading environment variables
 load_dotenv()
 
+# Sub function to read a file's bytes from disk, or from `data` when the contents are already in memory
+def read_file_bytes(file_path, data=None):
+    if data is not None:
+        return data.getvalue()
+
+    with open(file_path, 'rb') as file:
+        return file.read()
+
 # Sub function to convert images to base64
-def encode_image_to_base64(logger, image_path):
+def encode_image_to_base64(logger, image_path, data=None):
     logger.info(f"Ariflow - encode_image_to_base64 - Encoding image to base64")
     try:
-        with open(image_path, 'rb') as img_file:
-            img_base64 = base64.b64encode(img_file.read()).decode('utf-8')
+        img_base64 = base64.b64encode(read_file_bytes(image_path, data)).decode('utf-8')
         logger.info(f"Ariflow - encode_image_to_base64 - Image encoded to base64 successfully")
         return img_base64
     except Exception as e:
@@ -62,7 +68,8 @@ def image_summarize(logger, img_base64, prompt):
             return None
 
 # Function to parse images and extract contents
-def parse_images(logger, image_path):
+# (every parser below takes the file's path, plus a BytesIO `data` when the contents were never written to disk)
+def parse_images(logger, image_path, data=None):
     logger.info(f"Ariflow - parse_images - Generating summaries for images in {image_path}")
     prompt = (
         "You are an assistant tasked with summarizing images for retrieval via RAGs. "
@@ -70,11 +77,11 @@ def parse_images(logger, image_path):
         "Give a concise summary of the image that is well optimized for retrieval via RAGs."
     )
     
-    if os.path.isfile(image_path):
+    if data is not None or os.path.isfile(image_path):
         logger.info(f"Ariflow - parse_images - Processing image")
 
         # Encode image to base64
-        image_base64 = encode_image_to_base64(logger, image_path)
+        image_base64 = encode_image_to_base64(logger, image_path, data)
         if image_base64:
             image_summary = image_summarize(logger, image_base64, prompt)
             logger.info(f"Ariflow - parse_images - Image {image_path} summary: {image_summary}")
@@ -87,18 +94,15 @@ def parse_images(logger, image_path):
             return f"Failed to encode image {image_path}"
 
 # Function to parse CSV files and extract contents
-def parse_csv_files(logger, csv_file_path):
+def parse_csv_files(logger, csv_file_path, data=None):
     logger.info(f"Ariflow - parse_csv_files - Extarcting contents from csv file: {csv_file_path}")
 
-    extracted_contents = ""
-
     try:
-        # Open the CSV file for reading
-        with open(csv_file_path, 'r') as file:
-            csv_reader = csv.reader(file)
-            for row in csv_reader:
-                # Join the row contents and append to the extracted contents
-                extracted_contents += ", ".join(row) + "\n"
+        # Rows are streamed, so only the digest (or the capped rows) is held in memory
+        if get_tabular_mode() == "rows":
+            extracted_contents = format_rows(iter_csv_rows(csv_file_path, data), get_max_rows())
+        else:
+            extracted_contents = build_tabular_digest(f"CSV: {os.path.basename(csv_file_path)}", iter_csv_rows(csv_file_path, data), get_sample_rows())
     except Exception as e:
         logger.error(f"Airflow - parse_csv_files - Error processing CSV file: {e}")
         extracted_contents = f"Error processing CSV file {csv_file_path}: {str(e)}"
@@ -106,19 +110,22 @@ def parse_csv_files(logger, csv_file_path):
     return extracted_contents
 
 # Parsing Word Document files
-def parse_word_file(logger, file_path):
+def parse_word_file(logger, file_path, data=None):
     try:
         file_extension = os.path.splitext(file_path)[-1].lower()
 
         if file_extension == ".docx":
             # Use python-docx for .docx files
-            doc = Document(file_path)
+            doc = Document(data if data is not None else file_path)
             content = "\n".join([para.text for para in doc.paragraphs])
         elif file_extension == ".doc":
             # Use mammoth for .doc files
-            with open(file_path, "rb") as doc_file:
-                result = mammoth.extract_raw_text(doc_file)
-                content = result.value  # Extracted text
+            if data is not None:
+                result = mammoth.extract_raw_text(data)
+            else:
+                with open(file_path, "rb") as doc_file:
+                    result = mammoth.extract_raw_text(doc_file)
+            content = result.value  # Extracted text
         else:
             content = f"Unsupported file type: {file_extension}"
     except Exception as e:
@@ -127,8 +134,11 @@ def parse_word_file(logger, file_path):
     return content
 
 # Parsing txt files
-def parse_txt_files(logger, file_path):
+def parse_txt_files(logger, file_path, data=None):
     try:
+        if data is not None:
+            return data.getvalue().decode("utf-8")
+
         with open(file_path, "r", encoding="utf-8") as txt_file:
             content = txt_file.read()
         return content
@@ -137,28 +147,83 @@ def parse_txt_files(logger, file_path):
     
 
 # Parsing Spreadsheets
-def parse_excel_files(logger, file_path):
+def parse_excel_files(logger, file_path, data=None):
     try:
-        workbook = load_workbook(file_path, data_only=True)
-        content = ""
-        for sheet_name in workbook.sheetnames:
-            sheet = workbook[sheet_name]
-            content += f"Sheet: {sheet_name}\n"
-            for row in sheet.iter_rows(values_only=True):
-                content += ", ".join([str(cell) if cell is not None else "" for cell in row]) + "\n"
-        return content.strip()
+        mode = get_tabular_mode()
+        sections = []
+
+        # Read-only mode streams rows from the file instead of loading the whole workbook
+        for sheet_name, rows in iter_excel_sheets(file_path, data):
+            if mode == "rows":
+                sections.append(f"Sheet: {sheet_name}\n" + format_rows(rows, get_max_rows()))
+            else:
+                sections.append(build_tabular_digest(f"Sheet: {sheet_name}", rows, get_sample_rows()))
+
+        return "\n\n".join(sections).strip()
     except Exception as e:
         return f"Error parsing XLSX file {file_path}: {str(e)}"
 
 
-def parse_pdf_files(logger, file_path):
+def parse_pdf_files(logger, file_path, data=None):
+    try:
+        return "".join(iter_pdf_text(logger, file_path, data)).strip()
+    except Exception as e:
+        return f"Error parsing PDF file {file_path}: {str(e)}"
+
+
+# Prefixes of the messages returned in place of the text when an attachment could not be extracted
+EXTRACTION_ERROR_PREFIXES = ("Error processing", "Error parsing", "Failed to summarize image", "Failed to encode image")
+
+
+# Function to tell whether extracted contents are an extraction failure rather than the attachment's text
+def is_extraction_error(content):
+    return content is None or content.startswith(EXTRACTION_ERROR_PREFIXES)
+
+
+# Function to extract the text of one attachment; `data` (BytesIO) skips reading file_path from disk
+def extract_contents_from_file(logger, file_path, data=None):
+    file_extension = os.path.splitext(file_path)[-1].lower()  # Get file extension
+    content = ""
+
+    file_extensions = {
+        "PDFs"          : [".pdf"],
+        "Images"        : [".png", ".jpg", ".jpeg"],
+        "Docs"          : [".doc", ".docx"],
+        "TextFiles"     : [".txt"],
+        "SpreadSheets"  : [".xls", ".xlsx"],
+        "CSVFiles"      : ['.csv'],
+    }
+
     try:
-        pdf_document = fitz.open(file_path)
-        content = ""
-        for page_num in range(len(pdf_document)):
-            page = pdf_document[page_num]
-            content += page.get_text()
-        pdf_document.close()
-        return content.strip()
+        if file_extension in file_extensions["PDFs"]:
+            logger.info("Parsing PDF file")
+            content = parse_pdf_files(logger, file_path, data)
+        
+        elif file_extension in file_extensions["Images"]:
+            logger.info("Parsing Image file")
+            content = parse_images(logger, file_path, data)
+        
+        elif file_extension in file_extensions["Docs"]:
+            logger.info("Parsing Document file")
+            content = parse_word_file(logger, file_path, data)
+        
+        elif file_extension in file_extensions["TextFiles"]:
+            logger.info("Parsing Text file")
+            content = parse_txt_files(logger, file_path, data)
+        
+        elif file_extension in file_extensions["SpreadSheets"]:
+            logger.info("Parsing Spreadsheet file")
+            content = parse_excel_files(logger, file_path, data)
+        
+        elif file_extension in file_extensions["CSVFiles"]:
+            logger.info("Parsing CSV file")
+            content = parse_csv_files(logger, file_path, data)
+        
+        else:
+            logger.warning(f"Unsupported file type: {file_extension}")
+            content = f"Unsupported file type: {file_extension}"
+    
     except Exception as e:
-        return f"Error parsing PDF file {file_path}: {str(e)}"
\ No newline at end of file
+        content = f"Error processing file {file_path}: {str(e)}"
+    
+    return content
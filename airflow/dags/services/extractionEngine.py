@@ -0,0 +1,112 @@
+import os
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from services.extractFileContents import extract_contents_from_file
+
+# Images are summarized by GPT-4o (waiting on the network); every other format is parsed on the CPU
+IMAGE_EXTENSIONS = frozenset({".png", ".jpg", ".jpeg"})
+
+# Process pool for parsing (ATTACHMENT_PARSE_WORKERS > 1), shared by every extraction of the task
+_parse_pool = None
+_parse_pool_workers = 0
+
+
+# Function to tell whether a file is routed to the image (thread) pool
+def is_image_file(file_path):
+    return os.path.splitext(file_path)[-1].lower() in IMAGE_EXTENSIONS
+
+
+# Function run in the parse pool workers (top-level so it can be pickled)
+def parse_file_in_worker(file_path, data=None):
+    return extract_contents_from_file(logging.getLogger(__name__), file_path, data)
+
+
+# Function to get the process pool used for parsing (created once per task process)
+def get_parse_pool(workers):
+    global _parse_pool, _parse_pool_workers
+
+    if _parse_pool is None or _parse_pool_workers != workers:
+        shutdown_parse_pool()
+
+        # spawn, so workers do not inherit the task's pooled DB connections or HTTP sessions
+        _parse_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        _parse_pool_workers = workers
+
+    return _parse_pool
+
+
+def shutdown_parse_pool():
+    global _parse_pool
+
+    if _parse_pool is not None:
+        _parse_pool.shutdown(wait=True, cancel_futures=True)
+        _parse_pool = None
+
+
+# Function to extract many attachments at once, with a pool per kind of work
+def extract_contents_in_parallel(logger, files):
+    '''
+    Extract the text of `files`, a list of (file_path, data) where data is a BytesIO or None,
+    and return the contents in the same order.
+
+    PDFs, Word documents, spreadsheets, CSV and text go to a process pool of
+    ATTACHMENT_PARSE_WORKERS (serially in this process when 1 or fewer, or for a single file);
+    images go to a thread pool of ATTACHMENT_IMAGE_WORKERS concurrent vision calls.
+    Both pools run at the same time. The process pool is kept for later calls; the task
+    shuts it down with shutdown_parse_pool() once it is done.
+    '''
+
+    contents = [None] * len(files)
+    if not files:
+        return contents
+
+    parse_workers = int(os.getenv("ATTACHMENT_PARSE_WORKERS", str(os.cpu_count() or 1)))
+    image_workers = max(1, int(os.getenv("ATTACHMENT_IMAGE_WORKERS", "4")))
+
+    image_indexes = [index for index, (file_path, _) in enumerate(files) if is_image_file(file_path)]
+    parse_indexes = [index for index, (file_path, _) in enumerate(files) if not is_image_file(file_path)]
+
+    logger.info(f"Airflow - services/extractionEngine.py - extract_contents_in_parallel() - Extracting {len(parse_indexes)} files on up to {parse_workers} processes and {len(image_indexes)} images on up to {image_workers} threads")
+
+    thread_pool = ThreadPoolExecutor(max_workers=image_workers) if image_indexes else None
+    process_pool = get_parse_pool(parse_workers) if parse_workers > 1 and len(parse_indexes) > 1 else None
+    is_pool_broken = False
+    futures = {}
+
+    try:
+        for index in image_indexes:
+            futures[thread_pool.submit(extract_contents_from_file, logger, *files[index])] = index
+
+        for index in parse_indexes:
+            if process_pool:
+                futures[process_pool.submit(parse_file_in_worker, *files[index])] = index
+            else:
+                # Parsed here while the image threads wait on the network
+                contents[index] = extract_contents_from_file(logger, *files[index])
+
+        for future, index in futures.items():
+            try:
+                contents[index] = future.result()
+            except Exception as e:
+                # e.g. a worker killed by a malformed file (BrokenProcessPool)
+                is_pool_broken = is_pool_broken or isinstance(e, BrokenProcessPool)
+                contents[index] = f"Error processing file {files[index][0]}: {str(e)}"
+
+    except BaseException:
+        # Parsing still queued on the shared pool is of no use to anyone
+        for future in futures:
+            future.cancel()
+        raise
+
+    finally:
+        if thread_pool:
+            thread_pool.shutdown(wait=True, cancel_futures=True)
+
+        # A broken pool accepts no more work; the next call starts a new one
+        if is_pool_broken:
+            shutdown_parse_pool()
+
+    return contents
@@ -0,0 +1,106 @@
+import os
+import requests
+
+from services.graphClient import graph_request, get_retry_after, register_throttle
+
+# Microsoft Graph accepts at most 20 sub-requests per JSON batch
+MAX_BATCH_SIZE = 20
+
+# Sub-request statuses that are worth retrying after waiting
+RETRYABLE_STATUS_CODES = {429, 503, 504}
+
+# Function to send a list of requests to Microsoft Graph using JSON batching
+def execute_graph_batch(logger, access_token, batch_requests, mailbox=None, max_attempts=3):
+    """
+    Send requests through the Graph $batch endpoint, 20 sub-requests per HTTP call.
+
+    Each request is a dict with "id", "url" (relative to the API version, e.g.
+    "/me/messages/{id}/attachments") and an optional "method". Throttled
+    sub-requests (429/503/504) pause the shared Graph limiter for their
+    Retry-After and are resent in the next round. Returns a dict of
+    id -> {"status", "headers", "body"}; requests that still fail after
+    max_attempts keep their last error response.
+    """
+    logger.info(f"Airflow - services/graphBatch.py - execute_graph_batch() - Sending {len(batch_requests)} requests via JSON batching")
+
+    batch_endpoint = os.getenv("GRAPH_BATCH_ENDPOINT", "https://graph.microsoft.com/v1.0/$batch")
+
+    headers = {
+        "Content-Type": "application/json",
+    }
+
+    responses = {}
+    pending = [
+        {"id": str(request["id"]), "method": request.get("method", "GET"), "url": request["url"]}
+        for request in batch_requests
+    ]
+
+    attempt = 1
+    while pending and attempt <= max_attempts:
+        retry_requests = []
+        wait_seconds = 0
+
+        for start in range(0, len(pending), MAX_BATCH_SIZE):
+            chunk = pending[start:start + MAX_BATCH_SIZE]
+            chunk_by_id = {request["id"]: request for request in chunk}
+
+            try:
+                # Every sub-request counts against the mailbox limits, so the call costs len(chunk) tokens
+                response = graph_request(
+                    logger, "POST", batch_endpoint, access_token,
+                    mailbox = mailbox,
+                    cost    = len(chunk),
+                    headers = headers,
+                    json    = {"requests": chunk},
+                    timeout = 120
+                )
+
+                # The whole batch can be throttled too
+                if response.status_code in RETRYABLE_STATUS_CODES:
+                    logger.warning(f"Airflow - services/graphBatch.py - execute_graph_batch() - Batch throttled with status {response.status_code}")
+                    retry_requests.extend(chunk)
+                    wait_seconds = max(wait_seconds, get_retry_after(response.headers, 2 ** attempt))
+                    continue
+
+                response.raise_for_status()
+                batch_responses = response.json().get("responses", [])
+
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Airflow - services/graphBatch.py - execute_graph_batch() - Batch request failed: {e}")
+                for request in chunk:
+                    responses[request["id"]] = {"status": None, "headers": {}, "body": {"error": {"message": str(e)}}}
+                continue
+
+            for item in batch_responses:
+                item_id = str(item.get("id"))
+                status = item.get("status")
+
+                if status in RETRYABLE_STATUS_CODES and attempt < max_attempts and item_id in chunk_by_id:
+                    retry_requests.append(chunk_by_id[item_id])
+                    wait_seconds = max(wait_seconds, get_retry_after(item.get("headers"), 2 ** attempt))
+                    continue
+
+                if status is None or status >= 400:
+                    logger.warning(f"Airflow - services/graphBatch.py - execute_graph_batch() - Sub-request {item_id} failed with status {status}")
+
+                responses[item_id] = {
+                    "status"  : status,
+                    "headers" : item.get("headers", {}),
+                    "body"    : item.get("body", {})
+                }
+
+        if retry_requests and attempt < max_attempts:
+            logger.warning(f"Airflow - services/graphBatch.py - execute_graph_batch() - Retrying {len(retry_requests)} throttled requests in {wait_seconds} seconds")
+
+            # The next round blocks on the limiter until Retry-After has passed
+            register_throttle(access_token, mailbox, wait_seconds)
+
+        elif retry_requests:
+            for request in retry_requests:
+                responses.setdefault(request["id"], {"status": 429, "headers": {}, "body": {"error": {"message": "Throttled"}}})
+
+        pending = retry_requests
+        attempt += 1
+
+    logger.info(f"Airflow - services/graphBatch.py - execute_graph_batch() - Received {len(responses)} responses")
+    return responses
@@ -0,0 +1,249 @@
+import os
+import json
+import time
+import base64
+import hashlib
+import threading
+import requests
+
+# Statuses Graph uses to signal throttling or a temporarily unavailable backend
+THROTTLE_STATUS_CODES = {429, 503, 504}
+
+
+class TokenBucket:
+    ''' Thread-safe token bucket that can be paused when Graph asks us to back off '''
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self, cost=1):
+        ''' Block until `cost` tokens are available and return the seconds spent waiting '''
+
+        # A $batch call can cost more than a full bucket; never wait for the impossible
+        cost = min(float(cost), self.capacity)
+        waited = 0.0
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+
+                if now < self.blocked_until:
+                    delay = self.blocked_until - now
+                elif self.tokens >= cost:
+                    self.tokens -= cost
+                    return waited
+                else:
+                    delay = (cost - self.tokens) / self.rate
+
+            time.sleep(delay)
+            waited += delay
+
+    def block_for(self, seconds):
+        ''' Stop handing out tokens for `seconds` (used for Retry-After) '''
+
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+
+# Per-process limiter state, keyed by tenant id and mailbox. Each mapped sync_user task runs in
+# its own process, so the tenant limits are split across the MAX_PARALLEL_USERS processes
+_buckets = {}
+_semaphores = {}
+_state_lock = threading.Lock()
+_session = None
+
+_metrics = {
+    "requests"                  : 0,
+    "throttled_responses"       : 0,
+    "retries"                   : 0,
+    "token_wait_seconds_total"  : 0.0,
+    "token_wait_seconds_max"    : 0.0,
+    "retry_after_seconds_total" : 0.0,
+}
+_metrics_lock = threading.Lock()
+
+
+def get_tenant_process_count():
+    ''' Number of worker processes that call Graph for the same tenant at once (one per mapped sync_user task) '''
+
+    return max(int(os.getenv("MAX_PARALLEL_USERS", "4")), 1)
+
+
+def get_tenant_concurrency():
+    ''' This process's share of GRAPH_TENANT_CONCURRENCY '''
+
+    return max(int(os.getenv("GRAPH_TENANT_CONCURRENCY", "16")) // get_tenant_process_count(), 1)
+
+
+def _get_limiter(scope, key):
+    '''
+    Return the (bucket, semaphore) pair for a tenant or a mailbox.
+
+    The limiters live in this process only. A mailbox is synced by a single task at a time,
+    so its limits apply as configured; the tenant rate, burst and concurrency are divided by
+    MAX_PARALLEL_USERS so the processes together stay within the configured tenant limits.
+    '''
+
+    with _state_lock:
+        if (scope, key) not in _buckets:
+            if scope == "tenant":
+                processes = get_tenant_process_count()
+                rate = float(os.getenv("GRAPH_TENANT_RATE", "50")) / processes
+                burst = max(float(os.getenv("GRAPH_TENANT_BURST", os.getenv("GRAPH_TENANT_RATE", "50"))) / processes, 1.0)
+                concurrency = get_tenant_concurrency()
+            else:
+                rate = float(os.getenv("GRAPH_MAILBOX_RATE", "15"))
+                burst = float(os.getenv("GRAPH_MAILBOX_BURST", str(rate)))
+                concurrency = int(os.getenv("GRAPH_MAILBOX_CONCURRENCY", "4"))
+
+            _buckets[(scope, key)] = TokenBucket(rate=rate, capacity=burst)
+            _semaphores[(scope, key)] = threading.BoundedSemaphore(concurrency)
+
+        return _buckets[(scope, key)], _semaphores[(scope, key)]
+
+
+def _get_session():
+    ''' Share one HTTP session (and its keep-alive connections) across Graph calls '''
+
+    global _session
+
+    with _state_lock:
+        if _session is None:
+            _session = requests.Session()
+
+            # Keep enough pooled connections for every concurrent request the tenant limiter allows
+            pool_size = get_tenant_concurrency()
+            _session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+
+        return _session
+
+
+def _record(**values):
+    with _metrics_lock:
+        for key, value in values.items():
+            if key == "token_wait_seconds_max":
+                _metrics[key] = max(_metrics[key], value)
+            else:
+                _metrics[key] += value
+
+
+def get_token_claims(access_token):
+    ''' Read the claims of a JWT access token without verifying it (only used to key the limiters) '''
+
+    try:
+        payload = access_token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload))
+
+    except Exception:
+        return {}
+
+
+def get_limiter_keys(access_token, mailbox=None):
+    ''' Tenant and mailbox keys for a request, falling back to a token hash for opaque tokens '''
+
+    claims = get_token_claims(access_token)
+    token_hash = hashlib.sha256(str(access_token).encode()).hexdigest()[:16]
+
+    tenant = claims.get("tid") or token_hash
+    mailbox = mailbox or claims.get("oid") or claims.get("upn") or token_hash
+
+    return tenant, mailbox
+
+
+def get_retry_after(headers, default):
+    ''' Read the Retry-After value (in seconds) from a set of headers '''
+
+    try:
+        return max(float((headers or {}).get("Retry-After", default)), 0)
+    except (TypeError, ValueError):
+        return default
+
+
+def register_throttle(access_token, mailbox, seconds):
+    ''' Pause the mailbox (and tenant) buckets after Graph throttled a request or a batch sub-request '''
+
+    tenant, mailbox = get_limiter_keys(access_token, mailbox)
+    tenant_bucket, _ = _get_limiter("tenant", tenant)
+    mailbox_bucket, _ = _get_limiter("mailbox", mailbox)
+
+    mailbox_bucket.block_for(seconds)
+    tenant_bucket.block_for(seconds)
+    _record(throttled_responses=1, retry_after_seconds_total=seconds)
+
+
+def graph_request(logger, method, url, access_token, mailbox=None, cost=1, max_attempts=5, **kwargs):
+    '''
+    Send a request to Microsoft Graph through this process's per-tenant and per-mailbox limiters
+    (the tenant limits are this process's share of the configured ones, see _get_limiter).
+
+    The mailbox defaults to the user the access token belongs to.
+    Waits for a token in both buckets and a free concurrency slot, then retries
+    throttled responses after Retry-After (exponential backoff when it is missing).
+    `cost` is the number of Graph requests the call represents (sub-requests of a $batch).
+    The last response is returned as-is; callers still call raise_for_status().
+    '''
+
+    tenant, mailbox = get_limiter_keys(access_token, mailbox)
+    tenant_bucket, tenant_slots = _get_limiter("tenant", tenant)
+    mailbox_bucket, mailbox_slots = _get_limiter("mailbox", mailbox)
+
+    headers = kwargs.pop("headers", None) or {}
+    headers.setdefault("Authorization", f"Bearer {access_token}")
+    kwargs.setdefault("timeout", 60)
+
+    session = _get_session()
+    response = None
+
+    for attempt in range(1, max_attempts + 1):
+        waited = tenant_bucket.acquire(cost) + mailbox_bucket.acquire(cost)
+        _record(requests=1, token_wait_seconds_total=waited, token_wait_seconds_max=waited)
+
+        with tenant_slots, mailbox_slots:
+            response = session.request(method, url, headers=headers, **kwargs)
+
+        if response.status_code not in THROTTLE_STATUS_CODES:
+            return response
+
+        retry_after = get_retry_after(response.headers, min(2 ** attempt, 60))
+        logger.warning(f"Airflow - services/graphClient.py - graph_request() - Graph returned {response.status_code}, retrying in {retry_after} seconds ({attempt}/{max_attempts})")
+
+        # Back off every caller sharing this mailbox and tenant, not just this one
+        register_throttle(access_token, mailbox, retry_after)
+
+        if attempt < max_attempts:
+            # Release the connection of a discarded response (streamed ones are not read, so it would stay checked out)
+            response.close()
+
+            _record(retries=1)
+            time.sleep(retry_after)
+
+    return response
+
+
+def get_graph_metrics():
+    ''' Snapshot of limiter metrics for this worker process '''
+
+    with _metrics_lock:
+        return dict(_metrics)
+
+
+def log_graph_metrics(logger):
+    metrics = get_graph_metrics()
+    logger.info(
+        "Airflow - services/graphClient.py - log_graph_metrics() - "
+        f"Graph requests: {metrics['requests']}, throttled: {metrics['throttled_responses']}, retries: {metrics['retries']}, "
+        f"token wait total: {metrics['token_wait_seconds_total']:.2f}s, max: {metrics['token_wait_seconds_max']:.2f}s, "
+        f"Retry-After total: {metrics['retry_after_seconds_total']:.2f}s"
+    )
@@ -0,0 +1,195 @@
+import re
+from html.entities import html5
+from bs4 import BeautifulSoup
+from lxml import etree
+from unidecode import unidecode
+
+# Tags whose strings BeautifulSoup's get_text() leaves out (script, stylesheet, template and ruby annotation strings)
+SKIPPED_TAGS = frozenset({"script", "style", "template", "rt", "rp"})
+
+# Tags libxml2 reads as raw text, where html.parser still parses the markup inside them
+RAW_TEXT_TAGS = ("textarea", "xmp", "iframe", "plaintext", "noembed", "noframes", "title")
+
+# Markup the two parsers read differently: CDATA sections and content after </html> or a late
+# DOCTYPE (dropped by libxml2), nested links (closed by libxml2) and entity references unknown
+# to html.parser (which loses the ";")
+CDATA_PATTERN = re.compile(r"<!\[cdata\[", re.IGNORECASE)
+HTML_END_PATTERN = re.compile(r"</html\b[^>]*>", re.IGNORECASE)
+DOCTYPE_PATTERN = re.compile(r"<!doctype", re.IGNORECASE)
+ANCHOR_PATTERN = re.compile(r"<(/?)a[\s/>]", re.IGNORECASE)
+ENTITY_PATTERN = re.compile(r"&([a-zA-Z][a-zA-Z0-9]*);")
+
+# libxml2 is told the encoding explicitly so <meta charset> declarations in the body cannot override it
+_parser = etree.HTMLParser(encoding="utf-8", remove_pis=True, no_network=True)
+
+
+# Function to process email JSON contents and format them
+# (reference implementation; normalize_html() produces the same output and falls back to it)
+def decode_content(content):
+    return unidecode(content)
+
+def clean_text(text):
+    return text.replace('\n', ' ').replace('\r', '').strip()
+
+def extract_text_and_links(html_content):
+    soup = BeautifulSoup(html_content, 'html.parser')
+
+    # Replace <a> tags with their text and link inline (e.g., "Text (URL)")
+    for a_tag in soup.find_all('a', href=True):
+        link_text = a_tag.get_text(strip=True)
+        if a_tag.get('originalsrc', None):
+            href = a_tag['originalsrc']
+        else:
+            href = a_tag['href']
+        a_tag.replace_with(f"{link_text} ({href})")
+
+    # Extract the cleaned text
+    return soup.get_text(separator='\n', strip=True)
+
+
+class ReferenceParserRequired(ValueError):
+    ''' Raised when libxml2 would not read a body the way html.parser does '''
+
+
+# Function to find markup libxml2 reads differently from html.parser before parsing (None when there is none)
+def find_unsupported_markup(html_content):
+    if "\x00" in html_content:
+        return "NUL character"
+
+    if CDATA_PATTERN.search(html_content):
+        return "CDATA section"
+
+    html_end = HTML_END_PATTERN.search(html_content)
+    if html_end and html_content[html_end.end():].strip():
+        return "content after </html>"
+
+    for index, doctype in enumerate(DOCTYPE_PATTERN.finditer(html_content)):
+        if index or html_content[:doctype.start()].strip():
+            return "DOCTYPE after content"
+
+    # html.parser keeps a tag left open at the very end as text
+    if html_content.rfind("<") > html_content.rfind(">"):
+        return "unterminated tag at the end"
+
+    is_link_open = False
+    for anchor in ANCHOR_PATTERN.finditer(html_content):
+        if not anchor.group(1) and is_link_open:
+            return "nested <a> tags"
+        is_link_open = not anchor.group(1)
+
+    # libxml2 closes a link left open at the next table cell, html.parser keeps everything after it inside
+    if is_link_open:
+        return "unclosed <a> tag"
+
+    if "&" in html_content:
+        for name in ENTITY_PATTERN.findall(html_content):
+            if name + ";" not in html5:
+                return f"unknown entity &{name};"
+
+    return None
+
+
+# Function to check that the parsed tree holds the same strings html.parser would see (None when it does)
+def find_tree_divergence(root, error_log):
+    # libxml2 drops stray end tags and misplaced <html>/<head>/<body> tags, merging the
+    # strings html.parser keeps apart on each side
+    for error in error_log:
+        if error.message.startswith(("Unexpected end tag", "htmlParseStartTag: misplaced")):
+            return error.message
+
+    for element in root.iter(*RAW_TEXT_TAGS):
+        if element.text and "<" in element.text:
+            return f"markup inside <{element.tag}>"
+
+    return None
+
+
+# Function to normalize a plain value the same way as clean_text(decode_content(str(value)))
+def normalize_text(value):
+    text = value if isinstance(value, str) else str(value)
+
+    # unidecode is a no-op on ASCII, which is most of what Graph returns
+    if not text.isascii():
+        text = unidecode(text)
+
+    return text.replace('\n', ' ').replace('\r', '').strip()
+
+
+def _iter_strings(element, inline_links=True):
+    ''' Yield the stripped, non-empty strings under element in document order, with <a href> inlined as "Text (URL)" '''
+
+    stack = [element]
+    while stack:
+        node = stack.pop()
+
+        if isinstance(node, str):
+            node = node.strip()
+            if node:
+                yield node
+            continue
+
+        # Tails follow the whole subtree, so they go on the stack first
+        if node is not element and node.tail:
+            stack.append(node.tail)
+
+        tag = node.tag
+
+        # Comments and processing instructions only contribute their tail
+        if not isinstance(tag, str) or tag in SKIPPED_TAGS:
+            continue
+
+        if inline_links and tag == "a" and node is not element and "href" in node.attrib:
+            link_text = "".join(_iter_strings(node, inline_links=False))
+            href = node.get("originalsrc") or node.get("href")
+            stack.append(f"{link_text} ({href})")
+            continue
+
+        stack.extend(reversed(node))
+        if node.text:
+            stack.append(node.text)
+
+
+# Function to convert an HTML body to normalized text in a single pass over an lxml tree
+def normalize_html(html_content):
+    '''
+    Same output as clean_text(decode_content(extract_text_and_links(html_content))),
+    using libxml2 instead of html.parser.
+
+    Raises ReferenceParserRequired for markup libxml2 reads differently (content after
+    </html>, stray end tags between strings, CDATA, markup inside raw-text elements...),
+    and other errors on content libxml2 cannot take (e.g. lone surrogates); see normalize_body().
+    '''
+
+    if not html_content or not html_content.strip():
+        return ""
+
+    reason = find_unsupported_markup(html_content)
+    if reason:
+        raise ReferenceParserRequired(reason)
+
+    root = etree.fromstring(html_content.encode("utf-8"), _parser)
+    if root is None:
+        return ""
+
+    reason = find_tree_divergence(root, _parser.error_log)
+    if reason:
+        raise ReferenceParserRequired(reason)
+
+    return normalize_text("\n".join(_iter_strings(root)))
+
+
+# Function to normalize a Graph message body ({"contentType", "content"})
+def normalize_body(body):
+    ''' Return (text, fallback_error); fallback_error is set when html.parser had to be used '''
+
+    body = body or {}
+    content = body.get("content") or ""
+
+    # Bodies requested as text are already plain; only HTML needs parsing
+    if body.get("contentType", "html").lower() == "text":
+        return normalize_text(content), None
+
+    try:
+        return normalize_html(content), None
+    except Exception as e:
+        return clean_text(decode_content(extract_text_and_links(content))), str(e)
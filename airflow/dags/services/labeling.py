@@ -1,6 +1,5 @@
 import os
 import re
-import json
 import requests
 from dotenv import load_dotenv
 from services.logger import start_logger
@@ -79,37 +78,10 @@ def label_email(email_dict: dict):
     logger.info(f"Airflow - services/labeling.py - label_email() - Categorizing email...")
     
     labels = []
-    reply_to_addresses = ""
-    reply_to_list = None
-    
-    email_addresses = []
     email_dict["body"] = replace_urls(email_dict["body"])
 
-    try:
-        if email_dict['reply_to']:
-            reply_to_list = json.loads(str(email_dict['reply_to']))[0]
-
-            # Loop through the list and parse each emailAddress field
-            if len(reply_to_list) > 1:
-                
-                for item in reply_to_list:
-                    for key, val in item.items():
-                        
-                        contents = json.loads(str(val).replace("'", '"'))
-                        email_addresses.append(contents["address"])
-            else:
-                for key, val in reply_to_list.items():
-                    
-                    contents = json.loads(str(val).replace("'", '"'))
-                    email_addresses.append(contents["address"])
-    
-    except Exception as exception:
-        logger.error(f"Airflow - services/labeling.py - label_email() - An exception occurred when parsing reply_to emails (See exception below)")
-        logger.error(f"Airflow - services/labeling.py - label_email() - {exception}")
-
-
-    if email_addresses:
-        reply_to_addresses = ", ".join(email_addresses)
+    # reply_to is the list of reply-to addresses of the email
+    reply_to_addresses = ", ".join(address for address in email_dict.get("reply_to") or [] if address)
     
     prompt = f"""      
         Your task is to assign specific categories to emails based on their content. 
@@ -0,0 +1,118 @@
+import os
+import fitz
+import multiprocessing
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+
+# PDF text extraction, kept apart from extractFileContents.py so page pool workers only import PyMuPDF
+
+
+# Sub function to open a PDF from disk, or from its bytes when already in memory
+def open_pdf(file_path, pdf_bytes=None):
+    if pdf_bytes is not None:
+        return fitz.open(stream=pdf_bytes, filetype="pdf")
+
+    return fitz.open(file_path)
+
+
+# Function to yield the text of a PDF's pages one at a time (the document is closed with the generator)
+def iter_pdf_pages(file_path, pdf_bytes=None, start=0, stop=None):
+    pdf_document = open_pdf(file_path, pdf_bytes)
+
+    try:
+        stop = len(pdf_document) if stop is None else min(stop, len(pdf_document))
+
+        for page_num in range(start, stop):
+            yield pdf_document[page_num].get_text()
+
+    finally:
+        pdf_document.close()
+
+
+# Sub function run in the page pool workers (top-level so it can be pickled); stops early at max_chars
+def extract_pdf_page_range(file_path, pdf_bytes, start, stop, max_chars):
+    pages = []
+    total_chars = 0
+
+    for text in iter_pdf_pages(file_path, pdf_bytes, start, stop):
+        pages.append(text)
+        total_chars += len(text)
+
+        if total_chars >= max_chars:
+            break
+
+    return pages
+
+
+# Sub function to read page ranges on a process pool, keeping at most `workers` ranges in flight, in page order
+def iter_pdf_page_ranges(file_path, pdf_bytes, ranges, workers, max_chars):
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+    try:
+        pending = deque()
+        remaining = iter(ranges)
+
+        for start, stop in islice(remaining, workers):
+            pending.append(pool.submit(extract_pdf_page_range, file_path, pdf_bytes, start, stop, max_chars))
+
+        while pending:
+            pages = pending.popleft().result()
+
+            # Refill the window before handing out pages, so workers stay busy while the caller consumes them
+            for start, stop in islice(remaining, 1):
+                pending.append(pool.submit(extract_pdf_page_range, file_path, pdf_bytes, start, stop, max_chars))
+
+            yield from pages
+
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+# Function to yield a PDF's text page by page within the PDF_MAX_PAGES / PDF_MAX_TEXT_MB budget
+def iter_pdf_text(logger, file_path, data=None):
+    '''
+    Pages are read lazily. PDFs longer than PDF_PAGES_PER_RANGE are split into page ranges
+    parsed on PDF_PAGE_WORKERS processes (only from the task process, not from inside
+    another pool's worker). A truncation note is yielded last when the budget cuts pages off.
+    '''
+
+    max_pages = int(os.getenv("PDF_MAX_PAGES", "500"))
+    max_chars = int(float(os.getenv("PDF_MAX_TEXT_MB", "10")) * 1024 * 1024)
+    workers = int(os.getenv("PDF_PAGE_WORKERS", "0"))
+    range_size = max(1, int(os.getenv("PDF_PAGES_PER_RANGE", "50")))
+
+    pdf_bytes = data.getvalue() if data is not None else None
+
+    with open_pdf(file_path, pdf_bytes) as pdf_document:
+        page_count = len(pdf_document)
+
+    pages_to_read = min(page_count, max_pages)
+
+    if workers > 1 and pages_to_read > range_size and multiprocessing.parent_process() is None:
+        ranges = [(start, min(start + range_size, pages_to_read)) for start in range(0, pages_to_read, range_size)]
+        logger.info(f"Airflow - parse_pdf_files - Reading {pages_to_read} of {page_count} pages of {file_path} in {len(ranges)} ranges on {workers} processes")
+        pages = iter_pdf_page_ranges(file_path, pdf_bytes, ranges, min(workers, len(ranges)), max_chars)
+    else:
+        pages = iter_pdf_pages(file_path, pdf_bytes, 0, pages_to_read)
+
+    pages_read = 0
+    total_chars = 0
+
+    try:
+        for text in pages:
+            if total_chars + len(text) > max_chars:
+                yield text[:max_chars - total_chars]
+                pages_read += 1
+                break
+
+            yield text
+            pages_read += 1
+            total_chars += len(text)
+
+    finally:
+        pages.close()
+
+    if pages_read < page_count:
+        logger.warning(f"Airflow - parse_pdf_files - {file_path} truncated to {pages_read} of {page_count} pages by the extraction budget")
+        yield f"\n... ({page_count - pages_read} remaining pages truncated) ..."
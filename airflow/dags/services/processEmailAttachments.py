@@ -1,185 +1,373 @@
 import os
 import boto3
-import base64
-import requests
-import time
-from database.connectDB import create_connection_to_postgresql, close_connection
-from services.processEmails import save_emails_to_json_file
+from boto3.s3.transfer import TransferConfig
+from database.connectDB import postgres_connection
 from services.extractAttachments import download_attachments_from_s3
+from services.extractionEngine import extract_contents_in_parallel, shutdown_parse_pool
+from services.extractFileContents import is_extraction_error
+from services.attachmentBlobs import store_attachment_blob, save_blob_extracted_text, embed_new_blobs
+from services.graphBatch import execute_graph_batch, MAX_BATCH_SIZE
+from services.graphClient import graph_request
 
-def fetch_emails_with_attachments(logger):
-    logger.info(f"Airflow - services/processEmailAttachments.py - fetch_emails_with_attachments() - Fetching mails with attachments")
+# Only the metadata is listed; contents are streamed from /attachments/{id}/$value
+ATTACHMENT_FIELDS = "id,name,contentType,size"
 
+# Item (attached email/event) and reference (cloud link) attachments have no file contents to store
+FILE_ATTACHMENT_TYPE = "#microsoft.graph.fileAttachment"
+
+FILE_EXTENSIONS = {
+    "PDFs"          : [".pdf"],
+    "Images"        : [".png", ".jpg", ".jpeg"],
+    "Docs"          : [".doc", ".docx"],
+    "TextFiles"     : [".txt"],
+    "SpreadSheets"  : [".xls", ".xlsx"],
+    "CSVFiles"      : ['.csv'],
+}
+
+# Function to fetch the user's emails whose attachments have not been processed yet
+def fetch_emails_with_attachments(logger, user_email):
+    logger.info(f"Airflow - services/processEmailAttachments.py - fetch_emails_with_attachments() - Fetching mails with pending attachments for {user_email}")
+
+    # Served by the partial index idx_emails_pending_attachments
     query = """
-        SELECT DISTINCT 
-            u.email AS user_email,
-            e.id AS email_id,
-            e.has_attachments
-        FROM emails e
-        JOIN senders s ON s.email_id = e.id
-        JOIN recipients r ON r.email_id = e.id
-        JOIN users u ON (u.email = s.email_address OR u.email = r.email_address)
-        WHERE e.has_attachments = TRUE;
+        SELECT id
+        FROM emails
+        WHERE user_email = %s AND attachments_status = 'pending'
+        ORDER BY received_datetime;
         """
 
-    conn = create_connection_to_postgresql()
-    if conn:
-        
-        try:
-            cursor = conn.cursor()
-            cursor.execute(query)
-            emails_with_attachments = cursor.fetchall()
-            logger.info(f"Airflow - services/processEmailAttachments.py - fetch_emails_with_attachments() - All the emails with attachments fetched successfully")
-            return emails_with_attachments
+    with postgres_connection() as conn:
+        if conn:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(query, (user_email,))
+                    email_ids = [row[0] for row in cursor.fetchall()]
+                    logger.info(f"Airflow - services/processEmailAttachments.py - fetch_emails_with_attachments() - Found {len(email_ids)} mails with pending attachments")
+                    return email_ids
+            
+            except Exception as e:
+                logger.info(f"Airflow - services/processEmailAttachments.py - fetch_emails_with_attachments() - Error fetching emails with attachments: {e}")
+                return []
         
-        except Exception as e:
-            logger.info(f"Airflow - services/processEmailAttachments.py - fetch_emails_with_attachments() - Error fetching emails with attachments: {e}")
+        else:
+            logger.info(f"Airflow - services/processEmailAttachments.py - fetch_emails_with_attachments() - Failed to connect to the database.")
             return []
-        
-        finally:
-            close_connection(conn, cursor)
-            logger.info(f"Airflow - services/processEmailAttachments.py - fetch_emails_with_attachments() - Connection closed successfully")
-    
+
+
+# Function to record the outcome of attachment processing in the emails ledger
+def update_attachments_status(logger, email_ids, processed, max_attempts=3):
+    if not email_ids:
+        return
+
+    # Failed emails stay 'pending' for the next run until they run out of attempts
+    if processed:
+        query = """
+            UPDATE emails
+            SET attachments_status = 'processed'
+            WHERE id = ANY(%s);
+        """
+        params = (list(email_ids),)
     else:
-        logger.info(f"Airflow - services/processEmailAttachments.py - fetch_emails_with_attachments() - Failed to connect to the database. {e}")
-        return []
+        query = """
+            UPDATE emails
+            SET attachments_attempts = attachments_attempts + 1,
+                attachments_status = CASE WHEN attachments_attempts + 1 >= %s THEN 'failed' ELSE 'pending' END
+            WHERE id = ANY(%s);
+        """
+        params = (max_attempts, list(email_ids))
+
+    with postgres_connection() as conn:
+        if conn:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(query, params)
+                    conn.commit()
+                    logger.info(f"Airflow - services/processEmailAttachments.py - update_attachments_status() - Marked {cursor.rowcount} mails as {'processed' if processed else 'failed attempt'}")
+
+            except Exception as e:
+                logger.error(f"Airflow - services/processEmailAttachments.py - update_attachments_status() - Error updating attachments status: {e}")
+                conn.rollback()
+
+        else:
+            logger.info(f"Airflow - services/processEmailAttachments.py - update_attachments_status() - Failed to connect to the database.")
     
 
-def insert_attachment_data(logger, attachment_id, email_id, file_name, content_type, size, s3_url):
-    conn = create_connection_to_postgresql()
+def insert_attachment_data(logger, attachment_id, email_id, file_name, content_type, size, s3_url, content_hash=None):
+    is_inserted = False
 
-    if conn:
-        insert_query = """
-            INSERT INTO attachments (id, email_id, name, content_type, size, bucket_url)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        """
-        cursor = conn.cursor()
-        try:
-            cursor.execute(insert_query, (attachment_id, email_id, file_name, content_type, size, s3_url))
-            conn.commit()
-            logger.info(f"Attachment {file_name} inserted into the database.")
+    with postgres_connection() as conn:
+        if conn:
+            # A retried email can upload an attachment that was already recorded
+            insert_query = """
+                INSERT INTO attachments (id, email_id, name, content_type, size, bucket_url, content_hash)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (id)
+                DO UPDATE SET
+                    name = EXCLUDED.name,
+                    content_type = EXCLUDED.content_type,
+                    size = EXCLUDED.size,
+                    bucket_url = EXCLUDED.bucket_url,
+                    content_hash = EXCLUDED.content_hash
+            """
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(insert_query, (attachment_id, email_id, file_name, content_type, size, s3_url, content_hash))
+                conn.commit()
+                is_inserted = True
+                logger.info(f"Attachment {file_name} inserted into the database.")
+            
+            except Exception as e:
+                logger.error(f"Failed to insert attachment {file_name} into database. Error: {e}")
+                conn.rollback()
         
-        except Exception as e:
-            logger.error(f"Failed to insert attachment {file_name} into database. Error: {e}")
-            conn.rollback()
-        finally:
-            close_connection(conn, cursor)
-    
-    else:
-        logger.info(f"Airflow - services/processEmailAttachments.py - fetch_emails_with_attachments() - Failed to connect to the database. {e}")
+        else:
+            logger.info(f"Airflow - services/processEmailAttachments.py - insert_attachment_data() - Failed to connect to the database.")
 
-def upload_attachments_to_s3(logger, user_email, email_id, s3_bucket_name, access_token):
-    logger.info(f"Processing attachments for email ID: {email_id}")
+    return is_inserted
 
-    # Initialize S3 client
-    s3_client = boto3.client("s3")
+# Function to fetch the attachments of several emails using Graph JSON batching
+def fetch_attachments_for_emails(logger, access_token, email_ids):
+    logger.info(f"Airflow - services/processEmailAttachments.py - fetch_attachments_for_emails() - Fetching attachments for {len(email_ids)} emails")
+
+    batch_requests = [
+        {"id": str(index), "url": f"/me/messages/{email_id}/attachments?$select={ATTACHMENT_FIELDS}"}
+        for index, email_id in enumerate(email_ids)
+    ]
+
+    responses = execute_graph_batch(logger, access_token, batch_requests)
+
+    # email_id -> list of attachments, or None when the sub-request failed
+    attachments_by_email = {}
+    for index, email_id in enumerate(email_ids):
+        response = responses.get(str(index))
+
+        if not response or response["status"] != 200:
+            logger.error(f"Failed to fetch attachments for email ID: {email_id}. Response: {response}")
+            attachments_by_email[email_id] = None
+        else:
+            attachments_by_email[email_id] = response["body"].get("value", [])
+
+    return attachments_by_email
 
-    # Fetch attachments using Microsoft Graph API
-    attachment_url = f"https://graph.microsoft.com/v1.0/me/messages/{email_id}/attachments"
 
-    response = requests.get(
-        attachment_url,
-        headers={"Authorization": f"Bearer {access_token}"},
-        timeout=120,
+# Function to build the S3 transfer settings for streamed attachment uploads
+def get_transfer_config():
+    chunk_size = int(os.getenv("ATTACHMENT_UPLOAD_CHUNK_MB", "8")) * 1024 * 1024
+    concurrency = int(os.getenv("ATTACHMENT_UPLOAD_CONCURRENCY", "4"))
+
+    config = TransferConfig(
+        multipart_threshold = chunk_size,
+        multipart_chunksize = chunk_size,
+        max_concurrency     = concurrency
     )
 
-    if response.status_code != 200:
-        logger.error(f"Failed to fetch attachments for email ID: {email_id}. Response: {response.text}")
-        return
-    
-    save_emails_to_json_file(logger, response.json(), f"{email_id}_attachments")
+    # A non-seekable stream is buffered one part at a time; this caps the parts held in memory
+    # (chunk size x concurrency per attachment). boto3's constructor does not take it.
+    config.max_in_memory_upload_chunks = concurrency
+
+    return config
+
+
+# Function to get the S3 folder (category) an attachment is stored under, None if unsupported
+def get_attachment_category(file_name):
+    for category, extensions in FILE_EXTENSIONS.items():
+        if any(file_name.lower().endswith(ext) for ext in extensions):
+            return category
+
+    return None
+
+
+# Function to open an attachment's raw contents (/attachments/{id}/$value) as a stream
+def open_attachment_stream(logger, access_token, email_id, attachment_id):
+    endpoint = os.getenv("MESSAGES_ENDPOINT", "https://graph.microsoft.com/v1.0/me/messages")
+    url = f"{endpoint}/{email_id}/attachments/{attachment_id}/$value"
+
+    response = graph_request(logger, "GET", url, access_token, stream=True, timeout=300)
+
+    # An error response is never read, so its connection is released before raising
+    if not response.ok:
+        response.close()
+        response.raise_for_status()
+
+    # Undo any Content-Encoding so S3 receives the file bytes
+    response.raw.decode_content = True
+
+    return response
+
+
+# Function to store an email's attachments as content-addressed blobs and extract their contents
+# Extracted records are appended to `extracted_data`; new blobs too large to keep in memory are downloaded for extract_contents_from_attachments()
+def upload_attachments_to_s3(logger, access_token, user_email, email_id, s3_bucket_name, attachments, s3_client=None, transfer_config=None, extracted_data=None):
+    logger.info(f"Processing attachments for email ID: {email_id}")
 
-    # save_emails_to_json_file(logger, response.json(), f"{email_id}_with_attachments.json")
-    attachments = response.json().get("value", [])
     if not attachments:
         logger.info(f"No attachments found for email ID: {email_id}.")
-        return
+        return True
 
-    file_extensions = {
-        "PDFs"          : [".pdf"],
-        "Images"        : [".png", ".jpg", ".jpeg"],
-        "Docs"          : [".doc", ".docx"],
-        "TextFiles"     : [".txt"],
-        "SpreadSheets"  : [".xls", ".xlsx"],
-        "CSVFiles"      : ['.csv'],
-    }
-    
-    # Define base directory structure
-    base_dir = f"{user_email}/{email_id}/attachments"
+    # Initialize S3 client
+    s3_client = s3_client or boto3.client("s3")
+    transfer_config = transfer_config or get_transfer_config()
 
-    # Create subdirectories for categorizing attachment files 
-    subdirectories = {
-        category: os.path.join(base_dir, category) for category in file_extensions.keys()
-    }
+    is_uploaded = True
+    pending_records = []
+    pending_data = []
 
-    # Create subdirectories in S3 if they don't exist
-    for sub_dir in subdirectories.values():
-        s3_client.put_object(Bucket=s3_bucket_name, Key=f"{sub_dir}/")
+    # Large attachments are staged under the email's prefix until their hash is known
+    # (keyed by attachment id, since one email can carry several files with the same name)
+    base_dir = f"{user_email}/{email_id}/attachments"
 
-    # Upload attachments to S3 and insert data into the database
+    # Stream attachments to S3 and insert data into the database
     for attachment in attachments:
         attachment_id = attachment.get("id")
         file_name     = attachment.get("name")
-        content_bytes = attachment.get("contentBytes")
         content_type  = attachment.get("contentType")
-        size          = attachment.get("size")  # Assuming size is in the attachment response
 
-        if not file_name or not content_bytes:
+        if not file_name or attachment.get("@odata.type", FILE_ATTACHMENT_TYPE) != FILE_ATTACHMENT_TYPE:
             continue
 
-        file_contents = base64.b64decode(content_bytes)
-
-        # Save the file locally
-        if not os.path.isdir(os.path.join(os.getcwd(), "tmp")):
-            logger.info(f"creating local directory: {os.path.join(os.getcwd(), 'tmp')}")
-            os.makedirs(os.path.join(os.getcwd(), "tmp"))
-
-        local_file_path = os.path.join(os.getcwd(), f"tmp/{file_name}")  # Use /tmp or a preferred directory
-        logger.info(f"Storing attachments contents into local file: {local_file_path}")
-        
-        with open(local_file_path, "wb") as f:
-            f.write(file_contents)
-        logger.info(f"Files uploaded to  {local_file_path}")
-
         # Determine the target directory based on file type
-        target_dir = None
-        for category, extensions in file_extensions.items():
-            if any(file_name.lower().endswith(ext) for ext in extensions):
-                target_dir = subdirectories.get(category)
-                break
-
-        if not target_dir:
+        category = get_attachment_category(file_name)
+        if not category:
             logger.info(f"Skipping unsupported file type: {file_name}")
             continue
 
         try:
-            s3_key = f"{target_dir}/{file_name}"
-            s3_client.upload_file(local_file_path, s3_bucket_name, s3_key)
+            with open_attachment_stream(logger, access_token, email_id, attachment_id) as response:
+                blob, data = store_attachment_blob(
+                    logger, s3_client, transfer_config, response.raw, s3_bucket_name,
+                    staging_key  = f"{base_dir}/{category}/{attachment_id}/{file_name}",
+                    content_type = content_type
+                )
 
-            # Fetch the S3 URL for the uploaded file
-            s3_url = f"s3://{s3_bucket_name}/{s3_key}"
+            content_hash = blob["sha256"]
+            size = blob["size"]
+            s3_url = blob["bucket_url"]
 
             # Log the upload details
-            logger.info(f"[SUCCESS] Uploaded attachment {file_name} (ID: {attachment_id}) to S3 bucket {s3_bucket_name}.")
+            logger.info(f"[SUCCESS] Stored attachment {file_name} (ID: {attachment_id}) as blob {content_hash} in S3 bucket {s3_bucket_name}.")
             logger.info(f"Attachment Details: ID: {attachment_id}, Name: {file_name}, Content Type: {content_type}, Size: {size} bytes, S3 URL: {s3_url}")
 
             # Insert the attachment details into the database
-            insert_attachment_data(logger, attachment_id, email_id, file_name, content_type, size, s3_url)    
+            if not insert_attachment_data(logger, attachment_id, email_id, file_name, content_type, size, s3_url, content_hash):
+                is_uploaded = False
+
+            # Text is extracted once per blob; copies reuse it
+            content = blob["extracted_text"]
+
+            # Extracted later from disk; the file's SHA-256 is its content_hash, so the text and embedding are still kept per blob
+            # (keyed by attachment id like the staging key, so same-name attachments of one email do not overwrite each other)
+            if content is None and data is None:
+                local_path = os.path.join(category, attachment_id, file_name)
+                download_attachments_from_s3(logger, user_email, email_id, s3_bucket_name, s3_files={s3_url.split("/", 3)[3]: local_path})
+                continue
+
+            record = {
+                "email_id"     : user_email,
+                "email"        : email_id,
+                "file_type"    : category,
+                "file"         : file_name,
+                "content"      : content,
+                "content_hash" : content_hash
+            }
+
+            # The bytes just fetched are handed straight to the extractors below
+            if content is None:
+                pending_records.append(record)
+                pending_data.append(data)
+
+            elif extracted_data is not None:
+                extracted_data.append(record)
 
         except Exception as e:
             logger.error(f"[ERROR] Failed to upload {file_name} for email ID: {email_id}. Error: {e}")
+            is_uploaded = False
 
+    # The email's new blobs are extracted together (documents and images in parallel), then released
+    extracted_records = extract_pending_blobs(logger, pending_records, pending_data)
 
-def process_emails_with_attachments(logger, access_token, s3_bucket_name):
+    # A failed extraction leaves the email pending, so its blobs are extracted again on the next run
+    if len(extracted_records) < len(pending_records):
+        is_uploaded = False
+
+    if extracted_data is not None:
+        extracted_data.extend(extracted_records)
+
+    return is_uploaded
+
+
+# Function to extract the text of newly stored blobs (once per blob) and save it for later copies
+# Returns the records that were extracted; blobs that failed keep no text and are left pending
+def extract_pending_blobs(logger, records, data):
+    first_by_hash = {}
+    for record, contents in zip(records, data):
+        first_by_hash.setdefault(record["content_hash"], (record["file"], contents))
+
+    content_hashes = list(first_by_hash)
+    contents = extract_contents_in_parallel(logger, [first_by_hash[content_hash] for content_hash in content_hashes])
+    text_by_hash = {}
+
+    for content_hash, text in zip(content_hashes, contents):
+        if is_extraction_error(text):
+            logger.error(f"Airflow - services/processEmailAttachments.py - extract_pending_blobs() - Could not extract blob {content_hash} ({first_by_hash[content_hash][0]}): {text}")
+            continue
+
+        save_blob_extracted_text(logger, content_hash, text)
+        text_by_hash[content_hash] = text
+
+    extracted_records = []
+    for record in records:
+        if record["content_hash"] in text_by_hash:
+            record["content"] = text_by_hash[record["content_hash"]]
+            extracted_records.append(record)
+
+    return extracted_records
+
+
+def process_emails_with_attachments(logger, access_token, user_email, s3_bucket_name):
     logger.info(f"Airflow - services/processEmailAttachments.py - process_emails_with_attachments() - Processing mails with attachments")
 
     logger.info(f"Airflow - services/processEmailAttachments.py - process_emails_with_attachments() - Fetching mails with attachments")
-    emails_with_attachments = fetch_emails_with_attachments(logger)
+    email_ids = fetch_emails_with_attachments(logger, user_email)
+
+    # One client and transfer config for the whole run
+    s3_client = boto3.client("s3")
+    transfer_config = get_transfer_config()
+
+    # The parse process pool is started once and reused by every email's extraction
+    try:
+        # Discover attachment metadata one Graph batch (20 emails) at a time
+        for start in range(0, len(email_ids), MAX_BATCH_SIZE):
+            chunk = email_ids[start:start + MAX_BATCH_SIZE]
+            attachments_by_email = fetch_attachments_for_emails(logger, access_token, chunk)
+
+            processed_ids = []
+            failed_ids = []
+            extracted_data = []
 
-    # Process each email's attachments
-    for user_email, email_id, has_attachments in emails_with_attachments:
-        if has_attachments:
-            logger.info(f"Airflow - services/processEmailAttachments.py - process_emails_with_attachments() - Fetching mails with attachments for email - {user_email}, mail-id - {email_id}")
+            for email_id in chunk:
+                attachments = attachments_by_email.get(email_id)
+
+                if attachments is None:
+                    failed_ids.append(email_id)
+                    continue
+
+                logger.info(f"Airflow - services/processEmailAttachments.py - process_emails_with_attachments() - Fetching mails with attachments for email - {user_email}, mail-id - {email_id}")
             
-            upload_attachments_to_s3(logger, user_email, email_id, s3_bucket_name, access_token)
-            download_attachments_from_s3(logger, user_email, email_id, s3_bucket_name)
\ No newline at end of file
+                if upload_attachments_to_s3(logger, access_token, user_email, email_id, s3_bucket_name, attachments, s3_client, transfer_config, extracted_data):
+                    processed_ids.append(email_id)
+                else:
+                    failed_ids.append(email_id)
+
+            # Attachments extracted in memory are embedded here (once per blob and user); only the S3 fallbacks wait for extract_contents_task
+            # When embedding fails, the emails that had extracted attachments stay pending and are embedded again next run
+            if not embed_new_blobs(logger, user_email, extracted_data):
+                unembedded_ids = {record["email"] for record in extracted_data}
+                failed_ids.extend(email_id for email_id in processed_ids if email_id in unembedded_ids)
+                processed_ids = [email_id for email_id in processed_ids if email_id not in unembedded_ids]
+
+            # Checkpoint the ledger per batch so an interrupted run does not redo finished emails
+            update_attachments_status(logger, processed_ids, processed=True)
+            update_attachments_status(logger, failed_ids, processed=False)
+
+    finally:
+        shutdown_parse_pool()
@@ -2,26 +2,52 @@ import requests
 import os
 
 from database.loadtoDB import insert_email_folders
+from services.graphClient import graph_request
 
-# Function to get email folders
-def get_email_folders(logger, access_token):
-    logger.info("Airflow - services/processEmailFolders - get_email_folders() - Inside get_email_folders() function")
+# Function to fetch the user's mail folders from Microsoft Graph API
+# (every page of every level: Graph pages folder lists and only returns top-level folders from /mailFolders)
+def fetch_mail_folders(logger, access_token):
+    logger.info("Airflow - services/processEmailFolders - fetch_mail_folders() - Fetching mail folders from Microsoft Graph API")
 
-    mailfolder_endpoint = os.getenv("MAILFOLDERS_ENDPOINT")
+    mailfolder_endpoint = os.getenv("MAILFOLDERS_ENDPOINT").rstrip("/")
 
     headers = {
         "Authorization": f"Bearer {access_token}",
         "Content-Type": "application/json",
     }
 
-    try:
+    folders = []
+    folder_links = [mailfolder_endpoint]
+
+    while folder_links:
+        current_link = folder_links.pop()
+
+        while current_link:
+            response = graph_request(logger, "GET", current_link, access_token, headers=headers, timeout=60)
+            response.raise_for_status()
+
+            folder_data = response.json()
+
+            for folder in folder_data.get("value", []):
+                folders.append(folder)
+
+                # Subfolders (e.g. Inbox/Projects) are listed from their parent's childFolders
+                if folder.get("childFolderCount"):
+                    folder_links.append(f"{mailfolder_endpoint}/{folder.get('id')}/childFolders")
 
-        response = requests.get(mailfolder_endpoint, headers=headers, timeout=60)
-        response.raise_for_status()
-        logger.info("Airflow - services/processEmailFolders - get_email_folders() - Request successful for fetching email folders")
+            current_link = folder_data.get("@odata.nextLink")
 
-        emailfolders_response = response.json()
-        emailfolders = emailfolders_response.get("value", [])
+    logger.info(f"Airflow - services/processEmailFolders - fetch_mail_folders() - Request successful for fetching {len(folders)} email folders")
+
+    return folders
+
+
+# Function to get email folders
+def get_email_folders(logger, access_token):
+    logger.info("Airflow - services/processEmailFolders - get_email_folders() - Inside get_email_folders() function")
+
+    try:
+        emailfolders = fetch_mail_folders(logger, access_token)
 
         formatted_emaildirs = []
 
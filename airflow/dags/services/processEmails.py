@@ -1,28 +1,68 @@
 import os
+import math
 import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from urllib.parse import quote
 import chardet
 import requests
-from bs4 import BeautifulSoup
-from unidecode import unidecode
 
-from database.loadtoDB import load_email_info_to_db, insert_or_update_email_links
-from database.connectDB import create_connection_to_postgresql, close_connection
+from database.loadtoDB import EMAIL_GRAPH_FIELDS, is_select_fetch_mode, load_email_info_to_db, insert_or_update_email_links, fetch_delta_links, update_delta_link, delete_emails_from_db
+from database.connectDB import postgres_connection
+from services.processEmailFolders import fetch_mail_folders
+from services.vectors import delete_email_vectors
+from services.graphClient import graph_request, log_graph_metrics
+from services.emailRecord import format_email
 
-# Function to fetch all the emails
-def fetch_emails(logger, access_token,  email_id, user_id):
-    logger.info("Airflow - services/processEmails.py - fetch_emails() - Fetching mails from Microsoft Graph API")
+# Process pool for parallel body cleaning (EMAIL_CLEAN_WORKERS > 1)
+_clean_pool = None
+_clean_pool_workers = 0
+
+# Function to build the $select projection and Prefer header for message requests
+def get_graph_fetch_options():
+    # 'select' requests only the properties the loader maps; 'full' requests the whole message resource
+    select_fields = None
+    if is_select_fetch_mode():
+        select_fields = ",".join(EMAIL_GRAPH_FIELDS)
+
+    # 'text' makes Graph strip the HTML server side, at the cost of inline link extraction
+    body_content_type = os.getenv("GRAPH_BODY_CONTENT_TYPE", "html")
+    prefer = f'outlook.body-content-type="{body_content_type}"'
+
+    return select_fields, prefer
+
+
+# Function to append a query option to a Graph URL
+def add_query_option(url, option, value):
+    separator = "&" if "?" in url else "?"
+    return f"{url}{separator}{option}={quote(value, safe=',')}"
+
+
+# Function to fetch emails page by page, following @odata.nextLink
+def fetch_email_pages(logger, access_token,  email_id, user_id):
+    """
+    Yield one Graph page at a time as {"emails", "removed_ids", "checkpoint"}.
+
+    The caller must invoke page["checkpoint"]() once the page is fully processed,
+    so a failed run restarts from the first page that was not loaded.
+    """
+    logger.info("Airflow - services/processEmails.py - fetch_email_pages() - Fetching mails from Microsoft Graph API")
 
     fetch_emails_url = os.getenv("FETCH_EMAILS_ENDPOINT")
+    max_pages = int(os.getenv("FETCH_EMAILS_MAX_PAGES", "2"))
+
+    select_fields, prefer = get_graph_fetch_options()
 
     if "$top=" not in fetch_emails_url:
-        if "?" in fetch_emails_url:
-            fetch_emails_url += "&$top=100"
-        else:
-            fetch_emails_url += "?$top=100"
+        fetch_emails_url = add_query_option(fetch_emails_url, "$top", "100")
+
+    if select_fields and "$select=" not in fetch_emails_url:
+        fetch_emails_url = add_query_option(fetch_emails_url, "$select", select_fields)
             
     headers = {
         "Authorization": f"Bearer {access_token}",
-        "Prefer": 'outlook.body-content-type="html"',
+        "Prefer": prefer,
         "Content-Type": "application/json",
     }
 
@@ -33,134 +73,217 @@ def fetch_emails(logger, access_token,  email_id, user_id):
                     LIMIT 1
                     """
     
-    conn = create_connection_to_postgresql()
-    cursor = conn.cursor()
-    cursor.execute(curr_link_query, (user_id, email_id))
+    with postgres_connection() as conn:
+        if not conn:
+            logger.error("Airflow - services/processEmails.py - fetch_email_pages() - Failed to connect to the database")
+            raise ConnectionError("Failed to connect to the database")
+
+        with conn.cursor() as cursor:
+            cursor.execute(curr_link_query, (user_id, email_id))
+            curr_link = cursor.fetchone()
 
-    curr_link = cursor.fetchone()
-    logger.info(f"Airflow - services/processEmails.py - fetch_emails() - Current link from DB - {curr_link}")
+    logger.info(f"Airflow - services/processEmails.py - fetch_email_pages() - Current link from DB - {curr_link}")
     if curr_link is None:
         current_link = fetch_emails_url
-        logger.info(f"Airflow - services/processEmails.py - fetch_emails() - Fetch emails URL - {current_link}")
+        logger.info(f"Airflow - services/processEmails.py - fetch_email_pages() - Fetch emails URL - {current_link}")
     else:
         current_link = curr_link[0]
-        logger.info(f"Airflow - services/processEmails.py - fetch_emails() - Fetch emails URL - {current_link}")
+        logger.info(f"Airflow - services/processEmails.py - fetch_email_pages() - Fetch emails URL - {current_link}")
 
-    close_connection(conn, cursor)
-
-    all_emails = []  # List to store all emails
-    next_link = None
-    is_current_link_processed = False
+    total_emails = 0
     count = 0
 
     try:
-        while current_link:
-            logger.info(f"Airflow - services/processEmails.py - fetch_emails() - Fetching emails from link: {current_link}")
+        while current_link and count < max_pages:
+            logger.info(f"Airflow - services/processEmails.py - fetch_email_pages() - Fetching emails from link: {current_link}")
 
-            response = requests.get(current_link, headers=headers, timeout=60)
+            response = graph_request(logger, "GET", current_link, access_token, headers=headers, timeout=60)
             response.raise_for_status()
 
             email_data = response.json()
             emails = email_data.get("value", [])
-            all_emails.extend(emails)  
-
             next_link = email_data.get("@odata.nextLink")
-            is_current_link_processed = True  # Mark the current link as processed
             count = count + 1
+            total_emails += len(emails)
 
             email_link_data = {
                 "id": user_id,
                 "email": email_id,
                 "current_link": current_link,
                 "next_link": next_link,
-                "is_current_link_processed": is_current_link_processed
+                "is_current_link_processed": True
             }
 
-            insert_or_update_email_links(logger, email_link_data)
+            logger.info(f"Airflow - services/processEmails.py - fetch_email_pages() - Fetched {len(emails)} emails. Next link: {next_link}")
 
-            logger.info(f"Airflow - services/processEmails.py - fetch_emails() - Processed link: {current_link}")
-            logger.info(f"Airflow - services/processEmails.py - fetch_emails() - Fetched {len(emails)} emails. Next link: {next_link}")
+            # Drop our reference to the raw response before handing the page over
+            del email_data, response
 
-            # If there is no next link, break the loop
-            if not next_link:
-                break
-            else:
-                current_link = next_link
+            yield {
+                "emails"      : emails,
+                "removed_ids" : [],
+                "checkpoint"  : partial(insert_or_update_email_links, logger, email_link_data)
+            }
 
-            if count == 2:
-                break
+            current_link = next_link
 
     except requests.exceptions.RequestException as e:
-        logger.error(f"Airflow - services/processEmails.py - fetch_emails() - Error while fetching emails: {e}")
+        logger.error(f"Airflow - services/processEmails.py - fetch_email_pages() - Error while fetching emails: {e}")
     
-    logger.info(f"Airflow - services/processEmails.py - fetch_emails() - Completed fetching all emails. Total emails: {len(all_emails)}")
-    return all_emails
+    logger.info(f"Airflow - services/processEmails.py - fetch_email_pages() - Completed fetching emails. Total emails: {total_emails}")
+
+
+# Function to fetch only the messages that changed since the last run, using Graph delta queries per folder
+def fetch_email_change_pages(logger, access_token, email_id, user_id):
+    """
+    Yield one delta page at a time as {"emails", "removed_ids", "checkpoint"}.
+
+    The checkpoint stores the folder's nextLink (or the final deltaLink) once the
+    caller has processed the page, so an interrupted round resumes where it stopped.
+    """
+    logger.info("Airflow - services/processEmails.py - fetch_email_change_pages() - Fetching mail changes from Microsoft Graph API delta queries")
 
+    mailfolder_endpoint = os.getenv("MAILFOLDERS_ENDPOINT").rstrip("/")
+    max_pages = int(os.getenv("DELTA_MAX_PAGES", "10"))
 
+    select_fields, prefer = get_graph_fetch_options()
 
-# Function to process email JSON contents and format them
-def decode_content(content):
-    return unidecode(content)
+    headers = {
+        "Authorization": f"Bearer {access_token}",
+        "Prefer": f"{prefer}, odata.maxpagesize=100",
+        "Content-Type": "application/json",
+    }
+
+    delta_links = fetch_delta_links(logger, user_id, email_id)
+    folders = fetch_mail_folders(logger, access_token)
+
+    for folder in folders:
+        folder_id = folder.get("id")
+        
+        # A full delta round of the folder, used when there is no stored link or it expired
+        initial_link = f"{mailfolder_endpoint}/{folder_id}/messages/delta"
+        if select_fields:
+            initial_link = add_query_option(initial_link, "$select", select_fields)
+
+        # Resume from the stored link (deltaLink of the last finished round, or nextLink of an unfinished one)
+        # (stored links already carry the $select of the round that produced them)
+        current_link = delta_links.get(folder_id) or initial_link
+        is_restarted = current_link == initial_link
+        logger.info(f"Airflow - services/processEmails.py - fetch_email_change_pages() - Syncing folder {folder.get('displayName')}")
+
+        count = 0
+        try:
+            while current_link and count < max_pages:
+                response = graph_request(logger, "GET", current_link, access_token, headers=headers, timeout=60)
+
+                # 410 Gone (syncStateNotFound / resyncRequired): the stored sync state expired, start the folder over
+                if response.status_code == 410 and not is_restarted:
+                    logger.warning(f"Airflow - services/processEmails.py - fetch_email_change_pages() - Delta link of folder {folder.get('displayName')} expired, restarting a full delta round")
+                    update_delta_link(logger, user_id, email_id, folder_id, None)
+                    current_link = initial_link
+                    is_restarted = True
+                    continue
+
+                response.raise_for_status()
+
+                delta_data = response.json()
+                count = count + 1
+
+                emails = []
+                removed_ids = []
+                for message in delta_data.get("value", []):
+                    if "@removed" in message:
+                        removed_ids.append(message.get("id"))
+                    else:
+                        emails.append(message)
+
+                next_link = delta_data.get("@odata.nextLink")
+                delta_link = delta_data.get("@odata.deltaLink")
+
+                del delta_data, response
+
+                yield {
+                    "emails"      : emails,
+                    "removed_ids" : removed_ids,
+                    "checkpoint"  : partial(update_delta_link, logger, user_id, email_id, folder_id, next_link or delta_link)
+                }
+
+                if delta_link:
+                    logger.info(f"Airflow - services/processEmails.py - fetch_email_change_pages() - Folder {folder.get('displayName')} is up to date")
+                    break
+
+                current_link = next_link
 
-def clean_text(text):
-    return text.replace('\n', ' ').replace('\r', '').strip()
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Airflow - services/processEmails.py - fetch_email_change_pages() - Error while syncing folder {folder_id}: {e}")
 
-def extract_text_and_links(html_content):
-    soup = BeautifulSoup(html_content, 'html.parser')
+    logger.info(f"Airflow - services/processEmails.py - fetch_email_change_pages() - Completed delta sync")
 
-    # Replace <a> tags with their text and link inline (e.g., "Text (URL)")
-    for a_tag in soup.find_all('a', href=True):
-        link_text = a_tag.get_text(strip=True)
-        if a_tag.get('originalsrc', None):
-            href = a_tag['originalsrc']
-        else:
-            href = a_tag['href']
-        a_tag.replace_with(f"{link_text} ({href})")
 
-    # Extract the cleaned text
-    return soup.get_text(separator='\n', strip=True)
+# Function to delete removed emails from PostgreSQL and Milvus
+def delete_removed_emails(logger, removed_ids, user_email):
+    logger.info(f"Airflow - services/processEmails.py - delete_removed_emails() - Propagating {len(removed_ids)} deletions")
 
+    if not removed_ids:
+        return
 
+    released_hashes, shared_hashes = delete_emails_from_db(logger, removed_ids, user_email)
+    
+    if not delete_email_vectors(user_email=user_email, email_ids=removed_ids, released_hashes=released_hashes, shared_hashes=shared_hashes):
+        logger.warning(f"Airflow - services/processEmails.py - delete_removed_emails() - Failed to delete vectors of removed emails from Milvus")
+
+
+# Function to pick how many messages each pool task carries
+def get_clean_chunksize(message_count, workers):
+    # About four chunks per worker balances uneven bodies against per-task IPC overhead
+    return max(1, min(64, math.ceil(message_count / (workers * 4))))
+
+
+# Function to get the process pool used for body cleaning (created once per task process)
+def get_clean_pool(workers):
+    global _clean_pool, _clean_pool_workers
+
+    if _clean_pool is None or _clean_pool_workers != workers:
+        shutdown_clean_pool()
+
+        # spawn, so workers do not inherit the task's pooled DB connections or HTTP sessions
+        _clean_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        _clean_pool_workers = workers
+
+    return _clean_pool
+
+
+def shutdown_clean_pool():
+    global _clean_pool
+
+    if _clean_pool is not None:
+        _clean_pool.shutdown(wait=True, cancel_futures=True)
+        _clean_pool = None
+
+
+# Function to format a page of Graph messages into EmailRecords
 def process_email_response(logger, emails):
     logger.info(f"Airflow - services/processEmails.py - process_email_response() - Processing mail responses")
 
-    formatted_email_data = []
-
-    logger.info(f"Airflow - services/processEmails.py - process_email_response() - Parsing through each mail")
-    for email in emails:
-        formatted_email = {}
+    workers = int(os.getenv("EMAIL_CLEAN_WORKERS", "0"))
+    min_parallel = int(os.getenv("EMAIL_CLEAN_MIN_PARALLEL_MESSAGES", "200"))
 
-        for key, value in email.items():
-            if key == "body":
-                body_content = value.get("content", "")
-                cleaned_content = extract_text_and_links(body_content)
+    # Pool start-up and pickling cost more than they save on small pages
+    if workers > 1 and len(emails) >= min_parallel:
+        chunksize = get_clean_chunksize(len(emails), workers)
+        logger.info(f"Airflow - services/processEmails.py - process_email_response() - Parsing {len(emails)} mails on {workers} processes (chunksize {chunksize})")
 
-                formatted_email[key] = {
-                    "contentType": value.get("contentType", "unknown"),
-                    "content": clean_text(decode_content(cleaned_content))
-                }
+        # map() yields results in input order
+        results = get_clean_pool(workers).map(format_email, emails, chunksize=chunksize)
+    else:
+        logger.info(f"Airflow - services/processEmails.py - process_email_response() - Parsing through each mail")
+        results = map(format_email, emails)
 
-            elif isinstance(value, dict):
-                # Process nested dictionaries (e.g., sender, from, toRecipients)
-                formatted_email[key] = {
-                    sub_key: clean_text(decode_content(str(sub_value)))
-                    for sub_key, sub_value in value.items()
-                }
-            elif isinstance(value, list):
-                # Process lists (e.g., recipients)
-                formatted_email[key] = [
-                    {
-                        sub_key: clean_text(decode_content(str(sub_value)))
-                        for sub_key, sub_value in item.items()
-                    }
-                    if isinstance(item, dict) else clean_text(decode_content(str(item)))
-                    for item in value
-                ]
-            else:
-                # Process other key-value pairs
-                formatted_email[key] = clean_text(decode_content(str(value)))
-
-        formatted_email_data.append(formatted_email)
+    formatted_email_data = []
+    for record, fallback_error in results:
+        if fallback_error:
+            logger.warning(f"Airflow - services/processEmails.py - process_email_response() - Fell back to html.parser for mail {record.id}: {fallback_error}")
+        formatted_email_data.append(record)
 
     logger.info(f"Airflow - services/processEmails.py - process_email_response() - Data formatted successfully")
     return formatted_email_data
@@ -180,12 +303,33 @@ def save_emails_to_json_file(logger, email_data, file_name):
 def process_emails(logger, access_token, user_email, email_id, user_id):
     logger.info(f"Airflow - services/processEmails.py - process_emails() - Processing emails")
 
-    logger.info(f"Airflow - services/processEmails.py - process_emails() - Fetching emails with access token")
-    mail_responses = fetch_emails(logger, access_token, email_id, user_id)
+    # 'delta' syncs only created, updated and removed messages; 'pages' walks the mailbox via nextLink
+    if os.getenv("EMAIL_SYNC_MODE", "pages") == "delta":
+        pages = fetch_email_change_pages(logger, access_token, email_id, user_id)
+    else:
+        pages = fetch_email_pages(logger, access_token, email_id, user_id)
+
+    # Only ids are remembered across pages; message bodies are released after each page
+    loaded_ids = set()
+
+    # Each page is cleaned, loaded, embedded and checkpointed before the next one is fetched
+    try:
+        for page_number, page in enumerate(pages, start=1):
+            logger.info(f"Airflow - services/processEmails.py - process_emails() - Processing page {page_number} with {len(page['emails'])} emails")
+
+            # A message removed from one folder but already loaded from another in this run was moved; keep it
+            removed_ids = [removed_id for removed_id in page["removed_ids"] if removed_id not in loaded_ids]
+            delete_removed_emails(logger, removed_ids, user_email)
+
+            formatted_mail_responses = process_email_response(logger, page["emails"])
+            load_email_info_to_db(logger, formatted_mail_responses, user_email)
+            loaded_ids.update(email.id for email in formatted_mail_responses)
+
+            page["checkpoint"]()
+            del page, formatted_mail_responses
 
-    logger.info(f"Airflow - services/processEmails.py - process_emails() - Processing mail responses to format contents of emails")
-    formatted_mail_responses = process_email_response(logger, mail_responses)
-    save_emails_to_json_file(logger, formatted_mail_responses, "mail_responses.json")
+    finally:
+        shutdown_clean_pool()
 
-    logger.info(f"Airflow - services/processEmails.py - process_emails() - Loading mail data into PostgreSQL database")
-    load_email_info_to_db(logger, formatted_mail_responses, user_email)
\ No newline at end of file
+    logger.info(f"Airflow - services/processEmails.py - process_emails() - Processed {len(loaded_ids)} emails")
+    log_graph_metrics(logger)
@@ -0,0 +1,249 @@
+import os
+import csv
+import io
+import numpy as np
+from datetime import date, datetime
+from collections import Counter
+from openpyxl import load_workbook
+
+# Values buffered per numeric column before they are folded into the running stats
+NUMERIC_BLOCK_SIZE = 4096
+
+# Distinct values tracked per column; past this, top values are reported as approximate
+MAX_TRACKED_DISTINCT = 10000
+
+# Share of a column's non-empty values that must parse as numbers/dates for that type to be inferred
+TYPE_THRESHOLD = 0.9
+
+
+# Function to read the rows of a CSV file one at a time
+def iter_csv_rows(file_path, data=None):
+    if data is not None:
+        file = io.TextIOWrapper(io.BytesIO(data.getvalue()), encoding="utf-8", errors="replace", newline="")
+    else:
+        file = open(file_path, "r", encoding="utf-8", errors="replace", newline="")
+
+    with file:
+        yield from csv.reader(file)
+
+
+# Function to read a workbook sheet by sheet in read-only (streaming) mode, yielding (sheet name, rows)
+def iter_excel_sheets(file_path, data=None):
+    workbook = load_workbook(data if data is not None else file_path, read_only=True, data_only=True)
+
+    try:
+        for sheet in workbook.worksheets:
+            yield sheet.title, sheet.iter_rows(values_only=True)
+    finally:
+        # Read-only workbooks keep the file open until closed
+        workbook.close()
+
+
+# Function to format one row the way the row-by-row extraction does
+def format_row(row):
+    return ", ".join("" if cell is None else str(cell) for cell in row)
+
+
+# Function to format streamed rows one per line, stopping after `max_rows` (0 means no cap)
+def format_rows(rows, max_rows=0):
+    lines = []
+
+    for index, row in enumerate(rows):
+        if max_rows and index >= max_rows:
+            lines.append(f"... truncated after {max_rows} rows")
+            break
+        lines.append(format_row(row))
+
+    return "\n".join(lines)
+
+
+# Function to parse a cell as a number (CSV cells are strings, spreadsheet cells keep their types)
+def as_number(value):
+    if isinstance(value, bool):
+        return None
+
+    if isinstance(value, (int, float)):
+        return float(value)
+
+    if isinstance(value, str):
+        try:
+            return float(value.replace(",", "").strip())
+        except ValueError:
+            return None
+
+    return None
+
+
+# Function to parse a cell as a date (ISO strings in CSV, datetime cells in spreadsheets)
+def as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+
+    if isinstance(value, date):
+        return value
+
+    if isinstance(value, str) and len(value) >= 8 and value[:1].isdigit():
+        try:
+            return datetime.fromisoformat(value.strip()).date()
+        except ValueError:
+            return None
+
+    return None
+
+
+class ColumnStats:
+    ''' Streaming statistics for one column: type counts, NumPy-folded numeric moments, date range and top values '''
+
+    def __init__(self, name):
+        self.name = name
+        self.values = 0
+        self.missing = 0
+        self.dates = 0
+        self.min_date = None
+        self.max_date = None
+        self.distinct = Counter()
+        self.distinct_capped = False
+
+        # Numeric moments (count, mean, M2) combined block by block (Chan et al.)
+        self.numbers = []
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        if value is None or (isinstance(value, str) and not value.strip()):
+            self.missing += 1
+            return
+
+        self.values += 1
+
+        number = as_number(value)
+        if number is not None:
+            self.numbers.append(number)
+            if len(self.numbers) >= NUMERIC_BLOCK_SIZE:
+                self.flush()
+
+        else:
+            day = as_date(value)
+            if day is not None:
+                self.dates += 1
+                self.min_date = day if self.min_date is None else min(self.min_date, day)
+                self.max_date = day if self.max_date is None else max(self.max_date, day)
+
+        text = str(value).strip()
+        if text in self.distinct or len(self.distinct) < MAX_TRACKED_DISTINCT:
+            self.distinct[text] += 1
+        else:
+            self.distinct_capped = True
+
+    def flush(self):
+        if not self.numbers:
+            return
+
+        block = np.asarray(self.numbers, dtype=np.float64)
+        self.numbers = []
+
+        block = block[np.isfinite(block)]
+        if not block.size:
+            return
+
+        block_count = block.size
+        block_mean = block.mean()
+        block_m2 = np.square(block - block_mean).sum()
+
+        total = self.count + block_count
+        delta = block_mean - self.mean
+        self.mean += delta * block_count / total
+        self.m2 += block_m2 + delta * delta * self.count * block_count / total
+        self.count = total
+
+        self.min = block.min() if self.min is None else min(self.min, block.min())
+        self.max = block.max() if self.max is None else max(self.max, block.max())
+
+    def inferred_type(self):
+        if not self.values:
+            return "empty"
+        if self.count >= TYPE_THRESHOLD * self.values:
+            return "numeric"
+        if self.dates >= TYPE_THRESHOLD * self.values:
+            return "date"
+        return "text"
+
+    def describe(self):
+        self.flush()
+
+        column_type = self.inferred_type()
+        summary = f"- {self.name} ({column_type}): {self.values} values, {self.missing} missing"
+
+        if column_type == "numeric":
+            std = np.sqrt(self.m2 / self.count) if self.count else 0.0
+            summary += f"; min {self.min:g}, max {self.max:g}, mean {self.mean:g}, std {std:g}"
+
+        elif column_type == "date":
+            summary += f"; from {self.min_date.isoformat()} to {self.max_date.isoformat()}"
+
+        elif column_type == "text":
+            distinct = f"{len(self.distinct)}+" if self.distinct_capped else str(len(self.distinct))
+            top_values = ", ".join(f"{text} ({count})" for text, count in self.distinct.most_common(5))
+            summary += f", {distinct} distinct; top: {top_values}"
+
+        return summary
+
+
+# Function to summarize a table streamed row by row: header, inferred column types, per-column stats and sample rows
+def build_tabular_digest(title, rows, sample_rows):
+    header = None
+    columns = []
+    samples = []
+    row_count = 0
+
+    for row in rows:
+        if header is None:
+            # The first non-empty row is taken as the header
+            if not any(cell is not None and str(cell).strip() for cell in row):
+                continue
+            header = ["" if cell is None else str(cell).strip() for cell in row]
+            columns = [ColumnStats(name or f"column_{index + 1}") for index, name in enumerate(header)]
+            continue
+
+        row_count += 1
+
+        # Ragged rows get extra unnamed columns
+        while len(columns) < len(row):
+            columns.append(ColumnStats(f"column_{len(columns) + 1}"))
+
+        for index, column in enumerate(columns):
+            column.add(row[index] if index < len(row) else None)
+
+        if len(samples) < sample_rows:
+            samples.append(format_row(row))
+
+    if header is None:
+        return f"{title}: empty"
+
+    lines = [f"{title} ({row_count} rows x {len(columns)} columns)", "Columns:"]
+    lines.extend(column.describe() for column in columns)
+
+    if samples:
+        lines.append(f"Sample rows (first {len(samples)}):")
+        lines.append(format_row(header))
+        lines.extend(samples)
+
+    return "\n".join(lines)
+
+
+# Function to get how tabular files are turned into text: "digest" (default) or "rows"
+def get_tabular_mode():
+    return os.getenv("TABULAR_EXTRACTION_MODE", "digest").lower()
+
+
+# Function to get the number of sample rows kept in a digest
+def get_sample_rows():
+    return int(os.getenv("TABULAR_SAMPLE_ROWS", "20"))
+
+
+# Function to get the row cap of the "rows" mode (0 means no cap)
+def get_max_rows():
+    return int(os.getenv("TABULAR_MAX_ROWS", "5000"))
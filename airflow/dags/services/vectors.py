@@ -2,9 +2,10 @@ import os
 import re
 import json
 import tiktoken
-from openai import OpenAI
+import threading
 from dotenv import load_dotenv
 from services.logger import start_logger
+from services.embeddingClient import embed_texts, get_embedding_dimensions
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from pymilvus import MilvusClient, CollectionSchema, FieldSchema, DataType
 
@@ -14,43 +15,156 @@ load_dotenv()
 # Start logging
 logger = start_logger()
 
+# Per-process Milvus state: one client (rebuilt after a fork) and the collections known to exist with their index
+_milvus_client = None
+_milvus_pid = None
+_ready_collections = set()
+_milvus_lock = threading.Lock()
+
 def connect_to_Milvus():
-    ''' Connect to Milvus Vector store '''
+    ''' Return this process's Milvus client, connecting (and creating the database) on first use '''
 
-    logger.info("Airflow - MILVUS - connect_to_Milvus() - Connecting to Milvus database...")
-    client = None
-    
-    try:
+    global _milvus_client, _milvus_pid
 
-        temp_client = MilvusClient(
-            uri         = "http://" + os.getenv("MILVUS_HOST") + ':' + os.getenv("MILVUS_PORT"),
-            user        = os.getenv("MILVUS_USER"),
-            password    = os.getenv("MILVUS_PASSWORD"),
-        )
+    with _milvus_lock:
+        if _milvus_client is not None and _milvus_pid == os.getpid():
+            return _milvus_client
+
+        # A client inherited through fork shares the parent's gRPC channel; start over instead
+        _milvus_client = None
+        _ready_collections.clear()
+
+        logger.info("Airflow - MILVUS - connect_to_Milvus() - Connecting to Milvus database...")
         
-        # List all databases
-        existing_dbs = temp_client.list_databases()
+        try:
+
+            temp_client = MilvusClient(
+                uri         = "http://" + os.getenv("MILVUS_HOST") + ':' + os.getenv("MILVUS_PORT"),
+                user        = os.getenv("MILVUS_USER"),
+                password    = os.getenv("MILVUS_PASSWORD"),
+            )
+            
+            # List all databases
+            existing_dbs = temp_client.list_databases()
+            
+            # Create database if it doesn't exist
+            if os.getenv("MILVUS_DATABASE") not in existing_dbs:
+                logger.info("Creating database mailboxIndex...")
+                temp_client.create_database("mailboxIndex")
+
+            temp_client.close()
+
+            _milvus_client = MilvusClient(
+                uri       = "http://" + os.getenv("MILVUS_HOST") + ':' + os.getenv("MILVUS_PORT"),
+                user      = os.getenv("MILVUS_USER"),
+                password  = os.getenv("MILVUS_PASSWORD"),
+                db_name   = os.getenv("MILVUS_DATABASE"),
+                timeout   = None
+            )
+            _milvus_pid = os.getpid()
         
-        # Create database if it doesn't exist
-        if os.getenv("MILVUS_DATABASE") not in existing_dbs:
-            logger.info("Creating database mailboxIndex...")
-            temp_client.create_database("mailboxIndex")
-
-        client = MilvusClient(
-            uri       = "http://" + os.getenv("MILVUS_HOST") + ':' + os.getenv("MILVUS_PORT"),
-            user      = os.getenv("MILVUS_USER"),
-            password  = os.getenv("MILVUS_PASSWORD"),
-            db_name   = os.getenv("MILVUS_DATABASE"),
-            timeout   = None
+        except Exception as exception:
+            logger.error("Airflow - MILVUS - connect_to_Milvus() - Exception occurred when connecting to Milvus database (See exception below)")
+            logger.error(f"Airflow - MILVUS - connect_to_Milvus() - {exception}")
+
+        return _milvus_client
+
+def get_collection_name(user_email, suffix=""):
+    ''' Each user has a collection for emails and one for attachments ("_attachments") '''
+
+    collection_name = str(user_email) + suffix
+    collection_name = collection_name.replace('@', os.getenv("__AT"))
+    collection_name = collection_name.replace('.', os.getenv("__PERIOD"))
+
+    return collection_name
+
+def ensure_collection(conn, collection_name, description):
+    ''' Create the collection and its vector index unless this process already knows they exist '''
+
+    if collection_name in _ready_collections:
+        return
+
+    if not conn.has_collection(collection_name=collection_name):
+        logger.warning(f"Airflow - MILVUS - ensure_collection() - Collection '{collection_name}' does not exist. Creating collection...")
+
+        fields = [
+            FieldSchema(
+                name        = "id", 
+                dtype       = DataType.INT64, 
+                is_primary  = True, 
+                auto_id     = True
+            ),
+            FieldSchema(
+                name    = "embedding", 
+                dtype   = DataType.FLOAT_VECTOR, 
+                dim     = get_embedding_dimensions()
+            ),
+            FieldSchema(
+                name    = "metadata", 
+                dtype   = DataType.JSON
+            ),
+            FieldSchema(
+                name       = "page_content",
+                dtype      = DataType.VARCHAR,
+                max_length = 60000 
+            )
+        ]
+        schema = CollectionSchema(fields=fields, description=description)
+
+        # Create the collection
+        conn.create_collection(collection_name=collection_name, schema=schema)
+        logger.info(f"Airflow - MILVUS - ensure_collection() - Collection '{collection_name}' created successfully.")
+
+    # A collection created by a run that died before indexing still needs its index
+    if not conn.list_indexes(collection_name=collection_name):
+
+        # Index the embeddings for faster retrieval
+        index_params = conn.prepare_index_params()
+        index_params.add_index(
+            field_name  = "embedding",
+            index_type  = "IVF_FLAT", 
+            metric_type = "COSINE", 
+            params      = {"nlist": 1024}
         )
-    
-    except Exception as exception:
-        logger.error("Airflow - MILVUS - connect_to_Milvus() - Exception occurred when connecting to Milvus database (See exception below)")
-        logger.error(f"Airflow - MILVUS - connect_to_Milvus() - {exception}")
+        conn.create_index(collection_name=collection_name, index_params=index_params)
+        logger.info(f"Airflow - MILVUS - ensure_collection() - Added index to embeddings of '{collection_name}' successfully.")
+
+    _ready_collections.add(collection_name)
+
+class InsertBuffer:
+    ''' Collects rows per collection and inserts them in bulk, MILVUS_INSERT_BATCH_SIZE rows per insert '''
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.batch_size = max(1, int(os.getenv("MILVUS_INSERT_BATCH_SIZE", "256")))
+        self.rows = {}
+        self.inserted = {}
+
+    def add(self, collection_name, row):
+        rows = self.rows.setdefault(collection_name, [])
+        rows.append(row)
+
+        if len(rows) >= self.batch_size:
+            self.flush(collection_name)
+
+    def flush(self, collection_name=None):
+        ''' Insert the buffered rows of one collection (or of all of them) '''
+
+        names = [collection_name] if collection_name else list(self.rows)
+
+        for name in names:
+            rows = self.rows.pop(name, [])
+
+            for start in range(0, len(rows), self.batch_size):
+                try:
+                    self.conn.insert(collection_name=name, data=rows[start:start + self.batch_size], timeout=None)
+                except Exception:
+                    # The collection may have been dropped behind this process's back
+                    _ready_collections.discard(name)
+                    raise
+
+                self.inserted[name] = self.inserted.get(name, 0) + len(rows[start:start + self.batch_size])
 
-    finally:
-        return client
-    
 def count_tokens(text):
     '''Counts the tokens in the given text using the specified tokenizer '''
     
@@ -76,152 +190,97 @@ def preprocess_text(text, max_tokens=7000):
     
     return text
 
-def openai_embeddings(content):
-    ''' Convert text to OpenAI embeddings '''
-    logger.info("Airflow - MILVUS - openai_embeddings() - Connecting to OpenAI...")
+def create_embeddings_and_index_batch(documents):
+    ''' Create embeddings for many emails ([(data_to_index, metadata)]) in batched requests and index the vectors; returns one is_indexed per email '''
 
-    embeddings = None
-    client = None
+    logger.info(f"Airflow - MILVUS - create_embeddings_and_index_batch() - Creating embeddings for {len(documents)} emails")
 
-    try:
-        client = OpenAI(
-            api_key      = os.getenv("OPENAI_API_KEY"),
-            project      = os.getenv("PROJECT_ID"),
-            organization = os.getenv("ORGANIZATION_ID")
-        )
-
-        embeddings = client.embeddings.create(
-            input = [content], 
-            model = os.getenv("EMBEDDING_MODEL")
-        ).data[0].embedding
-    
-    except Exception as exception:
-        logger.error("Airflow - MILVUS - openai_embeddings() - Exception occurred when converting content to embeddings (See exception below)")
-        logger.error(f"Airflow - MILVUS - openai_embeddings() - {exception}")
+    is_indexed = [False] * len(documents)
 
-    finally:
-        
-        if client:
-            client.close()
-        
-        return embeddings
-
-def create_embeddings_and_index(data_to_index, metadata):
-    ''' Create embeddings using OpenAI embeddings and index the vectors '''
+    if not documents:
+        return is_indexed
 
-    logger.info("Airflow - MILVUS - create_embeddings_and_index() - Creating embeddings for email content")
-    
-    is_indexed = False
     conn = connect_to_Milvus()
     
     if not conn:
-        logger.error("Airflow - MILVUS - create_embeddings_and_index() - Cannot create embeddings because connection to Milvus failed")
+        logger.error("Airflow - MILVUS - create_embeddings_and_index_batch() - Cannot create embeddings because connection to Milvus failed")
         return is_indexed
-    
-    # Each user will have a separate collection
-    collection_name = str(metadata["user_email"])
-    collection_name = collection_name.replace('@', os.getenv("__AT"))
-    collection_name = collection_name.replace('.', os.getenv("__PERIOD"))
 
     try:
-        # If the collection does not exist, create one
-        if not conn.has_collection(collection_name):
-            logger.warning(f"Airflow - MILVUS - create_embeddings_and_index() - Collection '{collection_name}' does not exist. Creating collection...")
-            
-            fields = [
-                FieldSchema(
-                    name        = "id", 
-                    dtype       = DataType.INT64, 
-                    is_primary  = True, 
-                    auto_id     = True
-                ),
-                FieldSchema(
-                    name    = "embedding", 
-                    dtype   = DataType.FLOAT_VECTOR, 
-                    dim     = 3072
-                ),
-                FieldSchema(
-                    name    = "metadata", 
-                    dtype   = DataType.JSON
-                ),
-                FieldSchema(
-                    name       = "page_content",
-                    dtype      = DataType.VARCHAR,
-                    max_length = 60000 
-                )
-            ]
-            schema = CollectionSchema(fields=fields, description=f"Collection for user {collection_name}")
+        # Each user will have a separate collection
+        collections = {}
+
+        for position, (_, metadata) in enumerate(documents):
+            collections.setdefault(get_collection_name(metadata["user_email"]), []).append(position)
+
+        for collection_name in list(collections):
+            try:
+                ensure_collection(conn, collection_name, description=f"Collection for user {collection_name}")
             
-            # Create the collection
-            conn.create_collection(collection_name=collection_name, schema=schema)
-            logger.info(f"Airflow - MILVUS - create_embeddings_and_index() - Collection '{collection_name}' created successfully.")
-
-            # Index the embeddings for faster retrieval
-            index_params = conn.prepare_index_params()
-            index_params.add_index(
-                field_name  = "embedding",
-                index_type  = "IVF_FLAT", 
-                metric_type = "COSINE", 
-                params      = {"nlist": 1024}
-            )
-            # collection.create_index(field_name="embedding", index_params=index_params)
-            conn.create_index(collection_name=collection_name, index_params=index_params)
-            logger.info(f"Airflow - MILVUS - create_embeddings_and_index() - Added index to embeddings successfully.")
+            except Exception as exception:
+                logger.error("Airflow - MILVUS - create_embeddings_and_index_batch() - Exception occurred when creating collection (See exception below)")
+                logger.error(f"Airflow - MILVUS - create_embeddings_and_index_batch() - {exception}")
 
-        else:
-            logger.warning(f"Airflow - MILVUS - create_embeddings_and_index() - Collection '{collection_name}' already exists.")
-    
-    except Exception as exception:
-        logger.error("Airflow - MILVUS - connect_to_milvus() - Exception occurred when connecting to Milvus database (See exception below)")
-        logger.error(f"Airflow - MILVUS - connect_to_milvus() - {exception}")
+        contents = []
 
-    # Check if token limit is being exceeded
-    data_to_index["body"] = preprocess_text(text=data_to_index["body"], max_tokens=7000)
+        for data_to_index, _ in documents:
+            # Check if token limit is being exceeded
+            data_to_index["body"] = preprocess_text(text=data_to_index["body"], max_tokens=7000)
 
-    # Content to index
-    content = "; ".join([f"{str(key).upper()}: {value}" for key, value in data_to_index.items()])
+            # Content to index
+            contents.append("; ".join([f"{str(key).upper()}: {value}" for key, value in data_to_index.items()]))
 
-    try:
-        embedding = openai_embeddings(content=content)
+        embeddings = embed_texts(logger, contents)
+
+        buffer = InsertBuffer(conn)
+
+        for collection_name, positions in collections.items():
+            # Emails whose embedding failed stay unindexed and are retried on the next run
+            positions = [position for position in positions if embeddings[position] is not None]
+
+            if not positions:
+                continue
+
+            try:
+                for position in positions:
+                    buffer.add(collection_name, {
+                        "embedding"     : embeddings[position],
+                        "metadata"      : documents[position][1],
+                        "page_content"  : contents[position]
+                    })
 
-        vectors = {
-            "embedding"     : embedding,
-            "metadata"      : metadata,
-            "page_content"  : content
-        }
+                buffer.flush(collection_name)
 
-        conn.insert(collection_name=collection_name, data=vectors)
-        is_indexed = True
-        logger.info(f"Airflow - MILVUS - create_embeddings_and_index() - Saved vectors with metadata to {collection_name} successfully.")
+                for position in positions:
+                    is_indexed[position] = True
+
+                logger.info(f"Airflow - MILVUS - create_embeddings_and_index_batch() - Saved {len(positions)} vectors with metadata to {collection_name} successfully.")
+
+            except Exception as exception:
+                logger.error("Airflow - MILVUS - create_embeddings_and_index_batch() - Exception occurred when indexing embeddings (See exception below)")
+                logger.error(f"Airflow - MILVUS - create_embeddings_and_index_batch() - {exception}")
         
     except Exception as exception:
-        logger.error("Airflow - MILVUS - create_embeddings_and_index() - Exception occurred when creating and indexing embeddings (See exception below)")
-        logger.error(f"Airflow - MILVUS - create_embeddings_and_index() - {exception}")
-    
-    finally:
-        conn.close()
+        logger.error("Airflow - MILVUS - create_embeddings_and_index_batch() - Exception occurred when creating and indexing embeddings (See exception below)")
+        logger.error(f"Airflow - MILVUS - create_embeddings_and_index_batch() - {exception}")
 
-        # If needed in future
-        return is_indexed 
+    # If needed in future
+    return is_indexed 
 
-def embed_email_attachments(filename: str):
-    ''' Read the filename for the json file, and create embeddings for email attachments '''
+def embed_attachment_records(data: list):
+    ''' Create embeddings for extracted attachment records ({"email_id": user, "email": mail id, "file_type", "file", "content"}) '''
 
-    logger.info("Airflow - MILVUS - embed_email_attachments() - Creating embeddings for email attachments...")
-    data = []
+    logger.info(f"Airflow - MILVUS - embed_attachment_records() - Creating embeddings for {len(data)} attachments...")
 
-    try:
-        logger.info(f"Airflow - MILVUS - embed_email_attachments() - Reading {filename}")
+    is_embedded = False
 
-        with open(file=filename, mode='r') as file:
-            data = json.load(file)
+    if not data:
+        return is_embedded
 
-        if len(data) == 0:
-            raise ValueError(f"Expected some data in {filename}, but found nothing. Skipping...")
-        
+    try:
         conn = connect_to_Milvus()
         if not conn:
-            logger.error("Airflow - MILVUS - embed_email_attachments() - Cannot create embeddings because connection to Milvus failed")
+            logger.error("Airflow - MILVUS - embed_attachment_records() - Cannot create embeddings because connection to Milvus failed")
             raise ConnectionError()
         
         # LangChain
@@ -231,90 +290,149 @@ def embed_email_attachments(filename: str):
             length_function = len
         )
 
-        # Attachments Collection
-        fields = [
-            FieldSchema(
-                name        = "id", 
-                dtype       = DataType.INT64, 
-                is_primary  = True, 
-                auto_id     = True
-            ),
-            FieldSchema(
-                name    = "embedding", 
-                dtype   = DataType.FLOAT_VECTOR, 
-                dim     = 3072
-            ),
-            FieldSchema(
-                name    = "metadata", 
-                dtype   = DataType.JSON
-            ),
-            FieldSchema(
-                name       = "page_content",
-                dtype      = DataType.VARCHAR,
-                max_length = 60000 
-            )
-        ]
-        
-        logger.info(f"Airflow - MILVUS - embed_email_attachments() - Preparing content for embeddings...")
-        
-        for record in data:
-
-            user_id     = record["email_id"]
-            email_id    = record["email"]
-            file_type   = record["file_type"]
-            file_name   = record["file"]
-            content     = record["content"]
-            
-            collection_name = str(user_id) + "_attachments"
-            collection_name = collection_name.replace('@', os.getenv("__AT"))
-            collection_name = collection_name.replace('.', os.getenv("__PERIOD"))
-
-            if not conn.has_collection(collection_name=collection_name):
-                logger.warning(f"Airflow - MILVUS - embed_email_attachments() - Collection '{collection_name}' does not exist. Creating collection...")
+        logger.info(f"Airflow - MILVUS - embed_attachment_records() - Preparing content for embeddings...")
 
-                schema = CollectionSchema(fields=fields, description=f"Collection for attachments {collection_name}")
-                conn.create_collection(collection_name=collection_name, schema=schema)
+        # Chunk every file first so all chunks are embedded in a few batched requests
+        chunked_records = []
 
-                logger.info(f"Airflow - MILVUS - embed_email_attachments() - Collection '{collection_name}' created successfully.")
+        for record in data:
+            collection_name = get_collection_name(record["email_id"], suffix="_attachments")
+            ensure_collection(conn, collection_name, description=f"Collection for attachments {collection_name}")
 
-                # Index the embeddings for faster retrieval
-                index_params = conn.prepare_index_params()
-                index_params.add_index(
-                    field_name  = "embedding",
-                    index_type  = "IVF_FLAT", 
-                    metric_type = "COSINE", 
-                    params      = {"nlist": 1024}
-                )
+            # Create chunks
+            chunked_records.append((collection_name, record, text_splitter.split_text(record["content"])))
 
-                conn.create_index(collection_name=collection_name, index_params=index_params)
-                logger.info(f"Airflow - MILVUS - embed_email_attachments() - Added index to embeddings successfully.")
+        all_chunks = [chunk for _, _, chunks in chunked_records for chunk in chunks]
+        embeddings = iter(embed_texts(logger, all_chunks))
 
-            # Create chunks and embed them
-            chunks = text_splitter.split_text(content)
+        # Vectors of every file are inserted together, per collection
+        buffer = InsertBuffer(conn)
 
-            logger.info(f"Airflow - MILVUS - embed_email_attachments() - Creating embeddings for file {file_name}")
+        failed_chunks = 0
 
+        for collection_name, record, chunks in chunked_records:
             for idx, chunk in enumerate(chunks):
-                embedding = openai_embeddings(content=chunk)
+                embedding = next(embeddings)
+
+                if not embedding:
+                    failed_chunks += 1
 
-                if embedding:
+                else:
                     metadata = {
-                        "user_id"     : user_id,
-                        "email_id"    : email_id,
-                        "file_type"   : file_type,
-                        "file_name"   : file_name,
+                        "user_id"     : record["email_id"],
+                        "email_id"    : record["email"],
+                        "file_type"   : record["file_type"],
+                        "file_name"   : record["file"],
                         "chunk_index" : idx
                     }
 
-                    vectors = {
+                    if record.get("content_hash"):
+                        metadata["content_hash"] = record["content_hash"]
+
+                    buffer.add(collection_name, {
                         "embedding"     : embedding,
                         "metadata"      : metadata,
                         "page_content"  : chunk
-                    }
+                    })
+
+        buffer.flush()
+
+        for collection_name, count in buffer.inserted.items():
+            logger.info(f"Airflow - MILVUS - embed_attachment_records() - Saved {count} attachment vectors with metadata to {collection_name} successfully.")
+
+        # A file missing some of its chunks is not fully searchable; reporting it as failed gets it embedded again
+        if failed_chunks:
+            raise RuntimeError(f"{failed_chunks} of {len(all_chunks)} chunks could not be embedded")
 
-                    conn.insert(collection_name=collection_name, data=vectors, timeout=None)
-                    logger.info(f"Airflow - MILVUS - embed_email_attachments() - Saved attachment vectors with metadata to {collection_name} successfully.")
+        is_embedded = True
     
     except Exception as exception:
-        logger.error("Airflow - MILVUS - embed_email_attachments() - Exception occurred when embedding email attachments (See exception below)")
-        logger.error(f"Airflow - MILVUS - embed_email_attachments() - {exception}")
+        logger.error("Airflow - MILVUS - embed_attachment_records() - Exception occurred when embedding email attachments (See exception below)")
+        logger.error(f"Airflow - MILVUS - embed_attachment_records() - {exception}")
+
+    return is_embedded
+
+
+def delete_email_vectors(user_email, email_ids, include_attachments=True, released_hashes=(), shared_hashes=()):
+    '''
+    Delete the vectors of emails (and, unless told otherwise, their attachments) from the user's collections.
+
+    A blob's vectors are tagged with the first email it was embedded for: those of `shared_hashes`
+    (still attached to other emails) are kept, those of `released_hashes` are deleted whichever email they carry.
+    '''
+
+    logger.info(f"Airflow - MILVUS - delete_email_vectors() - Deleting vectors for {len(email_ids)} emails")
+
+    is_deleted = False
+
+    if not email_ids:
+        return is_deleted
+
+    conn = connect_to_Milvus()
+
+    if not conn:
+        logger.error("Airflow - MILVUS - delete_email_vectors() - Cannot delete vectors because connection to Milvus failed")
+        return is_deleted
+
+    collection_name = get_collection_name(user_email)
+
+    # Email vectors store the message id as metadata["id"], attachment vectors as metadata["email_id"]
+    id_list = json.dumps(list(email_ids))
+    attachment_expression = f'metadata["email_id"] in {id_list}'
+
+    if shared_hashes:
+        attachment_expression += f' and not (metadata["content_hash"] in {json.dumps(sorted(shared_hashes))})'
+
+    targets = [(collection_name, f'metadata["id"] in {id_list}')]
+
+    if include_attachments:
+        targets.append((collection_name + "_attachments", attachment_expression))
+
+        if released_hashes:
+            targets.append((collection_name + "_attachments", f'metadata["content_hash"] in {json.dumps(sorted(released_hashes))}'))
+
+    try:
+        for name, expression in targets:
+            if name in _ready_collections or conn.has_collection(collection_name=name):
+                conn.delete(collection_name=name, filter=expression)
+                logger.info(f"Airflow - MILVUS - delete_email_vectors() - Deleted vectors from {name}")
+
+        is_deleted = True
+
+    except Exception as exception:
+        logger.error("Airflow - MILVUS - delete_email_vectors() - Exception occurred when deleting vectors (See exception below)")
+        logger.error(f"Airflow - MILVUS - delete_email_vectors() - {exception}")
+
+    return is_deleted
+
+
+def delete_blob_vectors(user_email, content_hashes):
+    ''' Delete the vectors of attachment blobs from the user's attachment collection '''
+
+    logger.info(f"Airflow - MILVUS - delete_blob_vectors() - Deleting vectors for {len(content_hashes)} blobs")
+
+    is_deleted = False
+
+    if not content_hashes:
+        return is_deleted
+
+    conn = connect_to_Milvus()
+
+    if not conn:
+        logger.error("Airflow - MILVUS - delete_blob_vectors() - Cannot delete vectors because connection to Milvus failed")
+        return is_deleted
+
+    collection_name = get_collection_name(user_email, suffix="_attachments")
+
+    try:
+        if collection_name in _ready_collections or conn.has_collection(collection_name=collection_name):
+            conn.delete(collection_name=collection_name, filter=f'metadata["content_hash"] in {json.dumps(sorted(content_hashes))}')
+            logger.info(f"Airflow - MILVUS - delete_blob_vectors() - Deleted vectors from {collection_name}")
+
+        is_deleted = True
+
+    except Exception as exception:
+        logger.error("Airflow - MILVUS - delete_blob_vectors() - Exception occurred when deleting vectors (See exception below)")
+        logger.error(f"Airflow - MILVUS - delete_blob_vectors() - {exception}")
+
+    return is_deleted
@@ -1,3 +1,4 @@
+import ast
 import json
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import SystemMessage, AIMessage, ToolMessage
@@ -79,7 +80,8 @@ def fetch_email_from_postgres(email_id):
                             first_reply_to = reply_to_list[0].get("emailAddress")
                             if first_reply_to:
                                 
-                                first_reply_to_data = eval(first_reply_to)
+                                # Older rows stored emailAddress as a stringified Python dict
+                                first_reply_to_data = first_reply_to if isinstance(first_reply_to, dict) else ast.literal_eval(first_reply_to)
                                 reply_to_name = first_reply_to_data.get("name")
                                 reply_to_address = first_reply_to_data.get("address")
                     
@@ -32,7 +32,7 @@ class EmailRAGAgent:
         self.embeddings = OpenAIEmbeddings(
             model       = os.getenv("EMBEDDING_MODEL"),
             api_key     = os.getenv("OPENAI_API_KEY"),
-            dimensions  = 3072
+            dimensions  = int(os.getenv("EMBEDDING_DIMENSIONS", "3072"))
         )
         
         self.llm = ChatOpenAI(
@@ -50,6 +50,63 @@ llm = ChatOpenAI(
 logger = start_logger()
 
 
+# Emails of a thread with their senders, recipients and attachments (with the blob's extracted text);
+# module level so airflow/benchmarks/explainHotQueries.py can EXPLAIN the exact query
+THREAD_EMAILS_QUERY = """
+    WITH thread_emails AS (
+        SELECT 
+            e.id,
+            e.subject,
+            e.body,
+            e.body_preview,
+            e.sent_datetime,
+            e.received_datetime,
+            e.importance,
+            e.has_attachments,
+            e.conversation_id,
+            json_agg(
+                DISTINCT jsonb_build_object(
+                    'sender_email', s.email_address,
+                    'sender_name', s.name
+                )
+            ) AS senders,
+            json_agg(
+                DISTINCT jsonb_build_object(
+                    'recipient_email', r.email_address,
+                    'recipient_name', r.name,
+                    'type', r.type
+                )
+            ) AS recipients,
+            CASE 
+                WHEN e.has_attachments THEN 
+                    json_agg(
+                        DISTINCT jsonb_build_object(
+                            'name', a.name,
+                            'content_type', a.content_type,
+                            'size', a.size,
+                            'bucket_url', a.bucket_url,
+                            'extracted_text', b.extracted_text
+                        )
+                    ) FILTER (WHERE a.id IS NOT NULL)
+                ELSE '[]'::json
+            END AS attachments
+        FROM 
+            emails e
+            LEFT JOIN senders s ON e.id = s.email_id
+            LEFT JOIN recipients r ON e.id = r.email_id
+            LEFT JOIN attachments a ON e.id = a.email_id
+            LEFT JOIN attachment_blobs b ON a.content_hash = b.sha256
+        WHERE 
+            e.conversation_id = %(conversation_id)s
+        GROUP BY 
+            e.id
+    )
+    SELECT *
+    FROM thread_emails
+    ORDER BY sent_datetime ASC NULLS LAST;
+"""
+
+
 class ThreadAnalyzer:
     """ Analyze email threads and attempt to generate summary """
     
@@ -74,6 +131,10 @@ class ThreadAnalyzer:
         """Extract and process content from attachment based on its type."""
         
         try:
+            # Text already extracted by the pipeline for this blob
+            if attachment.get('extracted_text'):
+                return attachment['extracted_text']
+
             if not attachment.get('bucket_url'):
                 return None
 
@@ -153,59 +214,7 @@ class ThreadAnalyzer:
         
         try:
             with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                query = """
-                    WITH thread_emails AS (
-                        SELECT 
-                            e.id,
-                            e.subject,
-                            e.body,
-                            e.body_preview,
-                            e.sent_datetime,
-                            e.received_datetime,
-                            e.importance,
-                            e.has_attachments,
-                            e.conversation_id,
-                            json_agg(
-                                DISTINCT jsonb_build_object(
-                                    'sender_email', s.email_address,
-                                    'sender_name', s.name
-                                )
-                            ) AS senders,
-                            json_agg(
-                                DISTINCT jsonb_build_object(
-                                    'recipient_email', r.email_address,
-                                    'recipient_name', r.name,
-                                    'type', r.type
-                                )
-                            ) AS recipients,
-                            CASE 
-                                WHEN e.has_attachments THEN 
-                                    json_agg(
-                                        DISTINCT jsonb_build_object(
-                                            'name', a.name,
-                                            'content_type', a.content_type,
-                                            'size', a.size,
-                                            'bucket_url', a.bucket_url
-                                        )
-                                    ) FILTER (WHERE a.id IS NOT NULL)
-                                ELSE '[]'::json
-                            END AS attachments
-                        FROM 
-                            emails e
-                            LEFT JOIN senders s ON e.id = s.email_id
-                            LEFT JOIN recipients r ON e.id = r.email_id
-                            LEFT JOIN attachments a ON e.id = a.email_id
-                        WHERE 
-                            e.conversation_id = %s
-                        GROUP BY 
-                            e.id
-                    )
-                    SELECT *
-                    FROM thread_emails
-                    ORDER BY sent_datetime ASC NULLS LAST;
-                """
-                
-                cursor.execute(query, (conversation_id,))
+                cursor.execute(THREAD_EMAILS_QUERY, {"conversation_id": conversation_id})
                 thread_emails = cursor.fetchall()
                 logger.info(f"Found {len(thread_emails)} emails in thread")
         
@@ -286,11 +295,16 @@ class ThreadAnalyzer:
         """Summarize thread with token counting and limiting."""
         try:
             attachment_contents = []
+            seen_attachments = set()
 
-            # Process attachments
+            # Process attachments (a file forwarded through the thread is the same blob, so it is read once)
             for email in thread_emails:
                 if email['has_attachments'] and email['attachments']:
                     for attachment in email['attachments']:
+                        if attachment.get('bucket_url') in seen_attachments:
+                            continue
+                        seen_attachments.add(attachment.get('bucket_url'))
+
                         content = self.process_attachment_content(attachment)
                         if content:
                             attachment_contents.append({
@@ -84,31 +84,32 @@ def parse_images(logger, image_path):
         else:
             return f"Failed to encode image {image_path}"
 
+def iter_pdf_pages(file_path: str, page_limit: int):
+    """Yield the text of the first page_limit pages one at a time (the document is closed with the generator)."""
+    pdf_document = fitz.open(file_path)
+    try:
+        for page_num in range(min(page_limit, len(pdf_document))):
+            yield f"\n--- Page {page_num + 1} ---\n" + pdf_document[page_num].get_text()
+
+        if len(pdf_document) > page_limit:
+            yield f"\n... ({len(pdf_document) - page_limit} remaining pages truncated) ..."
+    finally:
+        pdf_document.close()
+
 def parse_pdf_files(logger, file_path: str, page_limit: int = 5) -> str:
     """Process PDF files with page limit."""
     try:
-        pdf_document = fitz.open(file_path)
-        content = ""
-        pages_to_process = min(page_limit, len(pdf_document))
-        
-        for page_num in range(pages_to_process):
-            page = pdf_document[page_num]
-            content += f"\n--- Page {page_num + 1} ---\n"
-            content += page.get_text()
-        
-        if len(pdf_document) > pages_to_process:
-            content += f"\n... ({len(pdf_document) - page_limit} remaining pages truncated) ..."
-            
-        pdf_document.close()
-        return content.strip()
+        return "".join(iter_pdf_pages(file_path, page_limit)).strip()
     except Exception as e:
         logger.error(f"Error parsing PDF file {file_path}: {str(e)}")
         return f"Error parsing PDF file {file_path}: {str(e)}"
 
 def parse_excel_files(logger, file_path: str) -> str:
     """Process Excel files with row limit."""
+    workbook = None
     try:
-        workbook = load_workbook(file_path, data_only=True)
+        # Read-only mode streams rows, so the truncated sheets are never loaded
+        workbook = load_workbook(file_path, read_only=True, data_only=True)
         content = ""
         sheets_processed = 0
         rows_per_sheet = 100
@@ -137,6 +138,9 @@ def parse_excel_files(logger, file_path: str) -> str:
     except Exception as e:
         logger.error(f"Error parsing XLSX file {file_path}: {str(e)}")
         return f"Error parsing XLSX file {file_path}: {str(e)}"
+    finally:
+        if workbook is not None:
+            workbook.close()
 
 def parse_word_file(logger, file_path: str) -> str:
     """Process Word documents."""
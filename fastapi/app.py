@@ -1,16 +1,45 @@
 import uvicorn
 from routes import auth, extras
 from fastapi import FastAPI
+from utils.logs import start_logger
+from contextlib import asynccontextmanager
 from utils.variables import load_env_vars
+from database.migrations import run_migrations
 from fastapi.middleware.cors import CORSMiddleware
+from database.connection import open_connection, close_connection
 
 # Check if the env file is present before loading the application
 env = load_env_vars()
 
+# Logging
+logger = start_logger()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    ''' Apply pending schema migrations before serving requests (shared with the Airflow pipeline) '''
+
+    conn = open_connection()
+
+    if conn:
+        try:
+            run_migrations(logger, conn)
+        
+        except Exception as exception:
+            logger.error(f"APP - lifespan() - Failed to apply schema migrations: {exception}")
+        
+        finally:
+            close_connection(conn)
+    
+    else:
+        logger.error("APP - lifespan() - Could not connect to PostgreSQL database to apply schema migrations")
+
+    yield
+
 # Initialize the app
 app = FastAPI(
-    debug = env["APP_DEBUG"],
-    title = env["APP_TITLE"]
+    debug    = env["APP_DEBUG"],
+    title    = env["APP_TITLE"],
+    lifespan = lifespan
 )
 
 # Allow CORS
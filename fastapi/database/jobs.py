@@ -32,9 +32,13 @@ def add_to_queued_jobs(email:str) -> bool:
                 logger.info(f"DATABASE/JOBS - add_to_queued_jobs() - Preparing SQL query to queued jobs...")
 
                 # Upon successful insert, the 'id' and 'created_at' will be returned
+                # An email has one job; a leftover one is reused (and left alone while Airflow holds it)
                 query = """
                     INSERT INTO queued_jobs (email, status)
                     VALUES (%s, %s)
+                    ON CONFLICT (email)
+                    DO UPDATE SET
+                        status = CASE WHEN queued_jobs.status = 'in_progress' THEN queued_jobs.status ELSE EXCLUDED.status END
                     RETURNING id, created_at;
                 """
                 logger.info(f"DATABASE/JOBS - add_to_queued_jobs() - Inserting record to queued jobs...")
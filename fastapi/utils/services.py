@@ -7,6 +7,7 @@ from utils.variables import load_env_vars
 from database.connection import open_connection, close_connection
 
 import requests
+import time
 import os
 
 env = load_env_vars()
@@ -291,6 +292,28 @@ def get_access_token(user_email):
     finally:
         close_connection(conn=conn)
 
+# Function to POST to Microsoft Graph, waiting out throttling
+def post_to_graph(url, headers, payload, max_attempts=3, timeout=30):
+    ''' POST to Microsoft Graph and retry 429 responses after their Retry-After '''
+
+    # Only 429 is retried: Graph guarantees throttled requests were not processed,
+    # whereas a 5xx on sendMail may already have delivered the message
+    for attempt in range(1, max_attempts + 1):
+        response = requests.post(url, headers=headers, json=payload, timeout=timeout)
+
+        if response.status_code != status.HTTP_429_TOO_MANY_REQUESTS or attempt == max_attempts:
+            return response
+
+        try:
+            retry_after = float(response.headers.get("Retry-After", 2 ** attempt))
+        except ValueError:
+            retry_after = 2 ** attempt
+
+        logger.warning(f"UTILS/EMAILS - post_to_graph() - Throttled by Microsoft Graph, retrying in {retry_after} seconds ({attempt}/{max_attempts})")
+        time.sleep(retry_after)
+
+    return response
+
 # Function to send an email
 def send_mail_response(user_email, response_output):
     logger.info(f"UTILS/EMAILS - send_mail_response() - Sending mail response generated by response_agent")
@@ -335,10 +358,10 @@ def send_mail_response(user_email, response_output):
             send_mail_endpoint = os.getenv("SEND_EMAILS_ENDPOINT")
 
             # Post request to send an email
-            response = requests.post(
+            response = post_to_graph(
                 send_mail_endpoint,
                 headers=headers,
-                json=email_body,
+                payload=email_body,
                 timeout=30
             )
 